@@ -14,13 +14,30 @@ pyglet.options['debug_gl'] = False
 
 import engine
 from engine import gamestate, util
-from engine import gamehandler, eventmanager
+from engine.util import tracing
+from engine import gamehandler, eventmanager, glyphcache, mixer, perfhud, scheduler, replay, sound
+
+# Events that can change what is on screen, so the scheduler must stop idling
+wake_events = frozenset(['on_mouse_press', 'on_mouse_release', 'on_mouse_drag', 
+                         'on_mouse_motion', 'on_mouse_scroll', 'on_key_press', 
+                         'on_key_release', 'on_text', 'on_resize', 'on_expose', 'on_activate'])
 
 class AdventureWindow(pyglet.window.Window):
     """
     Basic customizations to Window, plus configuration.
     """
-    def __init__(self, reset_save=False, reset_at_scene=None):
+    scheduler = None
+    perf_hud = None
+    recorder = None
+    replayer = None
+    
+    def __init__(self, reset_save=False, reset_at_scene=None, record_path=None, replayer=None):
+        if util.settings.perf_hud_key:
+            perfhud.install_trackers()  # Before any textures or sprites exist
+        if util.settings.trace_at_start:
+            tracing.start()
+        if replayer:
+            reset_at_scene = replayer.first_scene
         reset_save = reset_save or reset_at_scene
         if util.settings.fullscreen:
             super(AdventureWindow,self).__init__(fullscreen=True, vsync=True)
@@ -33,6 +50,10 @@ class AdventureWindow(pyglet.window.Window):
         gamestate.init_scale()          # Set up scaling transformations to have
                                         #   a consistent window size
         gamestate.event_manager = eventmanager.EventManager()
+        self.record_path = record_path
+        self.replayer = replayer
+        sim_rate = replayer.sim_rate if replayer else None
+        gamestate.scheduler = self.scheduler = scheduler.Scheduler(sim_rate=sim_rate)
         
         pyglet.gl.glEnable(pyglet.gl.GL_BLEND)
         pyglet.gl.glBlendFunc(pyglet.gl.GL_SRC_ALPHA, pyglet.gl.GL_ONE_MINUS_SRC_ALPHA)
@@ -41,6 +62,8 @@ class AdventureWindow(pyglet.window.Window):
         self.game_handler = None
         
         engine.init()                   # Set up resource paths
+        if util.settings.software_mixer:
+            mixer.start()               # Before anything makes a player
         
         self.init_load()
 
@@ -86,20 +109,46 @@ class AdventureWindow(pyglet.window.Window):
     
     def finish_loading(self, dt=0):
         self.preload()
+        if self.replayer:
+            replay.seed_rng(self.replayer.seed)
+        elif self.record_path:
+            seed = replay.new_seed()
+            replay.seed_rng(seed)
         self.game_handler = gamehandler.GameHandler(**self.game_info)
+        self.perf_hud = perfhud.PerfHUD(self.game_handler)
+        
+        if self.replayer:
+            # No real-time ticking: each frame steps once and draws once, as fast as possible
+            self.scheduler.schedule_sim(self.game_handler.update)
+            self.scheduler.schedule_render(self.game_handler.draw)
+            self.scheduler.schedule_render(self.perf_hud.draw)
+            self.replayer.start(self.scheduler)
+            pyglet.clock.schedule(self.replay_frame)
+            return
+        if self.record_path:
+            self.recorder = replay.Recorder(self.record_path, self.game_info['first_scene'],
+                                            self.scheduler, seed)
         
-        # Schedule drawing and update functions.
-        # Draw really only needs 60 FPS, update can be faster.
-        pyglet.clock.schedule_interval(self.on_draw, 1/60.0)
-        pyglet.clock.schedule_interval(self.game_handler.update, 1/120.0)
+        # The scheduler is the only thing on pyglet's clock. It runs fixed simulation ticks;
+        # pyglet's event loop then calls on_draw, which renders once per frame.
+        self.scheduler.schedule_sim(self.game_handler.update)
+        self.scheduler.schedule_render(self.game_handler.draw)
+        self.scheduler.schedule_render(self.perf_hud.draw)
+        self.scheduler.window = self
+        self.scheduler.idle_check = self.game_handler.is_idle
+        self.scheduler.start()
     
     def preload(self):
         self.on_draw()
         self.flip()
         i = 0
-        for s in ['options_appear.wav', 'select_1.wav', 'select_2.wav', 'select_3.wav', 
-                  'select_4.wav', 'select_5.wav', 'select_6.wav', 'give.wav', 'take.wav']:
-            pyglet.resource.media('sound/%s' % s, streaming=False)
+        sound.preload('options_appear', 'select_1', 'select_2', 'select_3', 'select_4',
+                      'select_5', 'select_6', 'give', 'take')
+        
+        # Caches (including the glyph manifest) live next to the saves
+        gamehandler.init_save_path(self.game_info['name'])
+        glyphcache.warm()
+        
         for item in util.preload:
             try:
                 util.load_image(item)
@@ -112,7 +161,7 @@ class AdventureWindow(pyglet.window.Window):
 
     def on_draw(self, dt=0):
         if self.game_handler:
-            self.game_handler.draw()
+            self.scheduler.render()
         else:
             util.draw.set_color(0,0,0)
             util.draw.rect(0,0,self.width,self.height)
@@ -121,10 +170,51 @@ class AdventureWindow(pyglet.window.Window):
             self.background_image.blit(0,0)
             self.load_batch.draw()
     
+    def replay_frame(self, dt=0):
+        if self.replayer.finished:
+            pyglet.clock.unschedule(self.replay_frame)
+            self.replayer.report()
+            pyglet.app.exit()
+            return
+        self.replayer.run_frame(self.dispatch_event, self.draw_replay_frame)
+        self.flip()
+        self.invalid = False        # Already drawn; keep the event loop from drawing again
+    
+    def draw_replay_frame(self):
+        self.switch_to()
+        self.on_draw()
+        pyglet.gl.glFinish()        # Count the GPU's time, not just the time to submit
+    
+    def dispatch_event(self, *args):
+        if (self.perf_hud and util.settings.perf_hud_key and args[0] == 'on_key_press' and 
+                args[1] == getattr(pyglet.window.key, util.settings.perf_hud_key)):
+            self.perf_hud.toggle()
+            self.scheduler.wake()
+            return
+        if args[0] == 'on_key_press' and args[1] == getattr(pyglet.window.key, 
+                                                            util.settings.trace_key):
+            tracing.on_trace_key()
+            return
+        if self.replayer and args[0] in replay.input_events and not self.replayer.injecting:
+            return                  # Live input would throw the replay off
+        if self.recorder:
+            self.recorder.record(*args)
+        if self.scheduler and args[0] in wake_events:
+            self.scheduler.wake()
+        return super(AdventureWindow, self).dispatch_event(*args)
+    
     def on_key_press(self, symbol, modifiers):
         # Override default behavior of escape key quitting
         if symbol == pyglet.window.key.ESCAPE:
             return pyglet.event.EVENT_HANDLED
+        # Here rather than in dispatch_event so that recordings include them
+        if self.game_handler:
+            if symbol == getattr(pyglet.window.key, util.settings.quicksave_key):
+                self.game_handler.quicksave()
+                return pyglet.event.EVENT_HANDLED
+            if symbol == getattr(pyglet.window.key, util.settings.quickload_key):
+                self.game_handler.quickload()
+                return pyglet.event.EVENT_HANDLED
     
     def on_close(self):
         self.game_handler.prompt_save_and_quit()
@@ -132,14 +222,22 @@ class AdventureWindow(pyglet.window.Window):
 
 def run_game():
     sys.path.append(os.path.join(os.path.dirname(sys.argv[0]), 'game'))
+    record_path = None
+    if '--record' in sys.argv:
+        i = sys.argv.index('--record')
+        record_path = sys.argv[i+1]
+        del sys.argv[i:i+2]
     if len(sys.argv) == 2:
         if sys.argv[1] == 'newgame':
-            main_window = AdventureWindow(True)
+            main_window = AdventureWindow(True, record_path=record_path)
         else:
-            main_window = AdventureWindow(True, sys.argv[1])
+            main_window = AdventureWindow(True, sys.argv[1], record_path=record_path)
     else:
-        main_window = AdventureWindow(True) # LOL
+        main_window = AdventureWindow(True, record_path=record_path) # LOL
     pyglet.app.run()
+    if main_window.recorder:
+        main_window.recorder.save()
+    tracing.dump_at_exit()
 
 if __name__ == '__main__':
     run_game()
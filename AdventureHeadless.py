@@ -0,0 +1,40 @@
+"""
+Runs a scene without a window, as fast as possible, and reports the tick rate.
+
+Usage:
+    python AdventureHeadless.py <name of scene> [seconds of game time] [ticks per second]
+"""
+
+import os, sys, time
+
+import pyglet
+
+# Importing the engine imports pyglet.gl, which would otherwise open a hidden window
+pyglet.options['shadow_window'] = False
+
+from engine import headless
+
+def run_game():
+    if len(sys.argv) < 2:
+        print __doc__
+        sys.exit(1)
+    scene_name = sys.argv[1]
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 60.0
+    sim_rate = int(sys.argv[3]) if len(sys.argv) > 3 else None
+
+    sys.path.append(os.path.join(os.path.dirname(sys.argv[0]), 'game'))
+    headless.install()
+
+    t = time.time()
+    game = headless.HeadlessGame(scene_name, sim_rate=sim_rate)
+    print "Loaded %s in %0.3fs" % (scene_name, time.time() - t)
+
+    ticks = int(seconds/game.scheduler.sim_t)
+    t = time.time()
+    game.run(ticks)
+    elapsed = time.time() - t
+    print "Simulated %0.1fs of game time (%d ticks) in %0.3fs: %0.0f ticks/s, %0.1fx real time" % (
+        seconds, ticks, elapsed, ticks/max(elapsed, 1e-6), seconds/max(elapsed, 1e-6))
+
+if __name__ == '__main__':
+    run_game()
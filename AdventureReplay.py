@@ -0,0 +1,49 @@
+"""
+Replays a recording made with Adventure.py's --record option, one simulation tick per frame,
+and reports how long each frame's update and draw took.
+
+Usage:
+    python AdventureReplay.py <recording> [--headless] [--timings <csv file>]
+
+--headless replays without a window (update timings only).
+--timings writes per-frame update and draw times to a CSV file.
+"""
+
+import os, sys
+
+import pyglet
+
+def run_game():
+    args = sys.argv[1:]
+    if not args:
+        print __doc__
+        sys.exit(1)
+    headless = '--headless' in args
+    timings_path = None
+    if '--timings' in args:
+        timings_path = args[args.index('--timings')+1]
+    
+    sys.path.append(os.path.join(os.path.dirname(sys.argv[0]), 'game'))
+    
+    if headless:
+        pyglet.options['shadow_window'] = False
+        from engine import headless, replay
+        headless.install()
+        replayer = replay.Replayer(args[0])
+        game = headless.HeadlessGame(replayer.first_scene, sim_rate=replayer.sim_rate,
+                                     seed=replayer.seed)
+        replayer.start(game.scheduler)
+        replayer.run(game.dispatch_event)
+        replayer.report()
+    else:
+        import Adventure
+        from engine import replay
+        replayer = replay.Replayer(args[0])
+        main_window = Adventure.AdventureWindow(True, replayer=replayer)
+        pyglet.app.run()
+    
+    if timings_path:
+        replayer.save_timings(timings_path)
+
+if __name__ == '__main__':
+    run_game()
@@ -0,0 +1,88 @@
+"""
+Checks that quickload rolls back scenes other than the quicksaved one.
+
+Without a window: quicksave in act1_scene1, go to act1_scene2 and hijack the potato (which takes
+it out of the scene and puts potato_note in the inventory), then quickload, either straight away
+or after moving on to act1_scene3. Afterwards potato_note must be gone from the inventory and
+the potato back in act1_scene2. Each case runs with the scene cache on and off, so act1_scene2
+comes back both from the cache and from its autosave.
+
+Usage:
+    python QuickloadCheck.py
+"""
+
+import os, sys
+
+import pyglet
+
+# Importing the engine imports pyglet.gl, which would otherwise open a hidden window
+pyglet.options['shadow_window'] = False
+
+from engine import headless
+
+def go_to(game, scene_name):
+    handler = game.game_handler.scene_handler
+    handler.notify(scene_name)
+    game.run(300)
+    return handler.scene.name == scene_name
+
+def hijack_potato(game):
+    ui = game.game_handler.ui
+    scn = game.game_handler.scene_handler.scene
+    scn.click_actor(scn.actors['potato'])
+    ui.cam.actions['Hijack potato for your own nefarious purposes']()
+    ui.cam.set_visible(False)
+    game.run(30)
+    return not scn.actors.has_key('potato') and ui.inventory.has_item('potato_note')
+
+def check(scene_cache_budget, leave_first):
+    """A list of what went wrong"""
+    from engine import autosave, util
+    util.settings.scene_cache_budget = scene_cache_budget
+    game = headless.HeadlessGame('act1_scene1', seed=1)
+    handler = game.game_handler
+    game.run(90)
+    handler.quicksave()
+
+    if not go_to(game, 'act1_scene2'):
+        return ["couldn't go to act1_scene2"]
+    if not hijack_potato(game):
+        return ["couldn't hijack the potato"]
+    if leave_first and not go_to(game, 'act1_scene3'):
+        return ["couldn't go to act1_scene3"]
+
+    handler.quickload()
+    game.run(30)
+    problems = []
+    if handler.scene_handler.scene.name != 'act1_scene1':
+        problems.append('quickload went to %s' % handler.scene_handler.scene.name)
+    if handler.ui.inventory.has_item('potato_note'):
+        problems.append('potato_note still in the inventory')
+    if handler.game_variables.get('potato_stop'):
+        problems.append('potato_stop still set')
+
+    autosave.flush()
+    if not go_to(game, 'act1_scene2'):
+        problems.append("couldn't go back to act1_scene2")
+    elif not handler.scene_handler.scene.actors.has_key('potato'):
+        problems.append('potato missing from act1_scene2')
+    handler.prompt_save_and_quit()
+    return problems
+
+def run_checks():
+    sys.path.append(os.path.join(os.path.dirname(sys.argv[0]), 'game'))
+    headless.install()
+
+    failed = False
+    for scene_cache_budget in (96, 0):
+        for leave_first in (False, True):
+            problems = check(scene_cache_budget, leave_first)
+            failed = failed or bool(problems)
+            print "%-4s scene cache %3dMB, quickload %-26s %s" % (
+                'FAIL' if problems else 'ok', scene_cache_budget,
+                'after leaving act1_scene2' if leave_first else 'in act1_scene2',
+                '; '.join(problems))
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    run_checks()
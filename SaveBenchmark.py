@@ -0,0 +1,113 @@
+"""
+Compares save formats: size on disk and time to load the game and one scene.
+
+Every scene in game/ is built without a window (and without its script), then saved as:
+
+    json        indented complete scene info, a file per scene (the old autosave format)
+    json delta  a file per scene, only what differs from info.json
+    binary      one container holding every scene's delta, with and without compression
+
+Usage:
+    python SaveBenchmark.py [scene to load] [load iterations]
+"""
+
+import json, os, shutil, sys, tempfile, time
+
+import pyglet
+
+# Importing the engine imports pyglet.gl, which would otherwise open a hidden window
+pyglet.options['shadow_window'] = False
+
+from engine import headless
+
+def folder_size(folder):
+    return sum(os.path.getsize(os.path.join(folder, f)) for f in os.listdir(folder))
+
+def time_loads(load, iterations):
+    t = time.time()
+    for i in xrange(iterations):
+        load()
+    return (time.time() - t)/iterations
+
+def run_benchmark():
+    scene_name = sys.argv[1] if len(sys.argv) > 1 else 'act1_scene1'
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    sys.path.append(os.path.join(os.path.dirname(sys.argv[0]), 'game'))
+    headless.install()
+    from engine import autosave, gamestate, savefile, scene
+
+    game = headless.HeadlessGame(scene_name)
+    handler = game.game_handler
+    game_info = handler.dict_repr()
+
+    # Build every scene, scripts off so that they don't start music or conversations
+    gamestate.scripts_enabled = False
+    full, deltas = {}, {}
+    for name in sorted(os.listdir('game')):
+        if not os.path.exists(os.path.join('game', name, 'info.json')):
+            continue
+        scn = scene.Scene(name, handler.scene_handler, handler.ui)
+        full[name] = json.loads(json.dumps(scn.dict_repr()))
+        deltas[name] = autosave.info_delta(autosave.base_info(name), scn.save_repr())
+        scn.exit()
+    gamestate.scripts_enabled = True
+
+    root = tempfile.mkdtemp()
+    folders = {}
+    try:
+        folders['json'] = os.path.join(root, 'json')
+        folders['json delta'] = os.path.join(root, 'delta')
+        folders['binary'] = os.path.join(root, 'binary')
+        folders['binary, uncompressed'] = os.path.join(root, 'binary_raw')
+        for folder in folders.itervalues():
+            os.mkdir(folder)
+
+        for name, info in full.iteritems():
+            with open(os.path.join(folders['json'], '%s.json' % name), 'w') as f:
+                json.dump(info, f, indent=4)
+            with open(os.path.join(folders['json delta'], '%s.json' % name), 'w') as f:
+                json.dump(deltas[name], f)
+        for folder in (folders['json'], folders['json delta']):
+            with open(os.path.join(folder, 'game.json'), 'w') as f:
+                json.dump(game_info, f, indent=4 if folder == folders['json'] else None)
+        sections = dict(deltas, game=game_info)
+        for key, compress in (('binary', True), ('binary, uncompressed', False)):
+            with open(os.path.join(folders[key], autosave.container_name), 'wb') as f:
+                f.write(savefile.dumps(sections, compress=compress))
+
+        def load_json(folder, delta):
+            def load():
+                with open(os.path.join(folder, 'game.json')) as f:
+                    json.load(f)
+                with open(os.path.join(folder, '%s.json' % scene_name)) as f:
+                    info = json.load(f)
+                if delta:
+                    autosave.apply_delta(autosave.base_info(scene_name), info)
+            return load
+
+        def load_binary(folder):
+            def load():
+                saved = savefile.read(os.path.join(folder, autosave.container_name))
+                saved.section('game')
+                autosave.apply_delta(autosave.base_info(scene_name), saved.section(scene_name))
+            return load
+
+        loaders = {
+            'json': load_json(folders['json'], False),
+            'json delta': load_json(folders['json delta'], True),
+            'binary': load_binary(folders['binary']),
+            'binary, uncompressed': load_binary(folders['binary, uncompressed']),
+        }
+
+        print
+        print "%d scenes saved; loading game and %s, %d times" % (len(full), scene_name, iterations)
+        print "%-22s %10s %12s" % ('format', 'bytes', 'load (ms)')
+        for key in ('json', 'json delta', 'binary', 'binary, uncompressed'):
+            print "%-22s %10d %12.3f" % (key, folder_size(folders[key]),
+                                         1000*time_loads(loaders[key], iterations))
+    finally:
+        shutil.rmtree(root)
+
+if __name__ == '__main__':
+    run_benchmark()
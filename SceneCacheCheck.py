@@ -0,0 +1,65 @@
+"""
+Checks that scenes taken back out of the scene cache don't move their actors twice over.
+
+Without a window, with the scene cache on: go act1_scene1 -> act1_scene2 -> act1_scene1 ->
+act1_scene2, staying a while in each. Levity's introduction is skipped so that she walks her
+route up and down act1_scene1 the whole time. After every tick in a scene taken from the cache,
+no actor's sprite may have more than one interpolator moving it: the scene's script runs again
+when it is re-entered, so a walk left running from the last visit would overlap the walk the
+script starts (come_from_left sends levity to levity_right, for one). The default stay is over
+a minute of game time, long enough for the minute levity_walk waits at either end of her route.
+
+Usage:
+    python SceneCacheCheck.py [ticks per scene]
+"""
+
+import collections, os, sys
+
+import pyglet
+
+# Importing the engine imports pyglet.gl, which would otherwise open a hidden window
+pyglet.options['shadow_window'] = False
+
+from engine import headless
+
+def overlapping_moves(scn):
+    """Identifiers of actors with more than one interpolator on their sprite"""
+    hosts = collections.Counter(i.host_object for i in scn.interp.interpolators)
+    return sorted(identifier for identifier, act in scn.actors.viewitems()
+                  if hosts[act.sprite] > 1)
+
+def run_check():
+    ticks = int(sys.argv[1]) if len(sys.argv) > 1 else 8000
+
+    sys.path.append(os.path.join(os.path.dirname(sys.argv[0]), 'game'))
+    headless.install()
+    from engine import util
+    util.settings.scene_cache_budget = 96
+
+    game = headless.HeadlessGame('act1_scene1', seed=1)
+    handler = game.game_handler.scene_handler
+    handler.scene.global_dict['levity_exposition'] = True
+    handler.scene.global_dict['levity_direction'] = 'right'
+    failed = False
+    for scene_name in ('act1_scene1', 'act1_scene2', 'act1_scene1', 'act1_scene2'):
+        if handler.scene.name != scene_name:
+            cached = handler.scene_cache.has_key(scene_name)
+            handler.notify(scene_name)
+        else:
+            cached = False
+        worst = []
+        for i in xrange(ticks):
+            game.run(1)
+            if not cached:
+                continue
+            overlapping = overlapping_moves(handler.scene)
+            if len(overlapping) > len(worst):
+                worst = overlapping
+        failed = failed or bool(worst) or handler.scene.name != scene_name
+        print "%-4s %s%s%s" % ('FAIL' if worst else 'ok', scene_name,
+                               ' (from the cache)' if cached else '',
+                               ', moved twice over: %s' % ', '.join(worst) if worst else '')
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    run_check()
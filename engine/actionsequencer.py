@@ -28,6 +28,8 @@ class ActionSequencer(object):
     point, either by setting done_function on an Interpolator or by setting a pyglet timer.
     """
     
+    __slots__ = ('actions', 'blocking_actions')     # So that Actor can have no __dict__
+    
     def __init__(self):
         self.actions = collections.deque()
         self.blocking_actions = 0
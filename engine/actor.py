@@ -2,7 +2,7 @@ import os, json, collections, random
 
 import pyglet
 
-import actionsequencer, interpolator, util
+import actionsequencer, interpolator, sound, util
 
 class Actor(actionsequencer.ActionSequencer):
     """Any non-static object that the player can interact with"""
@@ -12,6 +12,12 @@ class Actor(actionsequencer.ActionSequencer):
     info = None
     images = None
     
+    # Scenes can hold a lot of actors, so they don't each get a __dict__. Anything that is the
+    # same for every actor with a name is on its Prototype.
+    __slots__ = ('name', 'scene', 'proto', 'use_mask_to_detect_clicks', 'identifier', 
+                 'walkpath_point', 'current_state', 'walk_speed', 'anchor_x', 'anchor_y', 
+                 'casts_shadow', 'sprite', '_icon', '_bbox', '_bbox_key', '_bbox_image')
+    
     def __init__(self, identifier, name, scene, batch=None, attrs=None):
         super(Actor, self).__init__()
         attrs = attrs or {}
@@ -21,37 +27,51 @@ class Actor(actionsequencer.ActionSequencer):
         
         self.identifier = identifier
         self.walkpath_point = None
-        self.resource_path = util.respath_func_with_base_path('actors', self.name)
         
         self.update_static_info()
-        self.current_state = Actor.info[self.name]['start_state']
-        
-        self.walk_speed = Actor.info[self.name].get('walk_speed', 400.0)
-        self.anchor_x = Actor.info[self.name]['anchor_x']
-        self.anchor_y = Actor.info[self.name]['anchor_y']
-        self.current_state = attrs.get('start_state', Actor.info[self.name]['start_state'])
-        self.casts_shadow = Actor.info[self.name].get('casts_shadow', False)
+        proto = self.proto
+        self.walk_speed = proto.walk_speed
+        self.anchor_x = proto.anchor_x
+        self.anchor_y = proto.anchor_y
+        self.current_state = attrs.get('start_state', proto.start_state)
+        self.casts_shadow = proto.casts_shadow
         
         if self.scene and batch is None:
             batch = self.scene.batch
         
-        self.sprite = pyglet.sprite.Sprite(Actor.images[self.name][self.current_state], batch=batch)
+        self.sprite = pyglet.sprite.Sprite(proto.images[self.current_state], batch=batch)
         
-        self.make_icon()
+        self._icon = None   # Made when first needed (by the inventory)
+        self._bbox_key = None   # Sprite position, scale and image that _bbox was worked out for
         
         # Update attributes
         for attr in ['x', 'y', 'scale', 'rotation', 'opacity']:
             if attrs.has_key(attr):
                 setattr(self.sprite, attr, attrs[attr])
     
-    def make_icon(self):
-        try:
-            self.icon = pyglet.sprite.Sprite(self.image_named("icon", 0, 0), batch = None)
-        except pyglet.resource.ResourceNotFoundException:
-            self.icon = pyglet.sprite.Sprite(Actor.images[self.name][self.current_state], batch = None) 
-            if self.scene.ui:
-                if self.icon.height > self.scene.ui.inventory.height:
-                    self.icon.scale = float(self.scene.ui.inventory.height) / float(self.icon.height)
+    def _get_icon(self):
+        if self._icon is None:
+            self._icon = pyglet.sprite.Sprite(icon_image(self.name, self.current_state), 
+                                              batch = None)
+            self.fit_icon()
+        return self._icon
+    
+    icon = property(_get_icon)
+    
+    def update_icon(self):
+        """Show the current state on the icon, if it has been made and has no icon.png"""
+        if self._icon is not None:
+            img = icon_image(self.name, self.current_state)
+            if img is not self._icon.image:
+                self._icon.image = img
+                self.fit_icon()
+    
+    def fit_icon(self):
+        """Scale an icon made from a state image down to the inventory's height"""
+        if self.name in missing_icons and self.scene.ui:
+            self._icon.scale = 1.0
+            if self._icon.height > self.scene.ui.inventory.height:
+                self._icon.scale = float(self.scene.ui.inventory.height) / float(self._icon.height)
     
     
     def delete(self):
@@ -63,14 +83,29 @@ class Actor(actionsequencer.ActionSequencer):
     
     # Access
     
-    dialogue_offset = property(lambda self: Actor.info[self.name].get('dialogue_offset', (0, 0)))
+    dialogue_offset = property(lambda self: self.proto.dialogue_offset)
+    resource_path = property(lambda self: self.proto.resource_path)
+    
+    def bbox(self):
+        """(min x, min y, max x, max y) of the current image, kept until the sprite moves,
+        scales or changes image"""
+        s = self.sprite
+        key = (s.x, s.y, s.scale, s.image)
+        if key != self._bbox_key:
+            img = s.image
+            if hasattr(img, 'frames'):
+                img = img.frames[0].image
+            min_x = s.x - img.anchor_x
+            min_y = s.y - img.anchor_y
+            self._bbox = (min_x, min_y, min_x + img.width*s.scale, min_y + img.height*s.scale)
+            self._bbox_image = img
+            self._bbox_key = key
+        return self._bbox
+    
     def covers_point(self, x, y):
         if not self.sprite.visible:
             return False
-        min_x = self.abs_position_x()
-        min_y = self.abs_position_y()
-        max_x = self.abs_position_x() + self.width()
-        max_y = self.abs_position_y() + self.height()
+        min_x, min_y, max_x, max_y = self.bbox()
         return min_x <= x <= max_x and min_y <= y <= max_y
     
     def icon_covers_point(self, x, y):
@@ -81,60 +116,55 @@ class Actor(actionsequencer.ActionSequencer):
         return min_x <= x <= max_x and min_y <= y <= max_y
     
     def covers_visible_point(self, x, y):
-        min_x = self.abs_position_x()
-        min_y = self.abs_position_y()
-        max_x = self.abs_position_x() + self.width()
-        max_y = self.abs_position_y() + self.height()
+        min_x, min_y, max_x, max_y = self.bbox()
         if min_x <= x <= max_x and min_y <= y <= max_y:
             if self.use_mask_to_detect_clicks:
-                return (util.image_alpha_at_point(self.current_image(),  x-min_x, y-min_y))
+                return (util.image_alpha_at_point(self._bbox_image,  x-min_x, y-min_y))
             else:
                 return True
     
     # Convenience methods to tell the position, width, and height of the actor
     def width(self):
-        return self.current_image().width*self.sprite.scale
+        min_x, min_y, max_x, max_y = self.bbox()
+        return max_x - min_x
     
     def height(self):
-        return self.current_image().height*self.sprite.scale
+        min_x, min_y, max_x, max_y = self.bbox()
+        return max_y - min_y
     
     def abs_position_x(self):
-        return self.sprite.x - self.current_image().anchor_x
+        return self.bbox()[0]
     
     def abs_position_y(self):
-        return self.sprite.y - self.current_image().anchor_y
+        return self.bbox()[1]
     
     def current_image(self):
-        try:
-            return self.sprite.image.frames[0].image
-        except AttributeError:
-            return self.sprite.image
+        self.bbox()
+        return self._bbox_image
     
     # State changes
     
     def set_image_if_exists(self, image_name):
         """Update image/animation if available, otherwise stay the same"""
-        if Actor.images[self.name].has_key(image_name):
+        images = self.proto.images
+        if images.has_key(image_name):
             try:
-                self.sprite.image = Actor.images[self.name][image_name]
+                self.sprite.image = images[image_name]
             except AttributeError:
-                print "Error on", self.identifier, "setting an image", image_name, Actor.images[self.name][image_name], self.sprite._texture
+                print "Error on", self.identifier, "setting an image", image_name, images[image_name], self.sprite._texture
     
     def update_state(self, new_state):
         """Update self.current_state and update animation if possible. Variable is
         changed even if animation is not changed so that scripts do not become confused."""
-        if new_state != self.current_state and Actor.images[self.name].has_key(new_state):
+        if new_state != self.current_state and self.proto.images.has_key(new_state):
             self.current_state = new_state
             self.set_image_if_exists(new_state)
-            self.make_icon()
+            self.update_icon()
     
     # Possible actions to put in a sequence. Pay attention for parameter values.
     
     def play_speaking_sound(self):
-        try:
-            pyglet.resource.media(self.resource_path('speak.wav'), streaming=False).play()
-        except pyglet.resource.ResourceNotFoundException:
-            pass
+        sound.play(speaking_sound(self.name), bus='voice', optional=True)
     
     def move_to(self, pos, anim=None):
         """Set up an interpolator to move between this actor's current position and
@@ -143,7 +173,7 @@ class Actor(actionsequencer.ActionSequencer):
         interp = InterpClass(self.sprite, 'position', pos, speed=self.walk_speed, 
                              done_function=self.next_action)
         
-        if not anim or not Actor.images[self.name].has_key(anim):
+        if not anim or not self.proto.images.has_key(anim):
             if pos[0] < self.sprite.x:
                 anim = 'walk_left'
             else:
@@ -234,53 +264,59 @@ class Actor(actionsequencer.ActionSequencer):
     
     def update_static_info(self):
         """Initialize/update static Actor information"""
-        if Actor.info == None or Actor.images == None:
-            Actor.info = {}
-            Actor.images = {}
-        if not Actor.info.has_key(self.name) or not Actor.images.has_key(self.name):
-            self.update_actor_info()
+        self.proto = prototype(self.name)
+    
+    def preload_states(self, states=()):
+        """Load states ahead of their first use: states, plus walking if on a walk path"""
+        images = self.proto.images
+        if self.walkpath_point:
+            states = list(states) + list(walk_states)
+        for state in states:
+            images.get(state)
     
     def image_named(self, img_name, anchor_x, anchor_y):
         """Load and anchor a PNG"""
-        img = util.load_image(self.resource_path("%s.png" % img_name))
-        img.anchor_x = img.width * anchor_x
-        img.anchor_y = img.height * anchor_y
-        return img
+        return image_named(self.name, img_name, anchor_x, anchor_y)
     
     def update_actor_info(self):
         """Update static info for this Actor in particular"""
-        with pyglet.resource.file(self.resource_path('info.json'), 'r') as info_file:
-            my_info = json.load(info_file)
-            ax, ay = my_info['anchor_x'], my_info['anchor_y']
-            Actor.info[self.name] = my_info
-            Actor.images[self.name] = {}
-            for state_name, state_info in my_info['states'].viewitems():
-                if isinstance(state_info, list):
-                    num_frames = state_info[0]
-                    time_per_frame = state_info[1]
-                else:
-                    num_frames = state_info
-                    time_per_frame = 0.2
-                if num_frames == 1:
-                    img = self.image_named(state_name, ax, ay)
-                    Actor.images[self.name][state_name] = img
-                else:
-                    make_img = lambda i: self.image_named("%s_%d" % (state_name, i), ax, ay)
-                    images = [make_img(i) for i in range(1, num_frames+1)]
-                    loop = True
-                    if state_name in my_info.get('noloop', []):
-                        loop = False
-                    if state_name in my_info.get('randomize', []):
-                        random_images = [i for i in images]
-                        random.shuffle(random_images) # Guarantee at least one occurrence per image
-                        random_images.extend([random.choice(images) for i in xrange(20)])
-                        anim = pyglet.image.Animation.from_image_sequence(random_images,
-                                                                          time_per_frame,
-                                                                          loop)
-                    else:
-                        anim = pyglet.image.Animation.from_image_sequence(images, time_per_frame,
-                                                                          loop)
-                    Actor.images[self.name][state_name] = anim
+        load_actor_info(self.name)
+        self.proto = prototype(self.name)
+    
+    def snapshot(self):
+        """Everything about this Actor that can change in play, including queued actions"""
+        return {
+            'position': self.sprite.position,
+            'scale': self.sprite.scale,
+            'rotation': self.sprite.rotation,
+            'opacity': self.sprite.opacity,
+            'visible': self.sprite.visible,
+            'state': self.current_state,
+            'walkpath_point': self.walkpath_point,
+            'walk_speed': self.walk_speed,
+            'actions': [list(action_list) for action_list in self.actions],
+            'blocking_actions': self.blocking_actions
+        }
+    
+    def restore_snapshot(self, snapshot):
+        if snapshot['state'] != self.current_state:
+            self.current_state = snapshot['state']
+            self.set_image_if_exists(self.current_state)
+            self.update_icon()
+        for attr in ['position', 'scale', 'rotation', 'opacity', 'visible']:
+            setattr(self.sprite, attr, snapshot[attr])
+        self.walkpath_point = snapshot['walkpath_point']
+        self.walk_speed = snapshot['walk_speed']
+        self.actions = collections.deque(list(action_list) 
+                                         for action_list in snapshot['actions'])
+        self.blocking_actions = snapshot['blocking_actions']
+    
+    def revive(self):
+        """Give an Actor that was removed from its scene a new sprite. Returns the old one."""
+        old_sprite = self.sprite
+        self.sprite = pyglet.sprite.Sprite(self.proto.images[self.current_state], 
+                                           batch=self.scene.batch)
+        return old_sprite
     
     def dict_repr(self):
         """Store and return all information necessary to recreate this Actor's current state"""
@@ -297,3 +333,146 @@ class Actor(actionsequencer.ActionSequencer):
         return dict_repr
     
 
+
+
+# Static info, shared by every Actor with the same name
+
+class Prototype(object):
+    """What every Actor with the same name shares, looked up once"""
+    __slots__ = ('name', 'info', 'images', 'start_state', 'walk_speed', 'anchor_x', 'anchor_y',
+                 'casts_shadow', 'dialogue_offset', 'resource_path')
+    
+    def __init__(self, name):
+        super(Prototype, self).__init__()
+        info = Actor.info[name]
+        self.name = name
+        self.info = info
+        self.images = Actor.images[name]
+        self.start_state = info['start_state']
+        self.walk_speed = info.get('walk_speed', 400.0)
+        self.anchor_x = info['anchor_x']
+        self.anchor_y = info['anchor_y']
+        self.casts_shadow = info.get('casts_shadow', False)
+        self.dialogue_offset = info.get('dialogue_offset', (0, 0))
+        self.resource_path = util.respath_func_with_base_path('actors', name)
+
+prototypes = {}         # Name: Prototype
+
+def prototype(name):
+    """The Prototype for actors called name, loading their static info if needed"""
+    if not prototypes.has_key(name):
+        load_static_info(name)
+        prototypes[name] = Prototype(name)
+    return prototypes[name]
+
+icon_images = {}        # (name, state): inventory icon image
+missing_icons = set()   # Names of actors without an icon.png, which use their state images
+
+def load_static_info(name):
+    """Load info.json and images for actors called name unless they are already loaded"""
+    if Actor.info == None or Actor.images == None:
+        Actor.info = {}
+        Actor.images = {}
+    if not Actor.info.has_key(name) or not Actor.images.has_key(name):
+        load_actor_info(name)
+
+def image_named(name, img_name, anchor_x, anchor_y):
+    """Load and anchor a PNG"""
+    img = util.load_image(util.respath('actors', name, '%s.png' % img_name))
+    img.anchor_x = img.width * anchor_x
+    img.anchor_y = img.height * anchor_y
+    return img
+
+def load_actor_info(name):
+    """Update static info for actors called name. Images are loaded as states are used."""
+    with pyglet.resource.file(util.respath('actors', name, 'info.json'), 'r') as info_file:
+        my_info = json.load(info_file)
+        Actor.info[name] = my_info
+        prototypes.pop(name, None)
+        for key in [key for key in icon_images if key[0] == name]:
+            del icon_images[key]
+        missing_icons.discard(name)
+        Actor.images[name] = StateImages(name, my_info)
+
+class StateImages(dict):
+    """
+    Images and animations of actors called name by state, each loaded the first time it is
+    asked for. has_key() and get() know about every state in info.json, loaded or not.
+    """
+    def __init__(self, name, info):
+        super(StateImages, self).__init__()
+        self.name = name
+        self.info = info
+    
+    def __missing__(self, state_name):
+        if state_name not in self.info['states']:
+            raise KeyError(state_name)
+        self[state_name] = img = load_state_image(self.name, self.info, state_name)
+        return img
+    
+    def has_key(self, state_name):
+        return state_name in self.info['states']
+    
+    __contains__ = has_key
+    
+    def get(self, state_name, default=None):
+        return self[state_name] if self.has_key(state_name) else default
+
+def load_state_image(name, my_info, state_name):
+    """Load the image or animation for one state"""
+    ax, ay = my_info['anchor_x'], my_info['anchor_y']
+    state_info = my_info['states'][state_name]
+    if isinstance(state_info, list):
+        num_frames = state_info[0]
+        time_per_frame = state_info[1]
+    else:
+        num_frames = state_info
+        time_per_frame = 0.2
+    if num_frames == 1:
+        return image_named(name, state_name, ax, ay)
+    
+    images = [image_named(name, "%s_%d" % (state_name, i), ax, ay) 
+              for i in range(1, num_frames+1)]
+    loop = True
+    if state_name in my_info.get('noloop', []):
+        loop = False
+    if state_name in my_info.get('randomize', []):
+        # Its own generator, so that when a state is first used doesn't change the game's
+        # random numbers (which replays and snapshots depend on)
+        rng = random.Random('%s/%s' % (name, state_name))
+        random_images = [i for i in images]
+        rng.shuffle(random_images) # Guarantee at least one occurrence per image
+        random_images.extend([rng.choice(images) for i in xrange(20)])
+        return pyglet.image.Animation.from_image_sequence(random_images, time_per_frame, loop)
+    return pyglet.image.Animation.from_image_sequence(images, time_per_frame, loop)
+
+walk_states = ('walk_left', 'walk_right', 'stand_front')    # What walk path moves show
+
+def load_state(name, state):
+    """Image or animation for a state of actors called name, or None if there is no such state"""
+    load_static_info(name)
+    return Actor.images[name].get(state)
+
+def load_icon(name):
+    """The inventory icon for actors called name, or None if they use their current image"""
+    if name in missing_icons:
+        return None
+    try:
+        return image_named(name, "icon", 0, 0)
+    except pyglet.resource.ResourceNotFoundException:
+        missing_icons.add(name)
+        return None
+
+def icon_image(name, state):
+    """The image an icon of an actor called name shows in a state"""
+    key = (name, state)
+    if not icon_images.has_key(key):
+        img = load_icon(name)
+        if img is None:
+            img = Actor.images[name][state]
+        icon_images[key] = img
+    return icon_images[key]
+
+def speaking_sound(name):
+    """Sound bank name of the sound played when actors called name speak"""
+    return util.respath('actors', name, 'speak.wav')
@@ -0,0 +1,299 @@
+"""
+Autosaves, written in the background as differences from each scene's info.json.
+
+A scene's save only holds what changed in play: actors that were added, removed or moved on
+from how info.json has them, and any other top level keys that differ. Walk paths and camera
+points never change in play, so they always come from info.json. game.json holds the game
+variables and the current scene as before.
+
+save() takes a snapshot on the main thread and hands it to a writer thread, which works out the
+delta, serializes it and writes it atomically (temp file, then rename). A save of a file that is
+still waiting to be written replaces the waiting one, and a file whose contents haven't changed
+since the last write isn't written again. Until a save is on disk, load() and exists() see it
+anyway, so a scene can be entered again straight after it was saved.
+
+copy_folder() and restore_folder() put a whole save folder back as it was, for quickload.
+
+With settings.save_format 'binary', every file in a save folder goes into one container file
+(see savefile.py) as a section named after it; with 'json' each is a .json file. Files in the
+other format are read when there is nothing in the current one, and that includes JSON saves
+with complete scene info from before deltas.
+"""
+
+import atexit, collections, copy, json, marshal, os, shutil, threading, traceback
+
+import pyglet
+
+import savefile, util
+
+delta_format = 1
+container_name = 'save.stsv'
+
+_bases = {}     # Scene name: info.json contents as marshal data, which copies fast
+
+def base_info(scene_name):
+    """A new copy of a scene's info.json"""
+    if not _bases.has_key(scene_name):
+        path = util.respath('game', scene_name, 'info.json')
+        with pyglet.resource.file(path, 'r') as f:
+            _bases[scene_name] = marshal.dumps(json.load(f))
+    return marshal.loads(_bases[scene_name])
+
+def info_delta(base, info):
+    """What info changes in base"""
+    delta = {'delta_format': delta_format}
+    for k, v in info.viewitems():
+        if k != 'actors' and base.get(k) != v:
+            delta[k] = v
+    base_actors = base.get('actors', {})
+    delta['actors'] = {identifier: attrs for identifier, attrs in info['actors'].viewitems()
+                       if base_actors.get(identifier) != attrs}
+    delta['removed_actors'] = [identifier for identifier in base_actors
+                               if identifier not in info['actors']]
+    return delta
+
+def apply_delta(base, delta):
+    """
+    Scene info from a save, which is either a delta or (from older saves) complete info.
+    base is changed and returned.
+    """
+    if not delta.has_key('delta_format'):
+        return delta
+    info = base
+    for k, v in delta.viewitems():
+        if k not in ('delta_format', 'actors', 'removed_actors'):
+            info[k] = v
+    info['actors'].update(delta['actors'])
+    for identifier in delta['removed_actors']:
+        info['actors'].pop(identifier, None)
+    return info
+
+
+class Writer(object):
+    """Writes saves on a background thread, newest snapshot of each file only"""
+    def __init__(self):
+        super(Writer, self).__init__()
+        self.condition = threading.Condition()
+        self.pending = collections.OrderedDict()    # Path: (scene name or None, snapshot),
+                                                    # snapshot None to remove the save
+        self.writing = {}       # Like pending, for the saves being written
+        self.written = {}       # File path: data last written there
+        self.containers = {}    # Container path: {section name: data}
+        self.thread = None
+        self.closing = False
+
+    def put(self, path, scene_name, snapshot):
+        with self.condition:
+            self.pending.pop(path, None)    # Written in the order saves were last asked for
+            self.pending[path] = (scene_name, snapshot)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.work, name='autosave')
+                self.thread.daemon = True
+                self.thread.start()
+                atexit.register(self.close)
+            self.condition.notify_all()
+
+    def get(self, path):
+        """The newest snapshot for path that may not be on disk yet, or None"""
+        with self.condition:
+            return self.pending.get(path) or self.writing.get(path)
+
+    def entries(self, folder):
+        """Save name: newest snapshot, for the saves in folder that may not be on disk yet"""
+        with self.condition:
+            found = {}
+            for queue in (self.writing, self.pending):
+                for path, entry in queue.iteritems():
+                    if os.path.dirname(path) == folder:
+                        found[os.path.basename(path)] = entry
+            return found
+
+    def work(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.closing:
+                    self.condition.wait()
+                if not self.pending:
+                    return
+                self.writing, self.pending = self.pending, collections.OrderedDict()
+            try:
+                self.write_batch(self.writing)
+            except Exception:
+                traceback.print_exc()
+            with self.condition:
+                self.writing = {}
+                self.condition.notify_all()
+
+    def write_batch(self, batch):
+        touched = []
+        for path, (scene_name, snapshot) in batch.iteritems():
+            if snapshot is None:
+                self.remove(path, touched)
+                continue
+            if scene_name is not None:
+                snapshot = info_delta(base_info(scene_name), snapshot)
+            if util.settings.save_format == 'binary':
+                folder, name = os.path.split(path)
+                container = os.path.join(folder, container_name)
+                self.sections(container)[name] = snapshot
+                if container not in touched:
+                    touched.append(container)
+            else:
+                self.write_file('%s.json' % path, json.dumps(snapshot, sort_keys=True))
+        for container in touched:
+            self.write_file(container, savefile.dumps(self.sections(container),
+                                                      compress=util.settings.compress_saves))
+
+    def remove(self, path, touched):
+        """Delete a save in either format"""
+        folder, name = os.path.split(path)
+        container = os.path.join(folder, container_name)
+        if container in self.containers or os.path.exists(container):
+            if self.sections(container).pop(name, None) is not None and container not in touched:
+                touched.append(container)
+        json_path = '%s.json' % path
+        self.written.pop(json_path, None)
+        if os.path.exists(json_path):
+            os.remove(json_path)
+
+    def sections(self, container):
+        """Everything in a container, read from disk the first time it is written to"""
+        if container not in self.containers:
+            try:
+                self.containers[container] = savefile.read(container).sections()
+            except (IOError, savefile.SaveFormatError):
+                self.containers[container] = {}
+        return self.containers[container]
+
+    def write_file(self, path, data):
+        if self.written.get(path) == data and os.path.exists(path):
+            return
+        util.write_file_atomic(path, data)
+        self.written[path] = data
+
+    def flush(self):
+        """Wait until every save asked for so far is on disk"""
+        with self.condition:
+            while self.pending or self.writing:
+                self.condition.wait()
+
+    def forget(self, folder):
+        """Drop what is known about the saves in folder, which is about to be deleted"""
+        self.flush()
+        self.containers.pop(os.path.join(folder, container_name), None)
+        self.written.clear()
+
+    def close(self):
+        """Write everything and stop the thread, at exit"""
+        with self.condition:
+            self.closing = True
+            self.condition.notify_all()
+        self.thread.join()
+
+writer = Writer()
+
+def save(path, data, scene_name=None):
+    """
+    Save data as path in the background. With scene_name, data is the scene's
+    Scene.save_repr() and only its difference from info.json is written.
+    Nothing in data may be changed afterwards.
+    """
+    writer.put(path, scene_name, data)
+
+def _container(folder):
+    """The container in folder, or None"""
+    container = os.path.join(folder, container_name)
+    if not os.path.exists(container):
+        return None
+    try:
+        return savefile.read(container)
+    except (IOError, savefile.SaveFormatError):
+        return None
+
+def _container_section(path):
+    """The container holding path's section, or None"""
+    folder, name = os.path.split(path)
+    saved = _container(folder)
+    return saved if saved is not None and saved.has_section(name) else None
+
+def exists(path):
+    entry = writer.get(path)
+    if entry is not None:
+        return entry[1] is not None
+    return _container_section(path) is not None or os.path.exists('%s.json' % path)
+
+def load(path, scene_name=None):
+    """Data saved as path, including saves that are still being written"""
+    entry = writer.get(path)
+    if entry is not None:
+        if entry[1] is None:
+            raise IOError("Save %s was removed" % path)
+        data = copy.deepcopy(entry[1])
+        if scene_name is not None:
+            if entry[0] is not None:
+                data = info_delta(base_info(scene_name), data)
+            data = apply_delta(base_info(scene_name), data)     # Also a save put back as written
+        return data
+    # Files in the format not being written may be out of date, so they come second
+    saved = _container_section(path)
+    data = None
+    if saved is not None and (util.settings.save_format == 'binary' or
+                              not os.path.exists('%s.json' % path)):
+        try:
+            data = saved.section(os.path.basename(path))
+        except savefile.SaveFormatError:
+            if not os.path.exists('%s.json' % path):
+                raise
+            traceback.print_exc()   # Fall back on the JSON save
+    if data is None:
+        data = util.load_json(path)
+    if scene_name is not None:
+        data = apply_delta(base_info(scene_name), data)
+    return data
+
+def names(folder):
+    """Names of every save in folder, in either format, including saves still being written"""
+    found = set()
+    saved = _container(folder)
+    if saved is not None:
+        found.update(saved.names())
+    if os.path.isdir(folder):
+        found.update(f[:-len('.json')] for f in os.listdir(folder) if f.endswith('.json'))
+    for name, (scene_name, snapshot) in writer.entries(folder).iteritems():
+        if snapshot is None:
+            found.discard(name)
+        else:
+            found.add(name)
+    return found
+
+def copy_folder(folder):
+    """Everything saved in folder, as it would be written, for restore_folder()"""
+    saves = {}
+    for name in names(folder):
+        path = os.path.join(folder, name)
+        entry = writer.get(path)
+        if entry is None:
+            try:
+                saves[name] = load(path)
+            except (IOError, ValueError, savefile.SaveFormatError):
+                pass    # Unreadable saves are left out, and removed by restore_folder()
+        elif entry[0] is not None:
+            saves[name] = info_delta(base_info(entry[0]), entry[1])
+        else:
+            saves[name] = copy.deepcopy(entry[1])
+    return saves
+
+def restore_folder(folder, saves):
+    """Put the saves in folder back to what copy_folder() returned, in the background"""
+    for name in names(folder):
+        if name not in saves:
+            writer.put(os.path.join(folder, name), None, None)
+    for name, data in saves.iteritems():
+        writer.put(os.path.join(folder, name), None, data)
+
+def delete(folder):
+    """Delete a save folder"""
+    writer.forget(folder)
+    shutil.rmtree(folder)
+
+flush = writer.flush
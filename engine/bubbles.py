@@ -0,0 +1,117 @@
+"""
+Speech bubble labels, laid out ahead of time and reused.
+
+Laying out a label is most of the cost of showing a line of dialogue: its glyphs are looked up
+(and rendered into the font texture the first time they are seen), flowed into lines and turned
+into vertex lists. Instead of creating a Label per line and deleting it afterwards,
+conversations take labels from a pool shared by all of them:
+
+- Released labels stay laid out, keyed by (text, color, multiline), so a line that is spoken
+  again (looping background chatter, a choice that is picked twice) needs no layout at all.
+- prepare() lays out a line before it is spoken. Conversation calls it for the next few lines
+  of the label it is running, a tick after showing the current one.
+- Once the pool is full, a new line reuses the least recently used idle label of the same shape
+  instead of creating another Label.
+
+Showing a prepared label only moves it, which shifts its vertices without another layout.
+
+Bubble shapes are retained too. Each scene has a bubble batch holding every conversation's fill
+and outline vertex lists, which are only rewritten when a new line is shown, so all of a scene's
+bubbles are drawn by one batch draw. Labels stay outside it so the pool can be shared by every
+scene, and are drawn on top of the bubbles.
+"""
+
+import collections
+
+import pyglet
+
+font_name = ['Verdana', 'Helvetica']
+font_size = 12
+multiline_w = 400
+multiline_chars = 47    # Longer lines wrap at multiline_w
+
+capacity = 16       # Idle labels kept laid out
+lookahead = 3       # Lines Conversation prepares ahead of the one being spoken
+
+fill_color = (0, 0, 0, 255)
+fill_group = pyglet.graphics.OrderedGroup(0)
+outline_group = pyglet.graphics.OrderedGroup(1)
+
+_idle = collections.OrderedDict()   # key: Label, least recently used first
+_metrics = {}   # (text, font name, font size, width): (content_width, content_height)
+
+def loop_to_lines(points):
+    """Vertices of a GL_LINE_LOOP as GL_LINES, which can share a batch with other lists"""
+    lines = []
+    n = len(points)
+    for i in xrange(0, n, 2):
+        lines.extend(points[i:i+2])
+        lines.extend(points[(i+2)%n:(i+2)%n+2])
+    return lines
+
+def label_key(text, color):
+    return (text, color, len(text) > multiline_chars)
+
+def size(key):
+    """Content width and height of the label for key"""
+    text, color, multiline = key
+    return _metrics[(text, font_name[0], font_size, multiline_w if multiline else None)]
+
+def _new_label(key):
+    text, color, multiline = key
+    if multiline:
+        return pyglet.text.Label(text, color=color, font_size=font_size, font_name=font_name,
+                                 anchor_x='center', anchor_y='bottom',
+                                 multiline=True, width=multiline_w)
+    else:
+        return pyglet.text.Label(text, color=color, font_size=font_size, font_name=font_name,
+                                 anchor_x='center', anchor_y='bottom')
+
+def _lay_out(key):
+    """Make a label for key, reusing an idle one if the pool is full"""
+    text, color, multiline = key
+    label = None
+    if len(_idle) >= capacity:
+        for old_key in _idle:
+            if old_key[2] == multiline:
+                label = _idle.pop(old_key)
+                break
+        else:
+            _idle.popitem(last=False)[1].delete()
+    if label is None:
+        label = _new_label(key)
+    else:
+        label.begin_update()
+        label.text = text
+        label.color = color
+        label.end_update()
+    _metrics[(text, font_name[0], font_size, multiline_w if multiline else None)] = (
+        label.content_width, label.content_height)
+    return label
+
+def prepare(key):
+    """Lay out a label for key now so that acquire(key) is cheap later"""
+    if key in _idle:
+        _idle[key] = _idle.pop(key)
+    else:
+        _idle[key] = _lay_out(key)
+
+def acquire(key):
+    """A laid out label for key, taken out of the pool until release()"""
+    return _idle.pop(key, None) or _lay_out(key)
+
+def release(label, key):
+    """Return a label to the pool, still laid out"""
+    if key in _idle:
+        # Somebody else was showing the same line at the same time
+        label.delete()
+        return
+    _idle[key] = label
+    if len(_idle) > capacity:
+        _idle.popitem(last=False)[1].delete()
+
+def clear():
+    """Delete every idle label"""
+    while _idle:
+        _idle.popitem()[1].delete()
+    _metrics.clear()
@@ -21,14 +21,16 @@ Contextual Action Menu Life Cycle:
 
 import copy, math
 import json, pyglet
-import gamestate, ui, util
+import gamestate, sound, ui, util
 from pyglet.window import key
 
+font_name = ['Synchro LET', 'Verdana', 'Helvetica']
+font_size = 12
+
 class CAM(object):
     
     # Init
     def __init__(self, actions, x, y, ui):
-        self.vis_sound = pyglet.resource.media('sound/options_appear.wav', streaming=False)
         self.visible = False
         self.actions = actions
         self.x = x
@@ -52,13 +54,12 @@ class CAM(object):
         
         for i, (text, callback) in enumerate(self.actions.viewitems()):
             rect = rects[i]
-            self.sound_for_callback[callback] = pyglet.resource.media('sound/select_%d.wav' % (i+1),
-                                                                      streaming=False)
+            self.sound_for_callback[callback] = 'select_%d' % (i+1)
             self.buttons.append((rect, callback))
             self.labels.add(pyglet.text.Label("%d: %s" % (i+1, text), multiline=True,
-                                    font_name=['Synchro LET', 'Verdana', 'Helvetica'],
+                                    font_name=font_name,
                                     x=rect[0], y=rect[1], width=rect[2], height=rect[3],
-                                    font_size=12, anchor_y="top",
+                                    font_size=font_size, anchor_y="top",
                                     batch=self.batch, color=(255,255,255,255)))
         
         self.set_visible(True)
@@ -67,7 +68,7 @@ class CAM(object):
     # Make this into a property instead. I can't remember how right now. --Steve
     def set_visible(self, visible):
         if visible:
-            self.vis_sound.play()
+            sound.play('options_appear', sound.PRIORITY_HIGH)
             gamestate.event_manager.set_cam(self)
         else:
             gamestate.event_manager.set_cam(None)
@@ -87,7 +88,7 @@ class CAM(object):
                 return pyglet.event.EVENT_UNHANDLED
             else:
                 # execute the click action and clean up the CAM
-                self.sound_for_callback[callback].play()
+                sound.play(self.sound_for_callback[callback], sound.PRIORITY_HIGH)
                 callback()
                 self.set_visible(False)
                 self.ui.clean_cam()
@@ -97,7 +98,7 @@ class CAM(object):
         nums = {getattr(pyglet.window.key,"_%d" % (i+1)): self.buttons[i][1] for i in range(len(self.buttons))}
         for num, callback in nums.viewitems():
             if num == symbol:
-                self.sound_for_callback[callback].play()
+                sound.play(self.sound_for_callback[callback], sound.PRIORITY_HIGH)
                 callback()
                 self.set_visible(False)
                 self.ui.clean_cam()
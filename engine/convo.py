@@ -95,6 +95,10 @@ Commands:
                 Require that the conversation variable <local> be set to some true value
         
         (hide_after_use is somewhat redundant to update_locals+require, but it's convenient.)
+
+Files are compiled into instruction lists the first time they are used (see convoprogram.py).
+Bad labels, malformed lines and speakers that aren't in the scene raise ConvoError as soon as
+the conversation begins.
 """
 
 import collections
@@ -102,25 +106,20 @@ import functools
 import itertools
 import pyglet
 import random
-import re
-import yaml
 
-import actor, gamestate
+import actor, bubbles, convoprogram, gamestate, sound
+from convoprogram import SPEAK, ACTION, GOTO, CHOICE, GIVE, TAKE, UPDATE_LOCALS, UPDATE_GLOBALS
+from convoprogram import PLAY_SOUND, UPDATE_ANIMATIONS
 from interpolator import LinearInterpolator
 
-from util import draw
+from util import tracing
 
 # Convenience function for creating defaultdicts that return None if key not present
 nonedict = functools.partial(collections.defaultdict, lambda: None)
 
-# Match 'give:' syntax
-parens_match = re.compile(r'(?P<name>[^(]+\S+)\s+\((?P<id>[^)]+)\)')
-
-colors = {
-    'main': (255,201,215,255)
-}
+main_color = (255,201,215,255)
 
-more_colors = itertools.cycle(random.sample([
+bubble_colors = [
     (229,201,255,255),
     (201,206,255,255),
     (201,249,255,255),
@@ -128,9 +127,19 @@ more_colors = itertools.cycle(random.sample([
     (255,255,201,255),
     (255,228,201,255),
     (255,201,201,255),
-], 7))
+]
+
+colors = {}
+more_colors = None
+
+def reset_colors():
+    """Forget which speaker got which color and reshuffle. Called again when the RNG is seeded."""
+    global more_colors
+    colors.clear()
+    colors['main'] = main_color
+    more_colors = itertools.cycle(random.sample(bubble_colors, len(bubble_colors)))
 
-multiline_w = 400
+reset_colors()
 
 class Conversation(object):
     def __init__(self, scn, background=False):
@@ -138,18 +147,49 @@ class Conversation(object):
         self.scene = scn
         
         self.convo_name = None
-        self.convo_info = None
+        self.program = None
+        self.variables = None
         self.animations = None
-        self.convo_lines = None
-        self.convo_position = 0
+        self.code = None            # Lines of the label being run
+        self.pc = 0                 # Index of the next line in self.code
+        self.hidden_choices = set() # Choices used up by hide_after_use in this run
         self.background = background
         self.convo_label = None
+        self.convo_label_key = None
+        self.speech = None          # (actor ID, text) of the bubble on screen
         self.text_color = (255,255,255,255)
         self.vertices_outline = None
         self.vertices_fill = None
+        self.fill_list = None       # Bubble vertex lists in the scene's bubble batch
+        self.outline_list = None
+        
+        # Instruction handlers, indexed by opcode
+        self.ops = [None]*10
+        self.ops[SPEAK] = self._speak
+        self.ops[ACTION] = self._action
+        self.ops[GOTO] = self._goto
+        self.ops[CHOICE] = self._choice
+        self.ops[GIVE] = self._give
+        self.ops[TAKE] = self._take
+        self.ops[UPDATE_LOCALS] = self._update_locals
+        self.ops[UPDATE_GLOBALS] = self._update_globals
+        self.ops[PLAY_SOUND] = self._play_sound
+        self.ops[UPDATE_ANIMATIONS] = self._update_animations
     
     def delete(self):
-        pass
+        """Stop running without telling the scene, and remove the speech bubble"""
+        self.scene.clock.unschedule(self.next_line)
+        self.scene.clock.unschedule(self.prepare_upcoming)
+        self.clear_speech_bubble()
+    
+    def abandon(self):
+        """Stop as if the conversation had never started: no script call, no animation changes"""
+        self.delete()
+        self.code = None
+        self.convo_name = None
+        self.program = None
+        self.variables = None
+        self.animations = None
     
     active = property(lambda self: self.convo_name is not None)
     
@@ -168,13 +208,8 @@ class Conversation(object):
                 return pyglet.event.EVENT_HANDLED
     
     def draw(self):
-        """Draw dialogue box and text"""
+        """Draw dialogue text. The box is drawn with the scene's bubble batch."""
         if self.convo_label:
-            draw.set_color(0,0,0,1)
-            pyglet.graphics.draw(9, pyglet.gl.GL_TRIANGLES,('v2f', self.vertices_fill))
-            draw.set_color(*map(lambda c:c/255.0, self.text_color))
-            pyglet.graphics.draw(len(self.vertices_outline)/2,
-                                 pyglet.gl.GL_LINE_LOOP, ('v2f', self.vertices_outline))
             self.convo_label.draw()
     
     def _update_anim_dict(self, newdict):
@@ -191,41 +226,62 @@ class Conversation(object):
     
     def begin_conversation(self, convo_name):
         """Start a cutscene named <convo_name>"""
+        with tracing.span('Conversation load'):
+            program = convoprogram.load(self.scene.resource_path("convo/%s.convo" % convo_name))
+            program.check_speakers(self.scene.actors)
+        self.scene.prefetch_conversation(convo_name)
+        
         self.convo_name = convo_name
-        with pyglet.resource.file(self.scene.resource_path("convo/%s.convo" % convo_name), 'r') as f:
-            self.convo_info = yaml.load(f)
-            # Variables default to None
-            self.convo_info['variables'] = nonedict(self.convo_info['variables'])
-            self.animations = {
-                'at_rest': {},
-                'speaking': {}
-            }
-            # Add animations from YAML file
-            self._update_anim_dict(self.convo_info)
-            
-            # Go!
-            self.convo_lines = self.convo_info['start']
-            self.convo_position = 0
-            
-            # Or not!
-            if self.convo_info.has_key('stand_at') and self.scene.actors['main'].walkpath_point != self.convo_info['stand_at']:
-                def callback(*args):
-                    self.scene.actors['main'].next_action()
-                    self.next_line()
-                self.scene.actors['main'].prepare_walkpath_move(self.convo_info['stand_at'],
-                                                                callback=callback)
-                self.scene.actors['main'].next_action()
-            else:
-                for identifier, new_state in self.animations['at_rest'].viewitems():
-                    self.scene.actors[identifier].update_state(new_state)
+        self.program = program
+        # Variables default to None
+        self.variables = nonedict(program.variables)
+        self.animations = {
+            'at_rest': dict(program.at_rest),
+            'speaking': dict(program.speaking)
+        }
+        self.hidden_choices = set()
+        
+        # Go!
+        self.code = program.start
+        self.pc = 0
+        
+        # Or not!
+        main = self.scene.actors['main']
+        if program.stand_at is not None and main.walkpath_point != program.stand_at:
+            def callback(*args):
+                main.next_action()
                 self.next_line()
+            main.prepare_walkpath_move(program.stand_at, callback=callback)
+            main.next_action()
+        else:
+            for identifier, new_state in self.animations['at_rest'].viewitems():
+                self.scene.actors[identifier].update_state(new_state)
+            self.next_line()
     
-    # ACTION LIST COMMANDS
-    # Returns True if the caller can/should immediately execute the next line
+    # INSTRUCTIONS
+    # Each returns True if the caller can/should immediately execute the next line
+    
+    def _speak(self, arg):
+        actor_id, text = arg
+        if not self.scene.actors.has_key(actor_id):
+            return True
+        self.speak(actor_id, text)
+        return False
+    
+    def _action(self, arg):
+        """Call a method on an actor, e.g. jump"""
+        actor_id, action = arg
+        if not self.scene.actors.has_key(actor_id):
+            return True
+        if self.scene.ui.cam and not self.background:
+            self.scene.ui.cam.set_visible(False)
+        self._reset_at_rest(exclude=actor_id)
+        getattr(self.scene.actors[actor_id], action)()
+        return True
     
     def _update_locals(self, val):
         """Update variables dictionary"""
-        self.convo_info['variables'].update(val)
+        self.variables.update(val)
         return True
     
     def _update_globals(self, val):
@@ -238,25 +294,23 @@ class Conversation(object):
         return True
     
     def _give(self, val):
-        match = parens_match.match(val)
-        if match:
-            new_actor = actor.Actor(match.group('id'), match.group('name'), self.scene)
-            # new_actor = self.scene.new_actor(match.group('name'), match.group('id'))
-        else:
+        actor_name, identifier = val
+        if identifier is None:
+            inventory_items = self.scene.ui.inventory.items
             next_identifier = 1
-            while self.scene.actors.has_key("%s_%d" % (actor_name, next_identifier)):
-                next_identifier += 1
             identifier = "%s_%d" % (actor_name, next_identifier)
-            
-            new_actor = actor.Actor(next_identifier, val, self.scene)
+            while self.scene.actors.has_key(identifier) or inventory_items.has_key(identifier):
+                next_identifier += 1
+                identifier = "%s_%d" % (actor_name, next_identifier)
+        new_actor = actor.Actor(identifier, actor_name, self.scene)
         
         self.scene.ui.inventory.put_item(new_actor)
-        pyglet.resource.media('sound/give.wav').play()
+        sound.play('give', sound.PRIORITY_HIGH)
         return True
     
     def _take(self, val):
         self.scene.ui.inventory.get_item(val)
-        pyglet.resource.media('sound/take.wav').play()
+        sound.play('take', sound.PRIORITY_HIGH)
         return True
     
     def _update_animations(self, val):
@@ -265,146 +319,142 @@ class Conversation(object):
         self._reset_at_rest()
         return True
     
-    def _goto(self, val):
+    def _goto(self, code):
         """Start executing a different action list"""
-        self.convo_position = 0
+        self.pc = 0
         if self.scene.ui.cam and not self.background:
             self.scene.ui.cam.set_visible(False)
-        if val == 'exit':
+        if code is convoprogram.EXIT:
             self.stop_speaking()
             return False
         else:
-            self.convo_lines = self.convo_info[val]
+            self.code = code
             return True
     
-    def _choice(self, val):
+    def _choice(self, choices):
         """Present the user with a CAM where each button goes to a different label"""
         self.clear_speech_bubble()
         
-        temp_choices = self._enforce_choice_requirements(val)
-        choice_mappings = {k: self._make_choice_callback(k, val, v) for k, v
-                           in temp_choices.viewitems()}
+        choice_mappings = {c.text: self._make_choice_callback(c) for c in choices
+                           if c not in self.hidden_choices and self._requirements_met(c)}
         self.scene.ui.show_cam(self.scene.actors['main'], choice_mappings)
         self.scene.ui.cam.hide_on_click_outside = False
         return False
     
-    def _parse_command_dict(self, cmd_dict):
-        """Search cmd_dict for actions to execute. Return True if caller should call next_line()."""
-        needs_schedule = True
-        for cmd, arg in cmd_dict.viewitems():
-            try:
-                result = getattr(self, '_%s' % cmd)(arg)
-                needs_schedule = needs_schedule and result
-            except AttributeError:
-                pass    # Don't care, it's probably a spoken line
-        return needs_schedule
+    def run_line(self, line):
+        """Execute every instruction in a line. Return True if the next line should run now."""
+        proceed = True
+        ops = self.ops
+        for op, arg in line:
+            proceed = ops[op](arg) and proceed
+        return proceed
     
     # CHOICE ACTION HELPERS
     
-    def _make_choice_callback(self, choice, choice_dict, tag_dict):
+    def _make_choice_callback(self, choice):
         """Create a function to be called when a choice is clicked"""
         def decision():
-            tags = nonedict(tag_dict)
-            if tags['hide_after_use']:
-                del choice_dict[choice]
-            self._parse_command_dict(tags)
-            if self.convo_lines:
+            if choice.hide_after_use:
+                self.hidden_choices.add(choice)
+            self.run_line(choice.line)
+            if self.code:
                 self.next_line()
             else:
                 self.stop_speaking()
         return decision
     
-    def _enforce_choice_requirements(self, choices):
-        """Enforce 'requires' choice action"""
-        temp_choices = choices.copy()
-        for choice, tags in choices.viewitems():
-            if tags.has_key('require'):
-                v = self.convo_info['variables']
-                for r in tags['require'].split(', '):
-                    if not (r in v and v[r]) and not (r in self.scene.global_dict and self.scene.global_dict[r]) and not (r in self.scene.ui.inventory.items):
-                        del temp_choices[choice]
-                        break
-        return temp_choices
+    def _requirements_met(self, choice):
+        """Enforce 'require' choice action"""
+        v = self.variables
+        global_dict = self.scene.global_dict
+        items = self.scene.ui.inventory.items
+        for r in choice.requires:
+            if not v.get(r) and not global_dict.get(r) and not r in items:
+                return False
+        return True
     
     # OTHER CUTSCENE STUFF
     
+    @tracing.traced('Conversation.next_line')
     def next_line(self, dt=0):
         """Advance the cutscene by one line in the current action list"""
         if not self.active:
             print 'Somehow we are trying to call next_line on an inactive conversation'
             return
-        if self.convo_position >= len(self.convo_lines):
-            self.stop_speaking()
-        else:    
-            line = self.convo_lines[self.convo_position]
-            self.convo_position += 1
-            needs_schedule = self._parse_command_dict(nonedict(line))
-            for actor_id, arg in line.viewitems():
-                if self.scene.actors.has_key(actor_id):
-                    self.speak(actor_id, arg)
-                    needs_schedule = False
-            if needs_schedule:
-                self.next_line()
+        # Run lines until one waits for a timer or the player
+        while self.active:
+            if self.pc >= len(self.code):
+                self.stop_speaking()
+                return
+            line = self.code[self.pc]
+            self.pc += 1
+            if not self.run_line(line):
+                return
     
     def speak(self, actor_id, arg):
-        """Actor-specific actions like speaking and jumping"""
+        """Show a speech bubble for an actor and schedule the next line"""
         if self.scene.ui.cam and not self.background:
             self.scene.ui.cam.set_visible(False)
         self._reset_at_rest(exclude=actor_id)
         act = self.scene.actors[actor_id]
-        if isinstance(arg, str):
-            act.update_state(self.animations['speaking'][actor_id])
-            self.clear_speech_bubble()
-            
-            if not colors.has_key(actor_id):
-                colors[actor_id] = more_colors.next()
-            self.text_color = colors[actor_id]
-            
-            if len(arg) > 47:
-                self.convo_label = pyglet.text.Label(arg, color=self.text_color, font_size=12, 
-                                                     font_name=['Verdana', 'Helvetica'],
-                                                     anchor_x='center', anchor_y='bottom',
-                                                     x=act.sprite.x,
-                                                     y=act.sprite.y + 20 + \
-                                                        act.current_image().height - \
-                                                        act.current_image().anchor_y,
-                                                     multiline=True, width=multiline_w)
-            else:
-                self.convo_label = pyglet.text.Label(arg, color=self.text_color, font_size=12, 
-                                                     font_name=['Verdana', 'Helvetica'],
-                                                     anchor_x='center', anchor_y='bottom',
-                                                     x=act.sprite.x,
-                                                     y=act.sprite.y + 20 + \
-                                                        act.current_image().height - \
-                                                        act.current_image().anchor_y)
-            
-            self._update_vertices(act)
-            self.scene.clock.schedule_once(self.next_line, max(len(arg)*0.05, 3.0))
-            if not self.background:
-                act.play_speaking_sound()
-        else:
-            if arg.has_key('action'):
-                getattr(act, arg['action'])()
-                self.next_line()
+        act.update_state(self.animations['speaking'][actor_id])
+        self.show_speech(actor_id, arg)
+        
+        self.scene.clock.schedule_once(self.next_line, max(len(arg)*0.05, 3.0))
+        self.scene.clock.schedule_once(self.prepare_upcoming, 0)
+        if not self.background:
+            act.play_speaking_sound()
+    
+    def show_speech(self, actor_id, arg):
+        """Put up an actor's speech bubble"""
+        act = self.scene.actors[actor_id]
+        self._release_label()
+        self.speech = (actor_id, arg)
+        
+        if not colors.has_key(actor_id):
+            colors[actor_id] = more_colors.next()
+        self.text_color = colors[actor_id]
+        
+        key = bubbles.label_key(arg, self.text_color)
+        self.convo_label = bubbles.acquire(key)
+        self.convo_label_key = key
+        # Moving a laid out label only shifts its vertices
+        self.convo_label.x, self.convo_label.y = self._label_position(act, key)
+        
+        self._update_vertices(act)
+    
+    def prepare_upcoming(self, dt=0):
+        """Lay out the next few lines of the current label before they are spoken"""
+        if not self.active:
+            return
+        for line in self.code[self.pc:self.pc + bubbles.lookahead]:
+            for op, arg in line:
+                # Colors are handed out in speaking order, so only known speakers are prepared
+                if op == SPEAK and colors.has_key(arg[0]):
+                    bubbles.prepare(bubbles.label_key(arg[1], colors[arg[0]]))
+    
+    def _label_position(self, act, key):
+        """Bottom center of an actor's speech bubble text, kept inside the camera"""
+        w, h = bubbles.size(key)
+        cw = w/2+40
+        x = max(cw, act.sprite.x)
+        x = min(self.scene.camera.position[0]+gamestate.norm_w/2-cw, x)
+        y = act.sprite.y + 20 + act.current_image().height - act.current_image().anchor_y
+        return x, y
     
     def _update_vertices(self, act):
         offset_x, offset_y = act.dialogue_offset
         
-        cw = self.convo_label.content_width/2+40
-        self.convo_label.x = max(cw, self.convo_label.x)
-        self.convo_label.x = min(self.scene.camera.position[0]+gamestate.norm_w/2-cw, self.convo_label.x)
-        
         x = self.convo_label.x
         y = self.convo_label.y
-        w = self.convo_label.content_width
-        h = self.convo_label.content_height
+        w, h = bubbles.size(self.convo_label_key)
         
         point_x = act.sprite.x + offset_x
         point_y = y + offset_y - 20
         
         if self.convo_label.multiline:
-            x1, y1 = x - (multiline_w / 2) - 5, y - 5
-            x2, y2 = x + (multiline_w / 2) + 5, y + h + 5
+            x1, y1 = x - (bubbles.multiline_w / 2) - 5, y - 5
+            x2, y2 = x + (bubbles.multiline_w / 2) + 5, y + h + 5
         else:
             x1, y1 = x - (w / 2) - 5,   y - 5
             x2, y2 = x + (w / 2) + 5,   y + h + 5
@@ -433,12 +483,39 @@ class Conversation(object):
                 self.vertices_outline = first_tri + (mid_x, mid_y, x2, y1)
                 self.vertices_fill = first_tri + (x2, y2, x2, y1, x1, y1) + \
                                      (x2, y2, mid_x, mid_y, x2, y1)
+        self._update_bubble_lists()
+    
+    def _update_bubble_lists(self):
+        """Copy the bubble shape into this conversation's vertex lists"""
+        outline = bubbles.loop_to_lines(self.vertices_outline)
+        n = len(outline)/2
+        if self.fill_list is None:
+            batch = self.scene.bubble_batch
+            self.fill_list = batch.add(9, pyglet.gl.GL_TRIANGLES, bubbles.fill_group,
+                                       'v2f', ('c4B', bubbles.fill_color*9))
+            self.outline_list = batch.add(n, pyglet.gl.GL_LINES, bubbles.outline_group,
+                                          'v2f', 'c4B')
+        elif len(self.outline_list.vertices) != len(outline):
+            self.outline_list.resize(n)
+        self.fill_list.vertices = self.vertices_fill
+        self.outline_list.vertices = outline
+        self.outline_list.colors = self.text_color*n
+    
+    def _release_label(self):
+        if self.convo_label:
+            bubbles.release(self.convo_label, self.convo_label_key)
+            self.convo_label = None
+            self.convo_label_key = None
     
     def clear_speech_bubble(self):
         """Clear all spoken text"""
-        if self.convo_label:
-            self.convo_label.delete()
-            self.convo_label = None
+        self._release_label()
+        self.speech = None
+        if self.fill_list:
+            self.fill_list.delete()
+            self.outline_list.delete()
+            self.fill_list = None
+            self.outline_list = None
     
     def stop_speaking(self, dt=0):
         """Stop the cutscene"""
@@ -446,7 +523,8 @@ class Conversation(object):
             return
         self.clear_speech_bubble()
         self.scene.clock.unschedule(self.next_line)
-        self.convo_lines = []
+        self.scene.clock.unschedule(self.prepare_upcoming)
+        self.code = None
         
         for identifier, new_state in self.animations['at_rest'].viewitems():
             self.scene.actors[identifier].update_state(new_state)
@@ -454,7 +532,42 @@ class Conversation(object):
         # Order matters here in case the script starts a new conversation
         cn = self.convo_name
         self.convo_name = None
-        self.convo_info = None
+        self.program = None
+        self.variables = None
         self.animations = None
         self.scene.call_if_available('end_conversation', cn)
     
+    
+    # Snapshots
+    
+    def snapshot(self):
+        """Where this conversation is up to, for restore_snapshot()"""
+        return {
+            'convo_name': self.convo_name,
+            'program': self.program,
+            'variables': nonedict(self.variables) if self.variables is not None else None,
+            'animations': ({k: dict(v) for k, v in self.animations.viewitems()}
+                           if self.animations is not None else None),
+            'code': self.code,
+            'pc': self.pc,
+            'hidden_choices': set(self.hidden_choices),
+            'speech': self.speech
+        }
+    
+    def restore_snapshot(self, snapshot):
+        """
+        Pick up from a snapshot. The line being spoken is shown again; its timer is on the
+        scene's clock, which is restored separately.
+        """
+        self.clear_speech_bubble()
+        self.convo_name = snapshot['convo_name']
+        self.program = snapshot['program']
+        self.variables = (nonedict(snapshot['variables']) 
+                          if snapshot['variables'] is not None else None)
+        self.animations = ({k: dict(v) for k, v in snapshot['animations'].viewitems()}
+                           if snapshot['animations'] is not None else None)
+        self.code = snapshot['code']
+        self.pc = snapshot['pc']
+        self.hidden_choices = set(snapshot['hidden_choices'])
+        if snapshot['speech']:
+            self.show_speech(*snapshot['speech'])
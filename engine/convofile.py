@@ -0,0 +1,87 @@
+"""
+Loads .convo files without parsing YAML every time a conversation starts.
+
+Each file is parsed once (with libyaml when PyYAML was built with it) and kept in memory as
+marshal data. The marshal data is also written to the cache directory along with the source's
+modification time and size, so later runs skip YAML altogether until the .convo changes.
+
+Conversations modify the dictionaries they are given (variables, hide_after_use choices), so
+load() returns a fresh copy every time.
+"""
+
+import copy, marshal, os
+
+import pyglet
+import yaml
+
+import util
+
+try:
+    from yaml import CSafeLoader as YAMLLoader
+except ImportError:
+    from yaml import SafeLoader as YAMLLoader
+
+cache_version = 1
+
+_compiled = {}      # Resource name -> marshal data
+_uncompilable = {}  # Resource name -> parsed data that marshal can't store (e.g. dates)
+
+def source_path(name):
+    """Filesystem path of a resource, or None if it lives somewhere else (e.g. a zip)"""
+    location = pyglet.resource.location(name)
+    if isinstance(location, pyglet.resource.FileLocation):
+        return os.path.join(location.path, name)
+    return None
+
+def cache_file(name):
+    folder = util.cache_path('convo')
+    if folder is None:
+        return None
+    return os.path.join(folder, '%s.marshal' % name.replace('/', '__'))
+
+def parse(name):
+    with pyglet.resource.file(name, 'r') as f:
+        return yaml.load(f.read(), Loader=YAMLLoader)
+
+def read_cache(cached, stamp):
+    try:
+        with open(cached, 'rb') as f:
+            if marshal.load(f) == stamp:
+                return f.read()
+    except (IOError, EOFError, ValueError, TypeError):
+        pass
+    return None
+
+def compile_convo(name):
+    """Marshal data for a .convo, from the disk cache if it is up to date"""
+    path = source_path(name)
+    cached = cache_file(name) if path else None
+    stamp = None
+    if cached:
+        st = os.stat(path)
+        stamp = (cache_version, st.st_mtime, st.st_size)
+        if os.path.exists(cached):
+            data = read_cache(cached, stamp)
+            if data is not None:
+                return data
+    
+    info = parse(name)
+    try:
+        data = marshal.dumps(info)
+    except ValueError:
+        _uncompilable[name] = info
+        return None
+    if cached:
+        try:
+            util.write_file_atomic(cached, marshal.dumps(stamp) + data)
+        except (IOError, OSError):
+            pass    # Read-only cache folder; still works, just slower next run
+    return data
+
+def load(name):
+    """Fresh copy of the parsed contents of a .convo resource"""
+    if name not in _compiled and name not in _uncompilable:
+        _compiled[name] = compile_convo(name)
+    if name in _uncompilable:
+        return copy.deepcopy(_uncompilable[name])
+    return marshal.loads(_compiled[name])
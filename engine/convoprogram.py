@@ -0,0 +1,188 @@
+"""
+Compiles .convo scripts into instruction lists for Conversation's interpreter loop.
+
+Each label becomes a list of lines, and each line a tuple of (opcode, argument) instructions,
+commands first and speakers last like the YAML it came from. Work that used to happen every
+time a line ran is done once here:
+
+- goto arguments are the target label's code (or EXIT), so a jump is an assignment
+- choice requirements are split into tuples of names
+- choice tags are compiled into a line of their own
+- speaker lines are told apart from actor actions ({action: jump})
+- speakers, animation states, sounds and given items are collected so that prefetch.py can load
+  them before the conversation starts
+
+Mistakes are reported when the script is loaded rather than when the line is reached: unknown
+goto labels, malformed lines and choices, and (checked per scene by check_speakers) keys that
+are neither commands nor actors.
+"""
+
+import re
+
+import convofile
+
+# Opcodes
+SPEAK = 0
+ACTION = 1
+GOTO = 2
+CHOICE = 3
+GIVE = 4
+TAKE = 5
+UPDATE_LOCALS = 6
+UPDATE_GLOBALS = 7
+PLAY_SOUND = 8
+UPDATE_ANIMATIONS = 9
+
+commands = {
+    'goto': GOTO,
+    'choice': CHOICE,
+    'give': GIVE,
+    'take': TAKE,
+    'update_locals': UPDATE_LOCALS,
+    'update_globals': UPDATE_GLOBALS,
+    'play_sound': PLAY_SOUND,
+    'update_animations': UPDATE_ANIMATIONS,
+}
+
+# Top level keys that aren't labels
+header_keys = frozenset(['at_rest', 'speaking', 'variables', 'stand_at'])
+
+# Choice tags that aren't commands
+choice_tags = frozenset(['require', 'hide_after_use'])
+
+EXIT = None     # goto target that ends the conversation
+
+# Match 'give: name (identifier)' syntax
+parens_match = re.compile(r'(?P<name>[^(]+\S+)\s+\((?P<id>[^)]+)\)')
+
+class ConvoError(Exception):
+    pass
+
+class Choice(object):
+    """One button of a choice instruction"""
+    __slots__ = ('text', 'requires', 'hide_after_use', 'line')
+
+    def __init__(self, text, requires, hide_after_use, line):
+        self.text = text
+        self.requires = requires
+        self.hide_after_use = hide_after_use
+        self.line = line
+
+class Program(object):
+    def __init__(self, name, info):
+        super(Program, self).__init__()
+        self.name = name
+        self.at_rest = info.get('at_rest') or {}
+        self.speaking = info.get('speaking') or {}
+        self.variables = info.get('variables') or {}
+        self.stand_at = info.get('stand_at')
+        self.speakers = set()   # Keys used as actor identifiers
+        self.sounds = set()     # play_sound arguments
+        self.given = set()      # give arguments, as (name, identifier or None)
+        self.taken = set()      # take arguments
+        self.states = set()     # (actor identifier, state) pairs from at_rest, speaking and
+                                # update_animations
+        self.add_states(self.at_rest)
+        self.add_states(self.speaking)
+
+        # Labels are filled in after they have all been created so that gotos can refer to them
+        label_names = [k for k in info if k not in header_keys]
+        if 'start' not in label_names:
+            raise ConvoError("%s: no 'start' label" % name)
+        self.labels = {label: [] for label in label_names}
+        for label in label_names:
+            lines = info[label] or []
+            if not isinstance(lines, list):
+                raise ConvoError("%s: label '%s' is not a list of lines" % (name, label))
+            self.labels[label].extend(self.compile_line(label, line) for line in lines)
+        self.start = self.labels['start']
+
+    def add_states(self, animations):
+        for identifier, state in animations.viewitems():
+            self.states.add((identifier, state))
+
+    def error(self, label, message):
+        return ConvoError("%s, label '%s': %s" % (self.name, label, message))
+
+    def resolve(self, label, target):
+        if target == 'exit':
+            return EXIT
+        if target not in self.labels:
+            raise self.error(label, "goto to unknown label '%s'" % target)
+        return self.labels[target]
+
+    def compile_command(self, label, cmd, arg):
+        op = commands[cmd]
+        if op == GOTO:
+            arg = self.resolve(label, arg)
+        elif op == CHOICE:
+            arg = self.compile_choice(label, arg)
+        elif op == GIVE:
+            match = parens_match.match(arg)
+            if match:
+                arg = (match.group('name'), match.group('id'))
+            else:
+                arg = (arg, None)
+            self.given.add(arg)
+        elif op == TAKE:
+            self.taken.add(arg)
+        elif op == PLAY_SOUND:
+            self.sounds.add(arg)
+        elif op in (UPDATE_LOCALS, UPDATE_GLOBALS, UPDATE_ANIMATIONS):
+            if not isinstance(arg, dict):
+                raise self.error(label, "%s needs a dictionary" % cmd)
+            if op == UPDATE_ANIMATIONS:
+                for k in ('at_rest', 'speaking'):
+                    self.add_states(arg.get(k) or {})
+        return (op, arg)
+
+    def compile_line(self, label, line):
+        if not isinstance(line, dict):
+            raise self.error(label, "line %r is not a dictionary" % (line,))
+        instructions = []
+        speeches = []
+        for key, arg in line.viewitems():
+            if key in commands:
+                instructions.append(self.compile_command(label, key, arg))
+            elif isinstance(arg, basestring):
+                self.speakers.add(key)
+                speeches.append((SPEAK, (key, arg)))
+            elif isinstance(arg, dict) and 'action' in arg:
+                self.speakers.add(key)
+                speeches.append((ACTION, (key, arg['action'])))
+            else:
+                raise self.error(label, "don't know what to do with '%s: %r'" % (key, arg))
+        return tuple(instructions + speeches)
+
+    def compile_choice(self, label, choices):
+        if not isinstance(choices, dict):
+            raise self.error(label, "choice needs a dictionary of buttons")
+        compiled = []
+        for text, tags in choices.viewitems():
+            tags = tags or {}
+            unknown = [k for k in tags if k not in commands and k not in choice_tags]
+            if unknown:
+                raise self.error(label, "unknown command(s) %s in choice '%s'" % (
+                                 ', '.join(unknown), text))
+            requires = tuple(r.strip() for r in str(tags.get('require', '')).split(',')
+                             if r.strip())
+            line = tuple(self.compile_command(label, k, v) for k, v in tags.viewitems()
+                         if k in commands)
+            compiled.append(Choice(text, requires, bool(tags.get('hide_after_use')), line))
+        return tuple(compiled)
+
+    def check_speakers(self, actors):
+        """Raise ConvoError if a line is spoken by something that isn't in the scene"""
+        missing = [s for s in self.speakers if s not in actors]
+        if missing:
+            raise ConvoError("%s: %s %s neither a command nor an actor in this scene" % (
+                             self.name, ', '.join(sorted(missing)),
+                             'is' if len(missing) == 1 else 'are'))
+
+_programs = {}
+
+def load(name):
+    """Compiled Program for a .convo resource. Programs are never modified, so they are shared."""
+    if name not in _programs:
+        _programs[name] = Program(name, convofile.load(name))
+    return _programs[name]
@@ -2,13 +2,22 @@
 Handles game loading, saving, and initialization.
 """
 
-import os, sys, json, shutil
+import os, sys, json, shutil, copy
 import pyglet
 
 import gamestate, util
-import scene, scenehandler, ui
+from util import tracing
+import autosave, perfhud, scene, scenehandler, snapshot, ui
 import music
 
+def init_save_path(name):
+    """Create the folder for a game's saves and return it. Caches go under it by default."""
+    save_path = pyglet.resource.get_settings_path(name)
+    util.mkdir_if_absent(save_path)
+    if util.settings.cache_path is None:
+        util.settings.cache_path = os.path.join(save_path, 'cache')
+    return save_path
+
 class GameHandler(object):
     """This class will be useful when scene transitions are implemented."""
     def __init__(self, first_scene="title_screen", name="Adventure", reset_save=False):
@@ -18,36 +27,72 @@ class GameHandler(object):
         self.game_variables = {}
         
         self.dj = music.DJ(self, 0.8)
-        self.background_dj = music.DJ(self, 0.1)
+        self.background_dj = music.DJ(self, 0.1, 'ambience')
         
-        self.save_path = pyglet.resource.get_settings_path(self.name)
-        util.mkdir_if_absent(self.save_path)
+        self.save_path = init_save_path(self.name)
         
         if reset_save:
             try:
-                shutil.rmtree(os.path.join(self.save_path, "autosave"))
+                autosave.delete(os.path.join(self.save_path, "autosave"))
             except OSError:
                 pass    # Directory didn't exist but we don't care
         
+        self.quicksave_snapshot = None
+        
         self.scene_handler = scenehandler.SceneHandler(self)
         scn = self.load() or scene.Scene(first_scene, self.scene_handler, self.ui)
         self.scene_handler.set_first_scene(scn)
         self.update = self.scene_handler.update
+        self.is_idle = self.scene_handler.is_idle
     
     def paused(self):
         return self.scene_handler.scene.paused
     
-    def draw(self, dt=0):
+    def prepare_music(self, scene_name):
+        """Open the tracks a scene and the scenes it leads to might play"""
+        names = [scene_name]
+        names.extend(music.script_calls(scene_name)['exits'])
+        for name in names:
+            calls = music.script_calls(name)
+            self.dj.prepare(*calls['music'])
+            self.background_dj.prepare(*calls['background'])
+    
+    def draw(self, alpha=1.0):
+        if perfhud.active:
+            perfhud.start_laps()
         with util.pushmatrix(gamestate.scale):
-            self.scene_handler.draw_scenes()
+            self.scene_handler.draw_scenes(alpha)
             self.ui.draw()
+            if perfhud.active:
+                perfhud.lap('ui/inventory/cam')
             self.scene_handler.draw()
+            if perfhud.active:
+                perfhud.lap('scene transition')
     
     # Called by scenehandler when the user is exiting the game, should prompt for a save
     def prompt_save_and_quit(self):
         self.save()
+        self.scene_handler.clear_scene_cache()
+        autosave.flush()
         pyglet.app.exit()
     
+    # Quicksave (in memory, see snapshot.py)
+    
+    def quicksave(self):
+        if not snapshot.can_snapshot(self):
+            print "Can't quicksave here"
+            return
+        self.quicksave_snapshot = snapshot.Snapshot(self)
+        self.scene_handler.pin(self.quicksave_snapshot.scene)
+        print 'quicksave in %s' % self.quicksave_snapshot.scene.name
+    
+    def quickload(self):
+        if self.quicksave_snapshot is None or not snapshot.can_snapshot(self):
+            print "Can't quickload here"
+            return
+        self.quicksave_snapshot.restore()
+        print 'quickload in %s' % self.quicksave_snapshot.scene.name
+    
     # Serialization
     
     def dict_repr(self):
@@ -61,19 +106,20 @@ class GameHandler(object):
         """Returns a scene if save existed and was loaded successfully"""
         base_path = os.path.join(self.save_path, folder_name)
         scn = self.scene_handler.scene
-        if not os.path.exists(base_path):
+        if not autosave.exists(os.path.join(base_path, 'game')):
             return None
         else:
-            my_info = util.load_json(os.path.join(base_path, 'game'))
+            my_info = autosave.load(os.path.join(base_path, 'game'))
             self.game_variables = my_info['game_variables']
             return scene.Scene(my_info['first_scene'], self.scene_handler, self.ui,
                                load_path=os.path.join(base_path, my_info['first_scene']))
     
+    @tracing.traced('GameHandler.save')
     def save(self, folder_name="autosave"):
         base_path = os.path.join(self.save_path, folder_name)
         print 'save %s to %s' % (self.scene_handler.scene.name, base_path)
         scn = self.scene_handler.scene
         util.mkdir_if_absent(base_path)
-        util.save_json(self.dict_repr(), os.path.join(base_path, 'game'))
-        util.save_json(scn.dict_repr(), os.path.join(base_path, scn.name))
+        autosave.save(os.path.join(base_path, 'game'), copy.deepcopy(self.dict_repr()))
+        autosave.save(os.path.join(base_path, scn.name), scn.save_repr(), scn.name)
     
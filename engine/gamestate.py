@@ -10,6 +10,7 @@ camera_min = (norm_w//2, norm_h//2)
 camera_max = (norm_w, norm_h)
 
 event_manager = None
+scheduler = None
 
 keys = None
 
@@ -0,0 +1,148 @@
+"""
+Renders the glyphs the game will draw into pyglet's font textures during the loading screen.
+
+The first time a character is drawn in a font at a size, pyglet rasterizes it and uploads it to
+that font's texture, which shows up as a stall on the first lines of text. warm() does that
+work up front for:
+
+    speech bubbles      every spoken line in every .convo
+    CAM buttons         every choice in every .convo, plus the button numbers
+    large text          printable ASCII and credits.yaml, at the sizes the intro and credits use
+
+The characters needed per font and size (the manifest) are saved in the cache folder along
+with the modification times and sizes of the files they came from, so later runs only scan
+the dialogue again when it changes. pyglet can't be handed glyph bitmaps it didn't render, so
+the rendering itself happens on every run.
+
+Warmed fonts are kept referenced here. pyglet only holds on to the last few fonts loaded, and
+a dropped font takes its glyphs with it.
+"""
+
+import json, os, string
+
+import pyglet
+import yaml
+
+import bubbles, cam, convofile, convoprogram, gamestate, util
+from convoprogram import SPEAK, CHOICE
+from util import tracing
+
+manifest_version = 1
+
+# Title and caption sizes used by the intro and credits scenes, as fractions of norm_h
+large_text_font = ['Verdana', 'Helvetica']
+large_text_sizes = (0.045, 0.035)
+
+fonts = []      # Every warmed font
+
+def corpus_files():
+    """Every .convo and credits.yaml under game/. Folders that can't be read are skipped."""
+    paths = []
+    try:
+        scene_names = os.listdir('game')
+    except OSError:
+        return paths
+    for scene_name in sorted(scene_names):
+        folder = os.path.join('game', scene_name)
+        convo_folder = os.path.join(folder, 'convo')
+        try:
+            filenames = os.listdir(convo_folder) if os.path.isdir(convo_folder) else []
+        except OSError:
+            filenames = []
+        paths.extend(os.path.join(convo_folder, f) for f in sorted(filenames)
+                     if f.endswith('.convo'))
+        credits = os.path.join(folder, 'credits.yaml')
+        if os.path.exists(credits):
+            paths.append(credits)
+    return paths
+
+def stamp(paths):
+    result = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        result.append([path, st.st_mtime, st.st_size])
+    return result
+
+def _line_texts(line, speech, choices):
+    for op, arg in line:
+        if op == SPEAK:
+            speech.append(arg[1])
+        elif op == CHOICE:
+            for choice in arg:
+                choices.append(unicode(choice.text))
+                _line_texts(choice.line, speech, choices)
+
+def charset(texts):
+    return u''.join(sorted(set(c for c in u''.join(texts) if c >= u' ')))
+
+def scan(paths):
+    """Characters needed for speech, choices and large text"""
+    speech, choices, large = [], [], [unicode(string.printable)]
+    for path in paths:
+        if path.endswith('.convo'):
+            try:
+                program = convoprogram.load(path.replace(os.sep, '/'))
+            except convoprogram.ConvoError:
+                continue    # Reported when the conversation is started
+            for code in program.labels.itervalues():
+                for line in code:
+                    _line_texts(line, speech, choices)
+        else:
+            with open(path, 'r') as f:
+                for item in yaml.load(f, Loader=convofile.YAMLLoader) or []:
+                    large.extend(unicode(v) for v in item.itervalues())
+    choices.append(u'0123456789: ')
+    return {'speech': charset(speech), 'choices': charset(choices), 'large': charset(large)}
+
+def manifest_file():
+    folder = util.cache_path('glyphs')
+    if folder is None:
+        return None
+    return os.path.join(folder, 'manifest.json')
+
+def load_chars():
+    """Characters needed per kind of text, from the manifest if it is up to date"""
+    paths = corpus_files()
+    current = stamp(paths)
+    path = manifest_file()
+    if path and os.path.exists(path):
+        try:
+            with open(path, 'r') as f:
+                manifest = json.load(f)
+            if manifest['version'] == manifest_version and manifest['stamp'] == current:
+                return manifest['chars']
+        except (IOError, ValueError, KeyError):
+            pass
+
+    chars = scan(paths)
+    if path:
+        manifest = {'version': manifest_version, 'stamp': current, 'chars': chars}
+        try:
+            util.write_file_atomic(path, json.dumps(manifest))
+        except (IOError, OSError):
+            pass
+    return chars
+
+def font_specs(chars):
+    """(font names, size, characters) for every font that gets warmed"""
+    specs = [
+        (bubbles.font_name, bubbles.font_size, chars['speech']),
+        (cam.font_name, cam.font_size, chars['choices']),
+    ]
+    specs.extend((large_text_font, gamestate.norm_h*size, chars['large'])
+                 for size in large_text_sizes)
+    return specs
+
+def warm(progress=None):
+    """Render every needed glyph. progress(fraction) is called after each font."""
+    with tracing.span('glyphcache.warm'):
+        specs = font_specs(load_chars())
+        for i, (names, size, text) in enumerate(specs):
+            font = pyglet.font.load(names, size)
+            font.get_glyphs(text)
+            fonts.append(font)
+            if progress:
+                progress(float(i + 1)/len(specs))
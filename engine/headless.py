@@ -0,0 +1,344 @@
+"""
+Runs game logic without a window, GL context or audio device.
+
+install() replaces pyglet's sprite, batch, label, image and media classes with stand-ins that
+keep track of position, image, opacity and so on but never touch OpenGL or OpenAL. A NullWindow
+takes the place of the main window so that the event manager and scenes can push handlers and
+receive (injected) input events as usual.
+
+Nothing is drawn, so Scene.update, walk paths, interpolators and conversations run as fast as
+the CPU allows. This is meant for soak tests, regression checks and benchmarks:
+
+    import pyglet
+    pyglet.options['shadow_window'] = False
+    from engine import headless
+    headless.install()
+    game = headless.HeadlessGame('act1_scene1')
+    game.run_for(600.0)                     # Ten minutes of game time
+
+The shadow_window option has to be turned off before the engine package is imported, since
+importing pyglet.gl with the default options opens a hidden window and GL context.
+"""
+
+import struct
+
+import pyglet
+
+installed = False
+
+class StubImage(object):
+    """Stands in for a texture. Only knows its size and anchor."""
+    def __init__(self, width, height):
+        super(StubImage, self).__init__()
+        self.width = width
+        self.height = height
+        self.anchor_x = 0
+        self.anchor_y = 0
+        self.tex_coords = (0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 1.0, 1.0, 0.0, 0.0, 1.0, 0.0)
+
+    texture = property(lambda self: self)
+    owner = property(lambda self: self)
+
+    def get_texture(self, *args, **kwargs):
+        return self
+
+    def get_image_data(self):
+        return self
+
+    def get_data(self, fmt, pitch):
+        return _OpaquePixels(self.width*self.height*4)
+
+    def blit(self, *args, **kwargs):
+        pass
+
+
+class _OpaquePixels(object):
+    """Pixel data for a StubImage. Every pixel is fully opaque."""
+    def __init__(self, length):
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, i):
+        return 255
+
+
+class StubSprite(object):
+    def __init__(self, img, x=0, y=0, blend_src=None, blend_dest=None,
+                 batch=None, group=None, usage='dynamic'):
+        super(StubSprite, self).__init__()
+        self._image = img
+        self._frame_index = 0
+        self.x = x
+        self.y = y
+        self.batch = batch
+        self.group = group
+        self.scale = 1.0
+        self.rotation = 0.0
+        self.opacity = 255
+        self.color = (255, 255, 255)
+        self.visible = True
+
+    def _set_image(self, img):
+        self._image = img
+        self._frame_index = 0
+
+    image = property(lambda self: self._image, _set_image)
+
+    def _set_position(self, position):
+        self.x, self.y = position
+
+    position = property(lambda self: (self.x, self.y), _set_position)
+
+    def _current_frame(self):
+        try:
+            return self._image.frames[self._frame_index].image
+        except AttributeError:
+            return self._image
+
+    width = property(lambda self: self._current_frame().width*self.scale)
+    height = property(lambda self: self._current_frame().height*self.scale)
+
+    def _animate(self, dt):
+        pass
+
+    def delete(self):
+        self._image = None
+        self.batch = None
+
+    def draw(self):
+        pass
+
+
+class StubVertexList(object):
+    def __init__(self, count, data):
+        super(StubVertexList, self).__init__()
+        self.count = count
+        names = {'v': 'vertices', 'c': 'colors', 't': 'tex_coords'}
+        for fmt in data:
+            initial = None
+            if isinstance(fmt, tuple):
+                fmt, initial = fmt
+            size = int(fmt[1])
+            setattr(self, names.get(fmt[0], fmt[0]), list(initial or [0]*(count*size)))
+
+    def resize(self, count):
+        self.count = count
+
+    def delete(self):
+        pass
+
+
+class StubBatch(object):
+    def add(self, count, mode, group, *data):
+        return StubVertexList(count, data)
+
+    def add_indexed(self, count, mode, group, indices, *data):
+        return StubVertexList(count, data)
+
+    def draw(self):
+        pass
+
+
+class StubLabel(object):
+    """Stands in for pyglet.text.Label. Content size is estimated from the text."""
+    def __init__(self, text='', font_name=None, font_size=None, bold=False, italic=False,
+                 color=(255, 255, 255, 255), x=0, y=0, width=None, height=None,
+                 anchor_x='left', anchor_y='baseline', halign='left', multiline=False,
+                 dpi=None, batch=None, group=None):
+        super(StubLabel, self).__init__()
+        self.text = text
+        self.font_name = font_name
+        self.font_size = font_size or 12
+        self.color = color
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+        self.anchor_x = anchor_x
+        self.anchor_y = anchor_y
+        self.multiline = multiline
+        self.batch = batch
+
+    def _content_size(self):
+        char_w, line_h = self.font_size*0.6, self.font_size*1.5
+        lines = self.text.split('\n')
+        widest = max(len(line) for line in lines)*char_w
+        if self.multiline and self.width and widest > self.width:
+            num_lines = sum(int(len(line)*char_w/self.width)+1 for line in lines)
+            return self.width, num_lines*line_h
+        return widest, len(lines)*line_h
+
+    content_width = property(lambda self: self._content_size()[0])
+    content_height = property(lambda self: self._content_size()[1])
+
+    def begin_update(self):
+        pass
+
+    def end_update(self):
+        pass
+
+    def delete(self):
+        self.batch = None
+
+    def draw(self):
+        pass
+
+
+class StubSource(object):
+    def __init__(self, name):
+        super(StubSource, self).__init__()
+        self.name = name
+        self.duration = 0.0
+        self.audio_format = None
+        self.is_queued = False
+
+    def play(self):
+        player = StubPlayer()
+        player.queue(self)
+        player.play()
+        return player
+
+
+class StubPlayer(object):
+    def __init__(self):
+        super(StubPlayer, self).__init__()
+        self.sources = []
+        self.volume = 1.0
+        self.playing = False
+        self.eos_action = 'next'
+        self.time = 0.0
+
+    source = property(lambda self: self.sources[0] if self.sources else None)
+
+    def queue(self, source):
+        source.is_queued = True
+        self.sources.append(source)
+
+    def play(self):
+        self.playing = True
+
+    def pause(self):
+        self.playing = False
+
+    def next(self):
+        if self.sources:
+            self.sources.pop(0)
+
+    next_source = next
+
+    def seek(self, time):
+        self.time = time
+
+    def push_handlers(self, *args, **kwargs):
+        pass
+
+
+class NullWindow(pyglet.event.EventDispatcher):
+    """Receives and dispatches window events but has no on-screen presence"""
+    def __init__(self, width=1280, height=720):
+        super(NullWindow, self).__init__()
+        self.width = width
+        self.height = height
+        self.fullscreen = False
+        self.invalid = False
+
+    def set_caption(self, caption):
+        pass
+
+    def switch_to(self):
+        pass
+
+    def flip(self):
+        pass
+
+    def close(self):
+        pass
+
+
+_image_cache = {}
+
+def load_image(name, flip_x=False, flip_y=False, rotate=0):
+    """pyglet.resource.image replacement. Reads PNG dimensions without decoding anything."""
+    if not _image_cache.has_key(name):
+        f = pyglet.resource.file(name, 'rb')
+        try:
+            header = f.read(24)
+        finally:
+            f.close()
+        if header[:8] == '\x89PNG\r\n\x1a\n':
+            width, height = struct.unpack('>II', header[16:24])
+        else:
+            width, height = 1, 1
+        _image_cache[name] = StubImage(width, height)
+    return _image_cache[name]
+
+def load_media(name, streaming=True):
+    """pyglet.resource.media replacement. Fails the same way for missing files."""
+    pyglet.resource.location(name)
+    return StubSource(name)
+
+def install():
+    """Replace pyglet's GL- and audio-backed classes with the stand-ins above"""
+    global installed
+    if installed:
+        return
+    installed = True
+
+    pyglet.options['shadow_window'] = False
+    pyglet.options['audio'] = ('silent',)
+
+    from pyglet import window, sprite, graphics, text, media, resource
+    
+    NullWindow.event_types = list(window.Window.event_types)
+    
+    sprite.Sprite = StubSprite
+    graphics.Batch = StubBatch
+    graphics.draw = lambda *args, **kwargs: None
+    text.Label = StubLabel
+    media.Player = StubPlayer
+    resource.image = load_image
+    resource.media = load_media
+
+class HeadlessGame(object):
+    """A game with no window, driven one simulation tick at a time"""
+    def __init__(self, first_scene='title_screen', sim_rate=None, name='Space Train (headless)',
+                 reset_save=True, seed=None):
+        super(HeadlessGame, self).__init__()
+        install()
+
+        import engine
+        import gamestate, eventmanager, gamehandler, scheduler, replay
+
+        gamestate.main_window = self.window = NullWindow(gamestate.norm_w, gamestate.norm_h)
+        gamestate.init_scale()
+        gamestate.event_manager = eventmanager.EventManager()
+        gamestate.scheduler = self.scheduler = scheduler.Scheduler(sim_rate=sim_rate)
+        engine.init()
+        if seed is not None:
+            replay.seed_rng(seed)
+
+        self.game_handler = gamehandler.GameHandler(first_scene=first_scene, name=name,
+                                                    reset_save=reset_save)
+        self.scheduler.schedule_sim(self.game_handler.update)
+        self.recorder = None        # Set to a replay.Recorder to record dispatched input
+
+    scene = property(lambda self: self.game_handler.scene_handler.scene)
+
+    def run(self, ticks):
+        """Advance the simulation by a number of fixed ticks"""
+        step = self.scheduler.step
+        for i in xrange(ticks):
+            step()
+
+    def run_for(self, seconds):
+        """Advance the simulation by some amount of game time"""
+        self.run(int(seconds/self.scheduler.sim_t))
+
+    def dispatch_event(self, *args):
+        """Feed an input event to the game as if it came from the window"""
+        if self.recorder:
+            self.recorder.record(*args)
+        self.window.dispatch_event(*args)
+
@@ -1,6 +1,9 @@
+import copy
 import math
 import random
 
+from util import tracing
+
 class InterpolatorController(object):
     """Keeps track of the lifecycles of multiple interpolators"""
     def __init__(self):
@@ -13,6 +16,7 @@ class InterpolatorController(object):
     def delete(self):
         self.interpolators = set()
     
+    @tracing.traced('InterpolatorController.update_interpolators')
     def update_interpolators(self, dt=0):
         """Update all interpolators and remove those that have completed"""
         to_remove = set()
@@ -25,6 +29,22 @@ class InterpolatorController(object):
                 i.done_function(i)
         self.interpolators -= to_remove
     
+    def snapshot(self):
+        """Copies of the running interpolators, for restore()"""
+        return [copy.copy(i) for i in self.interpolators]
+    
+    def restore(self, snapshot, hosts=None):
+        """
+        Replace the running interpolators with copies of a snapshot's. hosts maps host objects
+        that have been replaced since the snapshot to their replacements.
+        """
+        self.interpolators.clear()
+        for i in snapshot:
+            i = copy.copy(i)
+            if hosts and i.host_object in hosts:
+                i.host_object = hosts[i.host_object]
+            self.interpolators.add(i)
+    
 
 class Interpolator(object):
     def __init__(self, host_object, attr_name, end, start=None, 
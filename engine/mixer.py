@@ -0,0 +1,263 @@
+"""
+Optional software mixer.
+
+With settings.software_mixer on and NumPy installed, every sound plays through one pyglet
+Player instead of an OpenAL source each. Channels stand in for Players: they take the same
+queue/play/pause/next calls and volume, and a mixer thread decodes whatever they are playing,
+sums it into blocks of 16-bit stereo and hands the blocks to the output player's source.
+
+Each channel belongs to a bus (music, ambience, sfx or voice) whose volume scales it. Music is
+ducked to duck_level while the current scene is in a conversation, ramping down and back up over
+duck_time. At most voice_limit channels are mixed; past that the lowest priority, oldest ones
+are stopped, so a burst of effects can't make mixing any more expensive.
+
+Without the mixer, player(bus) returns a plain pyglet Player and buses don't apply.
+"""
+
+import collections, threading, time
+
+import pyglet
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+rate = 44100
+block_frames = 1024
+queued_blocks = 4       # Blocks mixed ahead of the output player, about 90ms
+voice_limit = 12
+duck_level = 0.35
+duck_time = 0.5         # Seconds to duck or unduck all the way
+music_priority = 3      # Above every sound.PRIORITY_*, so effects never stop music
+
+buses = {'music': 1.0, 'ambience': 1.0, 'sfx': 1.0, 'voice': 1.0}
+
+active = False
+ducked = False          # Set by SceneHandler while a conversation is running
+
+lock = threading.Lock()     # Guards channels, their queues and whether they play; not decoding
+channels = []               # Every Channel with something queued
+output = None
+_blocks = collections.deque()
+_duck_gain = 1.0
+_plays = 0
+
+def decode(audio_data, audio_format):
+    """AudioData as float stereo frames"""
+    data = audio_data.get_string_data()
+    if audio_format.sample_size == 16:
+        samples = numpy.frombuffer(data, '<i2').astype(numpy.float32)/32768.0
+    else:
+        samples = (numpy.frombuffer(data, numpy.uint8).astype(numpy.float32) - 128.0)/128.0
+    channel_count = audio_format.channels
+    samples = samples[:len(samples) - len(samples) % channel_count].reshape(-1, channel_count)
+    if channel_count == 1:
+        samples = numpy.repeat(samples, 2, axis=1)
+    return samples
+
+class Channel(object):
+    """Stands in for a pyglet Player when the mixer is active"""
+    def __init__(self, bus, priority=music_priority):
+        super(Channel, self).__init__()
+        self.bus = bus
+        self.priority = priority
+        self.volume = 1.0
+        self.order = 0
+        self.sources = []       # Queued sources, the one playing first
+        self._playing = False
+        self._serial = 0        # Count of sources the queue has moved past
+
+        # Only the mixer thread uses these, without the lock
+        self._reader = None     # Queue source of the source at _reader_serial
+        self._reader_serial = None
+        self._pending = None    # Frames decoded at the source's rate but not mixed yet
+        self._phase = 0.0       # Position in _pending of the next frame to mix
+
+    source = property(lambda self: self.sources[0] if self.sources else None)
+    playing = property(lambda self: self._playing)
+
+    def queue(self, source):
+        with lock:
+            self.sources.append(source)
+            if self not in channels:
+                channels.append(self)
+
+    def play(self):
+        global _plays
+        with lock:
+            _plays += 1
+            self.order = _plays
+            self._playing = True
+
+    def pause(self):
+        with lock:
+            self._playing = False
+
+    def next(self):
+        with lock:
+            self._advance()
+
+    def _advance(self):
+        """Move past the current source, with the lock held. The mixer drops its reader later."""
+        if self.sources:
+            self.sources.pop(0)
+        self._serial += 1
+        if not self.sources and self in channels:
+            channels.remove(self)
+
+    def _stop(self):
+        while self.sources:
+            self._advance()
+
+    def _fill(self, frames):
+        """Decode until _pending holds frames frames, or the source ends"""
+        audio_format = self._reader.audio_format
+        chunks = [self._pending] if self._pending is not None else []
+        have = len(self._pending) if self._pending is not None else 0
+        while have < frames:
+            wanted = max(frames - have, block_frames)*audio_format.bytes_per_sample
+            audio_data = self._reader._get_audio_data(wanted)
+            if audio_data is None:
+                break
+            chunk = decode(audio_data, audio_format)
+            chunks.append(chunk)
+            have += len(chunk)
+        if chunks:
+            self._pending = numpy.concatenate(chunks)
+
+    def _read_source(self, source, serial, frames):
+        """Up to frames frames of source at the mixer rate, or None once it ends"""
+        if self._reader_serial != serial:
+            self._reader = source._get_queue_source()
+            self._reader_serial = serial
+            self._pending = None
+            self._phase = 0.0
+        audio_format = self._reader.audio_format
+        if audio_format is None:
+            return None
+        step = audio_format.sample_rate/float(rate)
+        self._fill(int(self._phase + (frames - 1)*step) + 2)
+        pending = self._pending
+        if pending is None or not len(pending):
+            return None
+
+        if step == 1.0 and self._phase == 0.0:
+            out = pending[:frames]
+            self._pending = pending[len(out):]
+            return out if len(out) else None
+
+        positions = self._phase + numpy.arange(frames)*step
+        positions = positions[positions <= len(pending) - 1]
+        if not len(positions):
+            return None
+        indices = numpy.arange(len(pending))
+        out = numpy.column_stack((numpy.interp(positions, indices, pending[:, 0]),
+                                  numpy.interp(positions, indices, pending[:, 1])))
+        following = positions[-1] + step
+        consumed = int(following)
+        self._pending = pending[consumed:]
+        self._phase = following - consumed
+        return out
+
+    def read(self, frames):
+        """
+        Up to frames frames at the mixer rate, moving through the queue as sources end.
+        Decoding can block on a stream, so the lock is only held to look at and change the queue.
+        """
+        out = []
+        needed = frames
+        while needed:
+            with lock:
+                if not self.sources:
+                    break
+                source, serial = self.sources[0], self._serial
+            data = self._read_source(source, serial, needed)
+            if data is None:
+                with lock:
+                    if self._serial == serial:  # Not moved on by next() meanwhile
+                        self._advance()
+            else:
+                out.append(data)
+                needed -= len(data)
+        return numpy.concatenate(out) if out else None
+
+def mix_block():
+    """The next block of output as 16-bit stereo"""
+    global _duck_gain
+    out = numpy.zeros((block_frames, 2), numpy.float32)
+    with lock:
+        target = duck_level if ducked else 1.0
+        change = (1.0 - duck_level)*block_frames/(rate*duck_time)
+        if _duck_gain > target:
+            _duck_gain = max(_duck_gain - change, target)
+        else:
+            _duck_gain = min(_duck_gain + change, target)
+
+        duck_gain = _duck_gain
+
+        sounding = [c for c in channels if c._playing]
+        if len(sounding) > voice_limit:
+            sounding.sort(key=lambda c: (c.priority, c.order), reverse=True)
+            for c in sounding[voice_limit:]:
+                c._stop()
+            sounding = sounding[:voice_limit]
+
+    for c in sounding:
+        data = c.read(block_frames)
+        if data is None:
+            continue
+        gain = c.volume*buses[c.bus]
+        if c.bus == 'music':
+            gain *= duck_gain
+        out[:len(data)] += data*gain
+    numpy.clip(out, -1.0, 1.0, out)
+    return (out*32767).astype('<i2').tostring()
+
+def run():
+    block_time = block_frames/float(rate)
+    while True:
+        if len(_blocks) < queued_blocks:
+            _blocks.append(mix_block())
+        else:
+            time.sleep(block_time/2)
+
+class MixerSource(pyglet.media.StreamingSource):
+    """Endless stream of the mixer's output"""
+    def __init__(self):
+        super(MixerSource, self).__init__()
+        self.audio_format = pyglet.media.AudioFormat(2, 16, rate)
+        self.video_format = None
+        self.timestamp = 0.0
+
+    def _get_audio_data(self, bytes):
+        try:
+            data = _blocks.popleft()
+        except IndexError:
+            data = '\0'*(block_frames*self.audio_format.bytes_per_sample)   # Fell behind
+        duration = len(data)/float(self.audio_format.bytes_per_second)
+        audio_data = pyglet.media.AudioData(data, len(data), self.timestamp, duration)
+        self.timestamp += duration
+        return audio_data
+
+def start():
+    """Route sound through the mixer from now on. Players made earlier are left alone."""
+    global active, output
+    if active:
+        return
+    if numpy is None:
+        print "Software mixer needs NumPy; playing sounds directly"
+        return
+    active = True
+    thread = threading.Thread(target=run, name='mixer')
+    thread.daemon = True
+    thread.start()
+    output = pyglet.media.Player()
+    output.queue(MixerSource())
+    output.play()
+
+def player(bus):
+    """Something to play a bus's sounds on: a Channel with the mixer, a Player without"""
+    if active:
+        return Channel(bus)
+    return pyglet.media.Player()
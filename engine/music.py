@@ -1,97 +1,262 @@
-import pyglet, functools
+"""
+Music and ambience.
+
+A DJ has two players, so a new track starts on the idle one while the old one fades out on
+the other and the two really overlap.
+
+Tracks are opened on a loader thread. prepare() asks for them ahead of time: GameHandler
+prepares the music of the current scene and of the scenes it leads to, as found in their
+scripts' play_music/play_background and notify calls, so starting a track doesn't wait for
+the file to be opened and decoded.
+
+Every track loops. The first loop_head seconds of each one are decoded once and kept, and a
+track that reaches its end carries on from that head while the loader thread seeks the stream
+to where the head ends, so loops restart without a gap.
+"""
+
+import Queue, functools, os, re, threading, traceback
+
+import pyglet
+
+import util, interpolator, mixer
+
+crossfade_time = 3.0
+loop_head = 2.0         # Seconds of each track kept decoded
+
+_heads = {}             # Track name: decoded audio from the start of the track
+
+class LoopingSource(pyglet.media.StreamingSource):
+    """Plays a stream forever, starting each loop from a decoded head"""
+    def __init__(self, stream, head):
+        super(LoopingSource, self).__init__()
+        self.stream = stream            # None if the whole track fits in the head
+        self.head = head
+        self.head_pos = 0
+        self.audio_format = stream.audio_format
+        self.video_format = None
+        self._duration = stream.duration
+        self.stream_ready = threading.Event()
+        self.stream_ready.set()
+
+    def rewind_stream(self):
+        """Loader thread: put the stream where the head ends"""
+        self.stream._seek(len(self.head)/float(self.audio_format.bytes_per_second))
+        self.stream_ready.set()
+
+    def _seek(self, timestamp):
+        # Players only ever seek back to the start
+        self.head_pos = 0
+        if self.stream:
+            self.stream_ready.clear()
+            loader.run_job(self.rewind_stream)
+
+    def _get_audio_data(self, bytes):
+        bytes_per_second = float(self.audio_format.bytes_per_second)
+        if self.head_pos < len(self.head):
+            bytes_per_sample = self.audio_format.bytes_per_sample
+            bytes = max(bytes - bytes % bytes_per_sample, bytes_per_sample)
+            data = self.head[self.head_pos:self.head_pos + bytes]
+            timestamp = self.head_pos/bytes_per_second
+            self.head_pos += len(data)
+            return pyglet.media.AudioData(data, len(data), timestamp, len(data)/bytes_per_second)
+        if self.stream:
+            self.stream_ready.wait()
+            audio_data = self.stream._get_audio_data(bytes)
+            if audio_data is not None:
+                return audio_data
+        elif not self.head:
+            return None
+        self._seek(0)
+        return self._get_audio_data(bytes)
+
+
+def read_head(stream):
+    """Decode the first loop_head seconds of a stream. Leaves the stream just after them."""
+    wanted = int(loop_head*stream.audio_format.bytes_per_second)
+    chunks = []
+    length = 0
+    while length < wanted:
+        audio_data = stream._get_audio_data(wanted - length)
+        if audio_data is None:
+            return ''.join(chunks), True
+        chunks.append(audio_data.get_string_data())
+        length += audio_data.length
+    return ''.join(chunks), False
+
+def open_track(name):
+    stream = pyglet.resource.media('music/%s.ogg' % name, streaming=True)
+    if stream.audio_format is None:
+        return stream       # Nothing to decode
+    if _heads.has_key(name):
+        head, whole_track = _heads[name]
+        if not whole_track:
+            stream._seek(len(head)/float(stream.audio_format.bytes_per_second))
+    else:
+        head, whole_track = _heads[name] = read_head(stream)
+    source = LoopingSource(stream, head)
+    if whole_track:
+        source.stream = None
+    return source
+
+
+class TrackLoader(object):
+    """Opens tracks and seeks streams on a background thread"""
+    def __init__(self):
+        super(TrackLoader, self).__init__()
+        self.jobs = Queue.Queue()
+        self.condition = threading.Condition()
+        self.ready = {}         # Track name: opened source that hasn't been played
+        self.pending = set()    # Track names being opened
+        self.thread = None
+
+    def run_job(self, job):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.work, name='music loader')
+            self.thread.daemon = True
+            self.thread.start()
+        self.jobs.put(job)
+
+    def work(self):
+        while True:
+            job = self.jobs.get()
+            try:
+                job()
+            except Exception:
+                traceback.print_exc()
+
+    def prepare(self, name):
+        with self.condition:
+            if name in self.ready or name in self.pending:
+                return
+            self.pending.add(name)
+        self.run_job(functools.partial(self.open, name))
+
+    def open(self, name):
+        try:
+            source = open_track(name)
+        except pyglet.resource.ResourceNotFoundException:
+            print "Missing music %s" % name
+            source = None
+        with self.condition:
+            self.pending.discard(name)
+            if source is not None:
+                self.ready[name] = source
+            self.condition.notify_all()
+
+    def get(self, name):
+        """A track ready to queue, opened now if it wasn't prepared"""
+        with self.condition:
+            while name in self.pending:
+                self.condition.wait()
+            source = self.ready.pop(name, None)
+        return source or open_track(name)
+
+loader = TrackLoader()
+
+
+# Script scanning
+
+_script_calls = {}
+
+call_patterns = {
+    'music': re.compile(r'''play_music\(\s*['"](\w+)['"]'''),
+    'background': re.compile(r'''play_background\(\s*['"](\w+)['"]'''),
+    'exits': re.compile(r'''notify\(\s*['"](\w+)['"]'''),
+}
+
+def script_calls(scene_name):
+    """Literal play_music, play_background and notify arguments in a scene's scripts"""
+    if not _script_calls.has_key(scene_name):
+        calls = {k: set() for k in call_patterns}
+        folder = os.path.join('game', scene_name)
+        try:
+            filenames = os.listdir(folder)
+        except OSError:
+            filenames = []
+        for filename in filenames:
+            if filename.endswith('.py'):
+                with open(os.path.join(folder, filename), 'r') as f:
+                    text = f.read()
+                for k, pattern in call_patterns.viewitems():
+                    calls[k].update(pattern.findall(text))
+        _script_calls[scene_name] = calls
+    return _script_calls[scene_name]
 
-import util, actionsequencer, interpolator
 
 class DJ(object):
     """Spin phat beatz yo"""
-    def __init__(self, handler, volume=1.0):
+    def __init__(self, handler, volume=1.0, bus='music'):
         super(DJ, self).__init__()
         self.handler = handler
         self.volume = volume
-        
-        self.player = pyglet.media.Player()
-        self.player.eos_action = 'loop'
-        self.player.volume = self.volume
-        
+
+        self.players = [mixer.player(bus), mixer.player(bus)]
+        self.player = self.players[0]       # Plays (or last played) the current track
+
         self.current_sound_name = ''
-        self.next_sound_name = ''
 
         self.res = util.respath_func_with_base_path('music')
-        
-        self.sound_cache = {}
 
-        self.seq = actionsequencer.ActionSequencer()
         self.interp = interpolator.InterpolatorController()
-        
+
         self.update = self.interp.update_interpolators
-    
+
     def get_sound(self, sound_name):
-        # if not self.sound_cache.has_key(sound_name):
-        #     self.sound_cache[sound_name] = pyglet.resource.media('music/%s.ogg' % sound_name, streaming=True)
-        # return self.sound_cache[sound_name]
-        return pyglet.resource.media('music/%s.ogg' % sound_name, streaming=True)
-    
-    def prime_cache(self, *args):
-        # Make sure that things are cached so we don't get nasty delays later
+        return loader.get(sound_name)
+
+    def prepare(self, *args):
+        """Open tracks in the background so that they start right away later"""
         for arg in args:
-            self.get_sound(arg)
-    
+            if arg != self.current_sound_name:
+                loader.prepare(arg)
+
+    prime_cache = prepare
+
+    def cancel_fades(self, player):
+        fades = [i for i in self.interp.interpolators if i.host_object is player]
+        self.interp.interpolators.difference_update(fades)
+
+    def fade(self, player, end, duration, done_function=None):
+        """Fade a player's volume from where it is now, replacing any fade already on it"""
+        self.cancel_fades(player)
+        fade = interpolator.LinearInterpolator(player, 'volume', start=player.volume, end=end,
+                                               name="volume", duration=duration,
+                                               done_function=done_function)
+        self.interp.add_interpolator(fade)
+
+    def stop(self, player):
+        self.cancel_fades(player)
+        player.pause()
+        while player.source:
+            player.next()
+
     def fade_out(self, time=3.0, next_sound=None):
-        self.next_sound_name = next_sound
-        fade_out = interpolator.LinearInterpolator(self.player, 'volume', 
-                                                   start=self.volume,
-                                                   end=0.0, name="volume", duration=time,
-                                                   done_function=self.next_track)
-        self.interp.add_interpolator(fade_out)
-    
+        if next_sound:
+            self.transition_to(next_sound)
+            return
+        player = self.player
+        self.current_sound_name = ''
+        self.fade(player, 0.0, time, done_function=lambda i: self.stop(player))
+
     def transition_to(self, sound_name, fade=True):
+        """Crossfade to a track. Without fade, it starts at full volume right away."""
+        if sound_name == self.current_sound_name and self.player.playing:
+            # Still playing, perhaps fading out; bring it back up
+            self.fade(self.player, self.volume, crossfade_time)
+            return
+
+        old = self.player
+        new = self.players[1] if old is self.players[0] else self.players[0]
+        self.stop(new)
+        new.queue(self.get_sound(sound_name))
         if fade:
-            self.next_sound_name = sound_name
-            self.fade_in(sound_name)
-        else:
-            new_sound = self.get_sound(sound_name)
-            if self.current_sound_name == sound_name:
-                if self.interp.interpolators:
-                    self.interp.delete()
-                fade_out = interpolator.LinearInterpolator(self.player, 'volume', 
-                                                           start=self.player.volume,
-                                                           end=self.volume, name="volume", 
-                                                           duration=3.0)
-                self.interp.add_interpolator(fade_out)
-            else:
-                if not new_sound.is_queued:
-                    self.player.queue(new_sound)
-                if self.player.playing:
-                    self.fade_out(next_sound=sound_name)
-                else:
-                    self.player.volume = self.volume
-                    self.player.play()
-    
-    def fade_in(self, sound_name):
-        new_sound = self.get_sound(sound_name)
-        if not new_sound.is_queued:
-            self.player.queue(new_sound)
-        if self.player.playing:
-            fade_out = interpolator.LinearInterpolator(self.player, 'volume', start=self.volume,
-                                                        end=0.0, name="volume", duration=5.0,
-                                                        done_function=self.fade_next_track)
-            self.interp.add_interpolator(fade_out)
+            new.volume = 0.0
+            self.fade(new, self.volume, crossfade_time)
         else:
-            self.player.volume = 0.0
-            self.fade_next_track()
-    
-    def fade_next_track(self, dt=0):
-        fade_in = interpolator.LinearInterpolator(self.player, 'volume', start=0.0,
-                                                    end=self.volume, name="volume", duration=3.0)
-        self.interp.add_interpolator(fade_in)
-        self.player.play()
-    
-    def next_track(self, dt=0):
-        if self.next_sound_name:
-            self.current_sound_name = self.next_sound_name
-            self.player.volume = 1.0
-            self.player.next()
-        else:
-            self.player.next()
-            self.player.pause()
-    
+            new.volume = self.volume
+        new.play()
+
+        if old.playing:
+            self.fade(old, 0.0, crossfade_time, done_function=lambda i: self.stop(old))
+        self.player = new
+        self.current_sound_name = sound_name
@@ -0,0 +1,107 @@
+"""
+Decoded audio for compressed sound effects, kept on disk so they load without a codec.
+
+Loading an .ogg or .mp3 as a static source decodes all of it through AVbin on the main thread.
+The first time that happens, the decoded PCM is written to the cache directory, headed by the
+audio format and a CRC32 of the compressed file. Later loads check the CRC against the file
+and memory-map the PCM instead of decoding it again; a file that has changed since is decoded
+and cached again.
+
+Mapped sources read straight from the mapping, so a sound's pages are only read in (and shared
+by every player it is queued on) when it is played.
+"""
+
+import mmap, os, struct, zlib
+
+import pyglet
+
+import util
+
+compressed = frozenset(['.ogg', '.mp3'])
+
+header = struct.Struct('<4sIiHHI')  # magic, version, CRC32 of the source, channels,
+                                    # sample size, sample rate
+magic = 'PCM '
+cache_version = 1
+
+class MappedSource(pyglet.media.StaticMemorySource):
+    """Static source over decoded audio in a memory-mapped cache file"""
+    def __init__(self, data, start, audio_format):
+        self._data = data
+        self._start = start
+        self._position = start
+        self._max_offset = len(data)
+        self.audio_format = audio_format
+        self._duration = (len(data) - start)/float(audio_format.bytes_per_second)
+
+    def _get_queue_source(self):
+        return MappedSource(self._data, self._start, self.audio_format)
+
+    def _seek(self, timestamp):
+        offset = int(timestamp*self.audio_format.bytes_per_second)
+        offset -= offset % self.audio_format.bytes_per_sample
+        self._position = min(self._start + offset, self._max_offset)
+
+    def _get_audio_data(self, bytes):
+        bytes -= bytes % self.audio_format.bytes_per_sample
+        data = self._data[self._position:self._position + bytes]
+        if not data:
+            return None
+        timestamp = (self._position - self._start)/float(self.audio_format.bytes_per_second)
+        self._position += len(data)
+        return pyglet.media.AudioData(data, len(data), timestamp,
+                                      len(data)/float(self.audio_format.bytes_per_second))
+
+
+def cache_file(name):
+    folder = util.cache_path('pcm')
+    if folder is None:
+        return None
+    return os.path.join(folder, '%s.pcm' % name.replace('/', '__'))
+
+def checksum(name):
+    with pyglet.resource.file(name, 'rb') as f:
+        return zlib.crc32(f.read())
+
+def read_cache(cached, crc):
+    """A MappedSource for a cache file if it is for this version of the source, else None"""
+    try:
+        with open(cached, 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (IOError, OSError, ValueError, mmap.error):
+        return None     # Missing, or empty
+    if len(data) < header.size:
+        data.close()
+        return None
+    tag, version, source_crc, channels, sample_size, sample_rate = header.unpack(
+        data[:header.size])
+    if tag != magic or version != cache_version or source_crc != crc:
+        data.close()
+        return None
+    audio_format = pyglet.media.AudioFormat(channels, sample_size, sample_rate)
+    return MappedSource(data, header.size, audio_format)
+
+def write_cache(cached, crc, source):
+    fmt = source.audio_format
+    try:
+        util.write_file_atomic(cached, header.pack(magic, cache_version, crc, fmt.channels,
+                                                   fmt.sample_size, fmt.sample_rate)
+                                       + source._data)
+    except (IOError, OSError):
+        pass
+
+def load(name):
+    """Static source for a sound resource, decoded from the cache if possible"""
+    if os.path.splitext(name)[1].lower() not in compressed:
+        return pyglet.resource.media(name, streaming=False)
+    cached = cache_file(name)
+    if cached is None:
+        return pyglet.resource.media(name, streaming=False)
+
+    crc = checksum(name)
+    source = read_cache(cached, crc)
+    if source is None:
+        source = pyglet.resource.media(name, streaming=False)
+        if getattr(source, 'audio_format', None) and hasattr(source, '_data'):
+            write_cache(cached, crc, source)
+    return source
@@ -0,0 +1,227 @@
+"""
+Performance overlay: frame, update and draw time split by subsystem, draw calls, texture binds,
+live sprites, interpolators and texture memory, plus a rolling frame time graph.
+
+Toggled with settings.perf_hud_key. Code that reports to the HUD does so behind a module flag:
+
+    if perfhud.active:
+        perfhud.lap('shadows')
+
+so while the HUD is hidden the cost is one attribute lookup per timing point. The draw call and
+texture bind counters are only patched into pyglet while it is shown. Live textures and sprites
+are tracked from startup if settings.perf_hud_key is set, and not at all if it is None.
+
+With settings.perf_hud_sync_gpu, each draw lap waits for the GPU (glFinish) so that time is
+charged to the subsystem that caused it. Frames take longer while the HUD is up as a result.
+"""
+
+import collections, timeit, weakref
+
+import pyglet
+from pyglet import gl
+
+import gamestate
+from util import draw, settings
+
+active = False
+timer = timeit.default_timer
+
+update_sections = ['update']
+draw_sections = ['env background', 'shadows', 'scene batch', 'overlay', 'convo bubbles',
+                 'ui/inventory/cam', 'scene transition']
+
+lap_totals = dict.fromkeys(update_sections + draw_sections, 0.0)
+_last_lap = [0.0]
+
+counts = {'draw calls': 0, 'texture binds': 0}
+_patched = []
+
+# Live textures (bytes each) and sprites. Tracked from startup, since they are created long
+# before anyone opens the HUD.
+textures = weakref.WeakKeyDictionary()
+sprites = weakref.WeakSet()
+_tracking = [False]
+
+graph_len = 240
+graph_h = 60.0
+graph_max_t = 0.050     # Frame time at the top of the graph
+
+def start_laps(sync=True):
+    if sync and settings.perf_hud_sync_gpu:
+        gl.glFinish()
+    _last_lap[0] = timer()
+
+def lap(name, sync=True):
+    """Charge the time since the last lap to name"""
+    if sync and settings.perf_hud_sync_gpu:
+        gl.glFinish()
+    t = timer()
+    lap_totals[name] += t - _last_lap[0]
+    _last_lap[0] = t
+
+
+# Counters
+
+def install_trackers():
+    """Keep track of live textures and sprites. Call before anything is loaded."""
+    if _tracking[0]:
+        return
+    _tracking[0] = True
+    texture_init = pyglet.image.Texture.__init__
+    def tracked_texture_init(self, width, height, *args, **kwargs):
+        texture_init(self, width, height, *args, **kwargs)
+        if not isinstance(self, pyglet.image.TextureRegion):
+            textures[self] = width*height*4
+    pyglet.image.Texture.__init__ = tracked_texture_init
+
+    sprite_init = pyglet.sprite.Sprite.__init__
+    def tracked_sprite_init(self, *args, **kwargs):
+        sprite_init(self, *args, **kwargs)
+        sprites.add(self)
+    pyglet.sprite.Sprite.__init__ = tracked_sprite_init
+
+    sprite_delete = pyglet.sprite.Sprite.delete
+    def tracked_sprite_delete(self):
+        sprites.discard(self)
+        sprite_delete(self)
+    pyglet.sprite.Sprite.delete = tracked_sprite_delete
+
+def _counted(func, counter):
+    def counted_func(*args):
+        counts[counter] += 1
+        return func(*args)
+    return counted_func
+
+def patch_gl_counters():
+    """Count GL draw and texture bind calls made by pyglet's graphics, image, sprite and text"""
+    import pyglet.graphics.vertexdomain, pyglet.text.layout
+    modules = [pyglet.graphics, pyglet.graphics.vertexdomain, pyglet.image, pyglet.sprite,
+               pyglet.text.layout]
+    functions = {
+        'glDrawArrays': 'draw calls',
+        'glDrawElements': 'draw calls',
+        'glMultiDrawArrays': 'draw calls',
+        'glMultiDrawElements': 'draw calls',
+        'glBindTexture': 'texture binds'
+    }
+    for module in modules:
+        for name, counter in functions.viewitems():
+            if hasattr(module, name):
+                original = getattr(module, name)
+                setattr(module, name, _counted(original, counter))
+                _patched.append((module, name, original))
+
+def unpatch_gl_counters():
+    while _patched:
+        module, name, original = _patched.pop()
+        setattr(module, name, original)
+
+
+class PerfHUD(object):
+    def __init__(self, game_handler):
+        super(PerfHUD, self).__init__()
+        self.game_handler = game_handler
+        self.frame_times = collections.deque([0.0]*graph_len, maxlen=graph_len)
+        self.last_frame = None
+        self.averages = dict.fromkeys(lap_totals, 0.0)
+        self.frame_avg = 0.0
+        self.frame_counts = dict(counts)
+
+        self.label = None
+        self.text_interval = 0.25
+        self.last_text = 0.0
+
+    def toggle(self):
+        global active
+        active = not active
+        if active:
+            install_trackers()      # Only counts what is made from now on, if not at startup
+            patch_gl_counters()
+            self.last_frame = None
+            for k in lap_totals:
+                lap_totals[k] = 0.0
+            for k in counts:
+                counts[k] = 0
+        else:
+            unpatch_gl_counters()
+            self.label = None
+
+    def interpolator_count(self):
+        scene_handler = self.game_handler.scene_handler
+        n = len(scene_handler.controller.interpolators)
+        n += len(self.game_handler.dj.interp.interpolators)
+        n += len(self.game_handler.background_dj.interp.interpolators)
+        for scn in scene_handler.scenes:
+            n += len(scn.interp.interpolators)
+        return n
+
+    def sample(self):
+        """Fold this frame's laps and counts into the running figures"""
+        now = timer()
+        if self.last_frame is not None:
+            frame_t = now - self.last_frame
+            self.frame_times.append(frame_t)
+            self.frame_avg = self.frame_avg*0.9 + frame_t*0.1
+        self.last_frame = now
+        for k, t in lap_totals.viewitems():
+            self.averages[k] = self.averages[k]*0.9 + t*0.1
+            lap_totals[k] = 0.0
+        self.frame_counts = dict(counts)
+
+    def make_text(self):
+        ms = lambda t: t*1000
+        drawn = sum(self.averages[k] for k in draw_sections)
+        lines = [
+            "frame   %6.2f ms  (%3.0f fps)" % (ms(self.frame_avg),
+                                              1.0/self.frame_avg if self.frame_avg else 0),
+            "update  %6.2f ms" % ms(self.averages['update']),
+            "draw    %6.2f ms" % ms(drawn),
+        ]
+        lines.extend("  %-17s %6.2f ms" % (k, ms(self.averages[k])) for k in draw_sections)
+        lines.extend([
+            "draw calls     %5d" % self.frame_counts['draw calls'],
+            "texture binds  %5d" % self.frame_counts['texture binds'],
+            "sprites        %5d" % len(sprites),
+            "interpolators  %5d" % self.interpolator_count(),
+            "texture memory %5.1f MB" % (sum(textures.itervalues())/1048576.0),
+        ])
+        return '\n'.join(lines)
+
+    def draw(self, alpha=1.0):
+        """Drawn after everything else, in window coordinates"""
+        if not active:
+            return
+        self.sample()
+
+        now = timer()
+        if self.label is None or now - self.last_text >= self.text_interval:
+            self.last_text = now
+            if self.label is None:
+                self.label = pyglet.text.Label('', font_size=10, multiline=True, width=300,
+                                               anchor_y='top', color=(255,255,255,255))
+            self.label.text = self.make_text()
+
+        w, h = gamestate.main_window.width, gamestate.main_window.height
+        x, y = 10, h - 10
+        draw.set_color(0, 0, 0, 0.6)
+        draw.rect(x - 5, y + 5, x + max(graph_len, 300), y - self.label.content_height - graph_h - 15)
+        self.label.x, self.label.y = x, y
+        self.label.draw()
+
+        # Frame time graph with 60 fps and 30 fps lines
+        gy = y - self.label.content_height - graph_h - 10
+        draw.set_color(0.4, 0.4, 0.4, 1)
+        for t in (1/60.0, 1/30.0):
+            ly = gy + graph_h*t/graph_max_t
+            draw.line(x, ly, x + graph_len, ly)
+        points = []
+        for i, t in enumerate(self.frame_times):
+            points.extend((x + i, gy + graph_h*min(t, graph_max_t)/graph_max_t))
+        draw.set_color(0.3, 1, 0.3, 1)
+        pyglet.graphics.draw(len(self.frame_times), gl.GL_LINE_STRIP, ('v2f', points))
+        draw.set_color(1, 1, 1, 1)
+
+        # The HUD's own draw calls aren't part of the frame being measured
+        for k in counts:
+            counts[k] = 0
+
@@ -0,0 +1,84 @@
+"""
+Loads everything a conversation could need before it starts, so that dialogue does no I/O.
+
+A compiled convo (see convoprogram.py) knows its speakers, the animation states it can put
+actors in, the sounds it can play and the items it can give, whichever branches are taken.
+convo_assets() resolves those against a scene's actors:
+
+    speaking    actor names whose speak.wav is played
+    states      (actor name, state) pairs
+    sounds      play_sound names
+    actors      actor names created by give, whose images and icon are loaded
+    effects     the give and take sound effects, if used
+
+Scene scripts can prefetch a conversation they are about to start:
+
+    myscene.prefetch_conversation('briggs_exposition')
+
+The scene also does it on its own. When main finishes a walk path move on or next to the
+stand_at point of one of the scene's conversations, that conversation is prefetched, and every
+conversation is prefetched when it begins if it wasn't already.
+"""
+
+import os
+
+import actor, convoprogram, sound
+from util import tracing
+
+def convo_assets(program, scn):
+    """Every asset a conversation could touch in a scene, as a dictionary of sets"""
+    names = {identifier: act.name for identifier, act in scn.actors.viewitems()}
+    return {
+        'speaking': set(names[i] for i in program.speakers if i in names),
+        'states': set((names[i], state) for i, state in program.states if i in names),
+        'sounds': set(program.sounds),
+        'actors': set(name for name, identifier in program.given),
+        'effects': set((['give'] if program.given else []) + (['take'] if program.taken else [])),
+    }
+
+def load_assets(assets, scn):
+    """Load and cache everything in a convo_assets() dictionary"""
+    for name in assets['actors']:
+        actor.load_static_info(name)
+        actor.load_icon(name)
+    for name in assets['speaking']:
+        sound.load(actor.speaking_sound(name), optional=True)
+    for name, state in assets['states']:
+        actor.load_state(name, state)
+    sound.preload(*assets['sounds'])
+    sound.preload(*assets['effects'])
+
+def prefetch(scn, convo_name):
+    with tracing.span('prefetch %s' % convo_name):
+        program = convoprogram.load(scn.resource_path("convo/%s.convo" % convo_name))
+        load_assets(convo_assets(program, scn), scn)
+
+def convos_by_stand_point(scn):
+    """Names of a scene's conversations, keyed by their stand_at point"""
+    result = {}
+    try:
+        filenames = os.listdir(scn.resource_path('convo'))
+    except OSError:
+        return result
+    for filename in sorted(filenames):
+        convo_name, ext = os.path.splitext(filename)
+        if ext != '.convo':
+            continue
+        try:
+            program = convoprogram.load(scn.resource_path('convo', filename))
+        except convoprogram.ConvoError:
+            # Reported properly if the conversation is ever started
+            continue
+        if program.stand_at is not None:
+            result.setdefault(program.stand_at, []).append(convo_name)
+    return result
+
+def points_near(walkpath, point):
+    """A walk path point and the points it shares an edge with"""
+    near = set([point])
+    for a, b in walkpath.edges:
+        if a == point:
+            near.add(b)
+        elif b == point:
+            near.add(a)
+    return near
@@ -0,0 +1,158 @@
+"""
+Records the input of a playthrough so that it can be replayed exactly, and times the replay.
+
+A recording holds the first scene, the simulation rate, the random seed and every input event
+the window received, stamped with the simulation tick it arrived after. The simulation only
+advances in fixed ticks and all of its randomness comes from the seeded random module, so
+feeding the same events in before the same ticks reproduces the run.
+
+    python Adventure.py act1_scene1 --record run.json
+    python AdventureReplay.py run.json [--headless] [--timings frames.csv]
+
+While replaying, every frame runs exactly one simulation tick and one draw, however long they
+take, and the time spent in each is kept per frame.
+"""
+
+import json, random, timeit
+
+import convo, gamestate
+
+version = 1
+
+# Only these are recorded. Everything else the window sees (resizes, draws) is not input.
+input_events = frozenset(['on_mouse_press', 'on_mouse_release', 'on_mouse_drag',
+                          'on_mouse_motion', 'on_mouse_scroll', 'on_key_press',
+                          'on_key_release', 'on_text', 'on_text_motion'])
+
+# Number of leading arguments that are window coordinates. They are stored in game units
+# (divided by gamestate.scale_factor) so that a run can be replayed at another window size.
+coordinate_args = {
+    'on_mouse_press': 2,
+    'on_mouse_release': 2,
+    'on_mouse_drag': 4,
+    'on_mouse_motion': 4,
+    'on_mouse_scroll': 2,
+}
+
+timer = timeit.default_timer
+
+def new_seed():
+    return random.SystemRandom().randrange(2**31)
+
+def seed_rng(seed):
+    """Seed everything random in the simulation: random itself and the convo speaker colors"""
+    random.seed(seed)
+    convo.reset_colors()
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values)*fraction), len(values)-1)]
+
+
+class Recorder(object):
+    """Stamps input events with the current tick and writes them out on save()"""
+    def __init__(self, path, first_scene, scheduler, seed):
+        super(Recorder, self).__init__()
+        self.path = path
+        self.scheduler = scheduler
+        self.info = {
+            'version': version,
+            'first_scene': first_scene,
+            'sim_rate': int(round(1.0/scheduler.sim_t)),
+            'seed': seed,
+            'norm_w': gamestate.norm_w,
+            'norm_h': gamestate.norm_h,
+            'events': []
+        }
+
+    def record(self, name, *args):
+        if name not in input_events:
+            return
+        args = list(args)
+        n = coordinate_args.get(name, 0)
+        args[:n] = [a/gamestate.scale_factor for a in args[:n]]
+        self.info['events'].append([self.scheduler.ticks, name, args])
+
+    def save(self):
+        self.info['end_tick'] = self.scheduler.ticks
+        with open(self.path, 'w') as f:
+            json.dump(self.info, f)
+        print 'Recorded %d events over %d ticks to %s' % (len(self.info['events']),
+                                                          self.info['end_tick'], self.path)
+
+
+class Replayer(object):
+    """Feeds recorded events back in, one simulation tick per frame"""
+    def __init__(self, path):
+        super(Replayer, self).__init__()
+        with open(path, 'r') as f:
+            self.info = json.load(f)
+        if self.info.get('version') != version:
+            raise ValueError("%s is a version %s recording, expected version %d" % (
+                             path, self.info.get('version'), version))
+        self.events = self.info['events']
+        self.next_event = 0
+        self.scheduler = None
+        self.injecting = False      # True while dispatching recorded (not live) input
+        self.frames = []            # (tick, number of events, update seconds, draw seconds)
+
+    first_scene = property(lambda self: self.info['first_scene'])
+    sim_rate = property(lambda self: self.info['sim_rate'])
+    seed = property(lambda self: self.info['seed'])
+    finished = property(lambda self: self.scheduler.ticks >= self.info['end_tick'])
+
+    def start(self, scheduler):
+        self.scheduler = scheduler
+        if (self.info['norm_w'], self.info['norm_h']) != (gamestate.norm_w, gamestate.norm_h):
+            print "Warning: recorded at %dx%d game units, replaying at %dx%d" % (
+                self.info['norm_w'], self.info['norm_h'], gamestate.norm_w, gamestate.norm_h)
+
+    def run_frame(self, dispatch_event, draw=None):
+        """Dispatch this tick's events, step once and draw once, timing both halves"""
+        ticks = self.scheduler.ticks
+        num_events = 0
+        t = timer()
+        self.injecting = True
+        while self.next_event < len(self.events) and self.events[self.next_event][0] <= ticks:
+            tick, name, args = self.events[self.next_event]
+            n = coordinate_args.get(name, 0)
+            args = [a*gamestate.scale_factor for a in args[:n]] + args[n:]
+            dispatch_event(str(name), *args)
+            self.next_event += 1
+            num_events += 1
+        self.injecting = False
+        self.scheduler.step()
+        update_t = timer() - t
+
+        draw_t = 0.0
+        if draw is not None:
+            t = timer()
+            draw()
+            draw_t = timer() - t
+        self.frames.append((ticks, num_events, update_t, draw_t))
+
+    def run(self, dispatch_event, draw=None):
+        while not self.finished:
+            self.run_frame(dispatch_event, draw)
+
+
+    # Results
+
+    def report(self):
+        update_ts = [f[2] for f in self.frames]
+        draw_ts = [f[3] for f in self.frames]
+        print "Replayed %d frames, %d events" % (len(self.frames), self.next_event)
+        for label, ts in (('update', update_ts), ('draw', draw_ts)):
+            if any(ts):
+                print "  %-6s mean %7.3fms  p50 %7.3fms  p95 %7.3fms  max %7.3fms  total %0.3fs" % (
+                    label, sum(ts)/len(ts)*1000, percentile(ts, 0.5)*1000,
+                    percentile(ts, 0.95)*1000, max(ts)*1000, sum(ts))
+
+    def save_timings(self, path):
+        with open(path, 'w') as f:
+            f.write('frame,tick,events,update_ms,draw_ms\n')
+            for i, (tick, num_events, update_t, draw_t) in enumerate(self.frames):
+                f.write('%d,%d,%d,%0.4f,%0.4f\n' % (i, tick, num_events, update_t*1000, draw_t*1000))
+
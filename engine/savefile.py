@@ -0,0 +1,207 @@
+"""
+Binary save container: the game variables and every scene's state in one versioned file.
+
+Layout (little endian):
+
+    header      magic 'STSV', format version (H), flags (H), string table length (I),
+                section count (I)
+    strings     UTF-8, separated by NUL characters
+    index       for each section: name (string number, I), offset in file (I), length (I)
+    sections    one encoded value each, zlib compressed if flags has COMPRESSED
+
+Every string in the file (dictionary keys, actor names, walk path point ids, states) is stored
+once in the string table and referred to by number, so a name repeated across actors and scenes
+costs a few bytes. Opening a file reads the header, strings and index; a section is only
+decompressed and decoded when it is asked for, so loading a save only decodes the scene that is
+being entered.
+
+Values are JSON-like and tagged with one byte:
+
+    N None      T True      F False
+    i int (i)   q long (q)  d float (d)
+    s string (string number, I)
+    l list (count, I) then the items
+    m dict (count, I) then key, value pairs
+"""
+
+import struct, zlib
+
+magic = 'STSV'
+version = 1
+
+COMPRESSED = 1
+
+header = struct.Struct('<4sHHII')
+index_entry = struct.Struct('<III')
+_int = struct.Struct('<i')
+_long = struct.Struct('<q')
+_float = struct.Struct('<d')
+_count = struct.Struct('<I')
+
+class SaveFormatError(Exception):
+    pass
+
+
+# Encoding
+
+class StringTable(object):
+    def __init__(self):
+        super(StringTable, self).__init__()
+        self.strings = []
+        self.numbers = {}
+
+    def number(self, s):
+        if isinstance(s, str):
+            s = s.decode('utf-8')
+        if s not in self.numbers:
+            if u'\0' in s:
+                raise ValueError("Can't save strings with NUL characters: %r" % s)
+            self.numbers[s] = len(self.strings)
+            self.strings.append(s)
+        return self.numbers[s]
+
+def _encode(value, strings, out):
+    if value is None:
+        out.append('N')
+    elif value is True:
+        out.append('T')
+    elif value is False:
+        out.append('F')
+    elif isinstance(value, (int, long)):
+        if -2**31 <= value < 2**31:
+            out.append('i' + _int.pack(value))
+        else:
+            out.append('q' + _long.pack(value))
+    elif isinstance(value, float):
+        out.append('d' + _float.pack(value))
+    elif isinstance(value, basestring):
+        out.append('s' + _count.pack(strings.number(value)))
+    elif isinstance(value, (list, tuple)):
+        out.append('l' + _count.pack(len(value)))
+        for item in value:
+            _encode(item, strings, out)
+    elif isinstance(value, dict):
+        out.append('m' + _count.pack(len(value)))
+        for k, v in value.iteritems():
+            _encode(k, strings, out)
+            _encode(v, strings, out)
+    else:
+        raise TypeError("Can't save %r" % (value,))
+
+def dumps(sections, compress=True):
+    """A save file holding sections, a dictionary of section name: value"""
+    strings = StringTable()
+    blobs = []
+    for name, value in sorted(sections.iteritems()):
+        out = []
+        _encode(value, strings, out)
+        blob = ''.join(out)
+        if compress:
+            blob = zlib.compress(blob)
+        blobs.append((strings.number(name), blob))
+
+    table = u'\0'.join(strings.strings).encode('utf-8')
+
+    offset = header.size + len(table) + index_entry.size*len(blobs)
+    index = []
+    for name_number, blob in blobs:
+        index.append(index_entry.pack(name_number, offset, len(blob)))
+        offset += len(blob)
+    flags = COMPRESSED if compress else 0
+    return ''.join([header.pack(magic, version, flags, len(table), len(blobs)),
+                    table] + index + [blob for name_number, blob in blobs])
+
+
+# Decoding
+
+def _decode(data, pos, strings):
+    tag = data[pos]
+    pos += 1
+    if tag == 's':
+        return strings[_count.unpack_from(data, pos)[0]], pos + 4
+    elif tag == 'i':
+        return _int.unpack_from(data, pos)[0], pos + 4
+    elif tag == 'm':
+        count = _count.unpack_from(data, pos)[0]
+        pos += 4
+        d = {}
+        for i in xrange(count):
+            k, pos = _decode(data, pos, strings)
+            d[k], pos = _decode(data, pos, strings)
+        return d, pos
+    elif tag == 'l':
+        count = _count.unpack_from(data, pos)[0]
+        pos += 4
+        items = []
+        for i in xrange(count):
+            item, pos = _decode(data, pos, strings)
+            items.append(item)
+        return items, pos
+    elif tag == 'd':
+        return _float.unpack_from(data, pos)[0], pos + 8
+    elif tag == 'N':
+        return None, pos
+    elif tag == 'T':
+        return True, pos
+    elif tag == 'F':
+        return False, pos
+    elif tag == 'q':
+        return _long.unpack_from(data, pos)[0], pos + 8
+    raise SaveFormatError("Unknown value tag %r at %d" % (tag, pos - 1))
+
+class SaveFile(object):
+    """A save file's string table and section index. Sections are decoded when asked for."""
+    def __init__(self, data):
+        super(SaveFile, self).__init__()
+        try:
+            file_magic, file_version, self.flags, table_length, section_count = \
+                header.unpack_from(data, 0)
+        except struct.error:
+            raise SaveFormatError("Save file is truncated")
+        if file_magic != magic:
+            raise SaveFormatError("Not a save file")
+        if file_version > version:
+            raise SaveFormatError("Save file is from a newer version (%d)" % file_version)
+        self.data = data
+
+        pos = header.size + table_length
+        if pos > len(data):
+            raise SaveFormatError("Save file is truncated")
+        try:
+            self.strings = data[header.size:pos].decode('utf-8').split(u'\0')
+        except UnicodeDecodeError:
+            raise SaveFormatError("Save file's string table is damaged")
+
+        self.index = {}     # Section name: (offset, length)
+        try:
+            for i in xrange(section_count):
+                name_number, offset, length = index_entry.unpack_from(data, pos)
+                pos += index_entry.size
+                if offset + length > len(data):
+                    raise SaveFormatError("Save file is truncated")
+                self.index[self.strings[name_number]] = (offset, length)
+        except (struct.error, IndexError):
+            raise SaveFormatError("Save file's index is damaged")
+
+    def names(self):
+        return self.index.keys()
+
+    def has_section(self, name):
+        return name in self.index
+
+    def section(self, name):
+        offset, length = self.index[name]
+        blob = self.data[offset:offset + length]
+        try:
+            if self.flags & COMPRESSED:
+                blob = zlib.decompress(blob)
+            return _decode(blob, 0, self.strings)[0]
+        except (zlib.error, struct.error, IndexError, TypeError):
+            raise SaveFormatError("Section %s of the save file is damaged" % name)
+
+    def sections(self):
+        return {name: self.section(name) for name in self.index}
+
+def read(path):
+    with open(path, 'rb') as f:
+        return SaveFile(f.read())
@@ -30,15 +30,19 @@ import importlib
 import pyglet
 import functools
 import itertools
+import types
+import copy
 
 import camera, actor, gamestate, util, interpolator, convo
-from util import walkpath, zenforcer, pushmatrix, shadow, draw
+from util import walkpath, zenforcer, pushmatrix, shadow, draw, tracing
 
-import cam, environment, gamehandler, scenehandler, sound
+import autosave, cam, environment, gamehandler, perfhud, prefetch, scenehandler, sound
 
 from pyglet.window import key
 
-update_t = 1/120.0
+# Sprites that move further than this in one tick were placed, not walked, so they are not
+# interpolated between ticks
+max_interp_dist_sq = 100.0**2
 
 class ClipGroup(pyglet.graphics.OrderedGroup): 
     """Sprite group that clips to a rectangle"""
@@ -57,15 +61,28 @@ class ClipGroup(pyglet.graphics.OrderedGroup):
         pyglet.gl.glDisable(pyglet.gl.GL_SCISSOR_TEST)
     
 
+def copy_value(v):
+    """Copy containers, so that a snapshot isn't changed along with the live value"""
+    if isinstance(v, (list, dict, set)):
+        return copy.copy(v)
+    return v
+
 class Scene(object):
     
     # Initialization
     
-    def __init__(self, name, scene_handler=None, ui=None, load_path=None, clip=True):
+    @tracing.traced('Scene.__init__')
+    def __init__(self, name, scene_handler=None, ui=None, load_path=None, clip=True,
+                 staged=False):
+        """
+        With staged, only the cheap setup happens here. load_step() then runs the rest a slice at
+        a time, and finish_loading() must be called before the scene is shown.
+        """
         super(Scene, self).__init__()
         self.name = name
         self.handler = scene_handler
         self.batch = pyglet.graphics.Batch()
+        self.bubble_batch = pyglet.graphics.Batch()     # Conversation speech bubbles
         self.fresh = (load_path is None)
         if clip:
             self.main_group = ClipGroup(w=gamestate.main_window.width, 
@@ -79,17 +96,21 @@ class Scene(object):
         self.blackout = False
         
         self.game_time = 0.0
-        self.accum_time = 0.0
         self.clock = pyglet.clock.Clock(time_function=lambda: self.game_time)
         self.paused = False
+        self.suspended = False      # In SceneHandler's scene cache (see simulate())
+        self.pending_conversation = None    # Started by a script while suspended
         self.x_offset = 0.0
         self.y_offset = 0.0
         
-        self.sound_player = sound.Sound()
         self.shadow = shadow.ShadowManager()
         
         self.moving_camera = False
         
+        # Positions as of the previous simulation tick, for render interpolation
+        self.last_positions = {}
+        self.last_camera_position = None
+        
         self.resource_path = util.respath_func_with_base_path('game', self.name)
         
         self.init_clock()
@@ -97,20 +118,69 @@ class Scene(object):
         self.interp = interpolator.InterpolatorController()
         self.convo = convo.Conversation(self)
         self.background_convos = set()
+        self.prefetched_convos = set()
+        self.convos_by_stand_point = None   # Built on the first walk path move
         self.init_convenience_bindings()
         
-        self.load_info(load_path)
-        self.initialize_from_info()
-        self.load_actors()
-        self.zenforcer.init_groups()
+        self.loading = self.load_stages(load_path)  # None once every stage has run
+        if not staged:
+            self.finish_loading()
+    
+    def load_stages(self, load_path):
+        """Loading work that doesn't touch shared state, yielding between pieces"""
+        with tracing.span('Scene.__init__ load_info'):
+            self.load_info(load_path)
+        yield
+        with tracing.span('Scene.__init__ initialize_from_info'):
+            self.initialize_from_info()
+        yield
+        for identifier, attrs in self.info['actors'].viewitems():
+            with tracing.span('Scene.__init__ load_actor'):
+                self.load_actor(identifier, attrs)
+            yield
+        # info.json's preload_states: {actor identifier: [states scripts or convos switch to]}
+        hints = self.info.get('preload_states', {})
+        for identifier, act in self.actors.items():
+            with tracing.span('Scene.__init__ preload_states'):
+                act.preload_states(hints.get(identifier, ()))
+            yield
+        with tracing.span('Scene.__init__ init_groups'):
+            self.update_shadows()
+            self.zenforcer.init_groups()
+    
+    def load_step(self, stages=None):
+        """
+        Run up to stages loading stages, or all that are left. Returns True once they have all
+        run. Counting stages rather than timing them keeps loading the same number of ticks on
+        every machine, which replays and headless runs rely on.
+        """
+        if self.loading is None:
+            return True
+        for i, _ in enumerate(self.loading, 1):
+            if stages is not None and i >= stages:
+                return False
+        self.loading = None
+        return True
+    
+    def finish_loading(self):
+        """
+        Run any stages left, then the scene script. The script sets up shared state (music, the
+        inventory, state.myscene), so it runs when the scene is about to be shown.
+        """
+        self.load_step()
         
         if gamestate.scripts_enabled:
-            self.load_script()
+            with tracing.span('Scene.__init__ load_script'):
+                self.load_script()
         
-        for i in xrange(10):
-            self.zenforcer.update()
+        with tracing.span('Scene.__init__ settle'):
+            for i in xrange(10):
+                self.zenforcer.update()
+            self.update(0)
         
-        self.update(0)
+        if self.pending_conversation:
+            # Once whatever the scene does on entry has had a moment to start
+            self.clock.schedule_once(self.begin_pending_conversation, 1.0)
     
     def init_convenience_bindings(self):
         self.add_interpolator = self.interp.add_interpolator
@@ -133,17 +203,20 @@ class Scene(object):
     def load_actors(self):
         """Initialize actors and update them with any values specified in the info dict"""
         for identifier, attrs in self.info['actors'].viewitems():
-            # Initialize and store
-            new_actor = actor.Actor(name=attrs['name'], identifier=identifier, 
-                                    scene=self, attrs=attrs)
-            
-            # Obey walk paths
-            if attrs.has_key('walkpath_point'):
-                new_actor.walkpath_point = attrs['walkpath_point']
-                new_actor.sprite.position = self.walkpath.points[new_actor.walkpath_point]
-            self.add_actor(new_actor, reset_shadows=False)
+            self.load_actor(identifier, attrs)
         self.update_shadows()
     
+    def load_actor(self, identifier, attrs):
+        # Initialize and store
+        new_actor = actor.Actor(name=attrs['name'], identifier=identifier, 
+                                scene=self, attrs=attrs)
+        
+        # Obey walk paths
+        if attrs.has_key('walkpath_point'):
+            new_actor.walkpath_point = attrs['walkpath_point']
+            new_actor.sprite.position = self.walkpath.points[new_actor.walkpath_point]
+        self.add_actor(new_actor, reset_shadows=False)
+    
     def update_shadows(self):
         self.shadow.set_targets([a.sprite for a in self.actors.viewvalues() if a.casts_shadow])
     
@@ -164,6 +237,65 @@ class Scene(object):
     
     # Cleanup
     
+    def suspend(self):
+        """
+        Stop a scene without destroying it, for SceneHandler's scene cache. Only simulate()
+        moves it on until wake() is called, and finish_loading() then runs its script as if it
+        had been loaded from a save.
+        """
+        self.suspended = True
+        self.stop_animations()
+        pyglet.clock.unschedule(self.zenforcer.update)
+        for c in self.background_convos:
+            c.delete()
+        self.background_convos = set()
+        self.fresh = False
+        self.paused = False
+        self.x_offset = 0.0
+        self.y_offset = 0.0
+        self.last_positions = {}
+        self.last_camera_position = None
+    
+    def wake(self):
+        """Undo suspend() before the scene is shown again"""
+        self.settle()
+        self.suspended = False
+        self.last_positions = {}
+        for act in self.actors.viewvalues():
+            if hasattr(act.sprite.image, 'frames'):
+                act.sprite.image = act.sprite.image     # Restarts the animation
+    
+    def settle(self):
+        """
+        Put a suspended scene the way loading it from its autosave would, since finish_loading()
+        runs the script again as if it had been: no conversation, nothing queued or moving, and
+        nothing on the clock. Actors on the walk path stand at the point they were heading for.
+        """
+        self.convo.abandon()
+        self.interp.interpolators.clear()
+        util.clear_clock(self.clock)
+        for act in self.actors.viewvalues():
+            act.actions.clear()
+            act.blocking_actions = 0
+            if act.walkpath_point:
+                act.sprite.position = self.walkpath.points[act.walkpath_point]
+    
+    def stop_animations(self):
+        for act in self.actors.viewvalues():
+            pyglet.clock.unschedule(act.sprite._animate)
+    
+    def texture_memory(self):
+        """Rough bytes of texture used by the environment and the actors' current images"""
+        sizes = {}
+        sprites = self.env.background_sprites + self.env.overlay_sprites
+        sprites.extend(act.sprite for act in self.actors.viewvalues())
+        for sprite in sprites:
+            img = sprite.image
+            frames = [f.image for f in img.frames] if hasattr(img, 'frames') else [img]
+            for frame in frames:
+                sizes[id(frame)] = frame.width*frame.height*4
+        return sum(sizes.itervalues())
+    
     def exit(self):
         pyglet.clock.unschedule(self.zenforcer.update)
         for convo in self.background_convos:
@@ -200,6 +332,8 @@ class Scene(object):
         if self.paused:
             return
         
+        if event == util.const.WALK_PATH_COMPLETED and args[0]['actor'].identifier == 'main':
+            self.prefetch_near(args[0]['point'])
         self.module.handle_event(event, *args, **kwargs)
     
     def call_if_available(self, func_name, *args, **kwargs):
@@ -214,9 +348,23 @@ class Scene(object):
         self.module.transition_from(old_scene_name)
     
     def begin_conversation(self, convo_name):
+        if self.suspended:
+            # Held until the scene is shown, since conversations need the player
+            self.pending_conversation = convo_name
+            return
         self.convo.begin_conversation(convo_name)
     
+    def begin_pending_conversation(self, dt=0):
+        if self.convo_in_progress():
+            self.clock.schedule_once(self.begin_pending_conversation, 1.0)
+            return
+        convo_name, self.pending_conversation = self.pending_conversation, None
+        if convo_name:
+            self.begin_conversation(convo_name)
+    
     def begin_background_conversation(self, convo_name):
+        if self.suspended:
+            return
         new_convo = convo.Conversation(self, background=True)
         self.background_convos.add(new_convo)
         new_convo.begin_conversation(convo_name)
@@ -230,6 +378,31 @@ class Scene(object):
             c.delete()
             self.background_convos.remove(c)
     
+    def prefetch_conversation(self, convo_name):
+        """Load everything a conversation could need ahead of time (see prefetch.py)"""
+        if convo_name not in self.prefetched_convos:
+            self.prefetched_convos.add(convo_name)
+            prefetch.prefetch(self, convo_name)
+    
+    def prefetch_near(self, point):
+        """Prefetch conversations that begin at or next to a walk path point"""
+        if self.convos_by_stand_point is None:
+            self.convos_by_stand_point = prefetch.convos_by_stand_point(self)
+        for p in prefetch.points_near(self.walkpath, point):
+            for convo_name in self.convos_by_stand_point.get(p, ()):
+                self.prefetch_conversation(convo_name)
+    
+    def is_idle(self):
+        """True if nothing in this scene will change until the player does something"""
+        if self.paused:
+            return True
+        if self.interp.interpolators or util.clock_has_events(self.clock):
+            return False
+        for act in self.actors.viewvalues():
+            if util.sprite_is_animating(act.sprite):
+                return False
+        return True
+    
     def convo_in_progress(self):
         return self.convo.convo_name is not None
     
@@ -240,16 +413,20 @@ class Scene(object):
         return False
     
     def play_music(self, name, fade=True):
-        self.handler.handler.dj.transition_to(name, fade=fade)
+        if not self.suspended:
+            self.handler.handler.dj.transition_to(name, fade=fade)
     
     def fade_music(self, time=3.0):
-        self.handler.handler.dj.fade_out(time=time)
+        if not self.suspended:
+            self.handler.handler.dj.fade_out(time=time)
     
     def play_background(self, name, fade=True):
-        self.handler.handler.background_dj.transition_to(name, fade=fade)
+        if not self.suspended:
+            self.handler.handler.background_dj.transition_to(name, fade=fade)
     
     def fade_background(self, time=3.0):
-        self.handler.handler.background_dj.fade_out(time=time)
+        if not self.suspended:
+            self.handler.handler.background_dj.fade_out(time=time)
     
     def _global_dict(self):
         return self.handler.handler.game_variables
@@ -374,25 +551,54 @@ class Scene(object):
     
     # Update/draw
     
+    @tracing.traced('Scene.update')
     def update(self, dt=0):
-        if dt > 0.2:
-            dt = 0.01
         if self.paused: 
             return
         
+        self.store_render_state()
         self.update_clock(dt)
         
         if not self.moving_camera and self.actors.has_key('main'):
             self.camera.position = self.actors["main"].sprite.position
         self.interp.update_interpolators(dt)
         self.zenforcer.update(dt)
+        self.reap_background_convos()
+    
+    def simulate(self, dt):
+        """
+        Tick a suspended scene: its clock (so script timers fire) and interpolators (so walk
+        path moves go on), but no camera, z-order, animation, sound or conversations. Moves and
+        timers still running when the scene is shown again are settled by wake().
+        """
+        self.update_clock(dt)
+        self.interp.update_interpolators(dt)
+        self.stop_animations()      # Started again by any state changes
+    
+    def reap_background_convos(self):
+        finished = [c for c in self.background_convos if not c.active]
+        for c in finished:
+            c.delete()
+            self.background_convos.remove(c)
     
-    def draw(self, dt=0):
+    @tracing.traced('Scene.draw')
+    def draw(self, alpha=1.0):
         if self.blackout:
             draw.set_color(0,0,0,1)
             draw.rect(0, 0, gamestate.norm_w, gamestate.norm_h)
+            if perfhud.active:
+                perfhud.lap('env background')
             return
         self.env.behind.blit(0,0,0)
+        
+        if alpha < 1.0 and not self.paused:
+            moved = self.apply_render_state(alpha)
+            self.draw_world()
+            self.restore_render_state(moved)
+        else:
+            self.draw_world()
+    
+    def draw_world(self):
         with camera.apply_camera(self.camera):
             if self.main_group:
                 self.main_group.x = self.x_offset
@@ -400,38 +606,71 @@ class Scene(object):
             
             with pushmatrix(pyglet.gl.glTranslatef, self.x_offset, self.y_offset, 0):
                 self.env.draw()
+                if perfhud.active:
+                    perfhud.lap('env background')
                 self.shadow.draw()
+                if perfhud.active:
+                    perfhud.lap('shadows')
                 self.batch.draw()
+                if perfhud.active:
+                    perfhud.lap('scene batch')
         
                 self.env.draw_overlay()
+                if perfhud.active:
+                    perfhud.lap('overlay')
+                self.bubble_batch.draw()
                 self.convo.draw()
-                
-                convos_to_remove = set()
                 for c in self.background_convos:
                     c.draw()
-                    if not c.active:
-                        convos_to_remove.add(c)
-                for c in convos_to_remove:
-                    c.delete()
-                    self.background_convos.remove(c)
+                if perfhud.active:
+                    perfhud.lap('convo bubbles')
+    
+    
+    # Render interpolation
+    
+    def store_render_state(self):
+        """Remember where everything was before this tick"""
+        self.last_positions = {act.sprite: act.sprite.position 
+                               for act in self.actors.viewvalues()}
+        self.last_camera_position = self.camera.position
+    
+    def apply_render_state(self, alpha):
+        """Move sprites and camera to where they were alpha of the way through the current
+        tick. Returns what was moved so that restore_render_state() can put it back."""
+        moved = []
+        for act in self.actors.viewvalues():
+            s = act.sprite
+            if s not in self.last_positions:
+                continue
+            x0, y0 = self.last_positions[s]
+            x1, y1 = s.position
+            if (x0 != x1 or y0 != y1) and (x1-x0)**2 + (y1-y0)**2 < max_interp_dist_sq:
+                moved.append((s, x1, y1))
+                s.position = (x0 + (x1-x0)*alpha, y0 + (y1-y0)*alpha)
+        
+        camera_position = self.camera.position
+        if self.last_camera_position and self.last_camera_position != camera_position:
+            x0, y0 = self.last_camera_position
+            x1, y1 = camera_position
+            self.camera.position = (x0 + (x1-x0)*alpha, y0 + (y1-y0)*alpha)
+            moved.append((self.camera, x1, y1))
+        return moved
+    
+    def restore_render_state(self, moved):
+        for obj, x, y in moved:
+            obj.position = (x, y)
     
     
     # Clock
     
     def init_clock(self):
         self.game_time = 0.0
-        self.accum_time = 0.0
         self.clock = pyglet.clock.Clock(time_function=lambda: self.game_time)
     
     def update_clock(self, dt=0):
-        # Align updates to fixed timestep 
-        self.accum_time += dt 
-        if self.accum_time > update_t * 3: 
-            self.accum_time = update_t 
-        while self.accum_time >= update_t: 
-            self.game_time += update_t
-            self.clock.tick() 
-            self.accum_time -= update_t
+        # The engine scheduler only ever passes fixed timesteps
+        self.game_time += dt
+        self.clock.tick()
     
     
     # Serialization
@@ -443,12 +682,94 @@ class Scene(object):
         self.info['camera_points'] = self.camera.dict_repr()
         return self.info
     
+    def save_repr(self):
+        """
+        Like dict_repr(), but for autosave: a new dictionary, without the walk path and camera
+        points (which don't change in play)
+        """
+        state = {k: v for k, v in self.info.viewitems() 
+                 if k not in ('actors', 'walkpath', 'camera_points')}
+        state['actors'] = {i: act.dict_repr() for i, act in self.actors.viewitems()}
+        return state
+    
+    def snapshot(self):
+        """
+        Everything about this Scene that can change in play, in memory: actors and their queued
+        actions, interpolators, conversations, clock events and the script's module variables.
+        Objects are referred to, not copied, so a snapshot can only be restored to this Scene.
+        """
+        return {
+            'game_time': self.game_time,
+            'clock': util.clock_snapshot(self.clock),
+            'actors': {i: (act, act.snapshot()) for i, act in self.actors.viewitems()},
+            'interpolators': self.interp.snapshot(),
+            'convo': self.convo.snapshot(),
+            'background_convos': [(c, c.snapshot()) for c in self.background_convos],
+            'camera': (self.camera._x, self.camera._y),
+            'moving_camera': self.moving_camera,
+            'interaction_enabled': self.interaction_enabled,
+            'blackout': self.blackout,
+            'pending_conversation': self.pending_conversation,
+            'script': self.script_variables()
+        }
+    
+    def restore_snapshot(self, snapshot):
+        self.paused = False
+        
+        # Actors, bringing back any that were removed (with new sprites)
+        hosts = {}  # Replaced sprite: new sprite, for interpolators on removed actors
+        for identifier in self.actors.keys():
+            if snapshot['actors'].get(identifier, (None,))[0] is not self.actors[identifier]:
+                self.remove_actor(identifier)
+        for identifier, (act, act_snapshot) in snapshot['actors'].viewitems():
+            if not self.actors.has_key(identifier):
+                hosts[act.revive()] = act.sprite
+                self.actors[identifier] = act
+            act.restore_snapshot(act_snapshot)
+        self.zenforcer.init_groups()
+        self.zenforcer.update()
+        self.update_shadows()
+        
+        self.camera._x, self.camera._y = snapshot['camera']
+        self.moving_camera = snapshot['moving_camera']
+        self.interaction_enabled = snapshot['interaction_enabled']
+        self.blackout = snapshot['blackout']
+        self.pending_conversation = snapshot['pending_conversation']
+        
+        self.convo.restore_snapshot(snapshot['convo'])
+        for c in self.background_convos:
+            c.delete()
+        self.background_convos = set()
+        for c, convo_snapshot in snapshot['background_convos']:
+            c.restore_snapshot(convo_snapshot)
+            self.background_convos.add(c)
+        
+        self.interp.restore(snapshot['interpolators'], hosts)
+        # Last, since restoring conversations can schedule things
+        self.game_time = snapshot['game_time']
+        util.restore_clock(self.clock, snapshot['clock'])
+        self.restore_script_variables(snapshot['script'])
+        self.last_positions = {}
+        self.last_camera_position = None
+    
+    def script_variables(self):
+        """The script module's variables (not its functions or imports)"""
+        if not hasattr(self, 'module'):
+            return {}
+        return {k: copy_value(v) for k, v in vars(self.module).iteritems()
+                if not k.startswith('__') and not callable(v) 
+                and not isinstance(v, types.ModuleType)}
+    
+    def restore_script_variables(self, variables):
+        for k, v in variables.viewitems():
+            setattr(self.module, k, copy_value(v))
+    
     def load_info(self, load_path=None):
         if load_path is None:
             with pyglet.resource.file(self.resource_path('info.json'), 'r') as info_file:
                 self.info = json.load(info_file)
         else:
-            self.info = util.load_json(load_path)
+            self.info = autosave.load(load_path, self.name)
     
     def save_info(self):
         shutil.copyfile(self.resource_path('info.json'), self.resource_path('info.json~'))
@@ -483,6 +804,7 @@ class Scene(object):
         song.play()
     
     def play_sound(self, sound_name):
-        self.sound_player.play_sound(sound_name)
+        if not self.suspended:
+            sound.play(sound_name)
                 
     
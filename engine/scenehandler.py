@@ -9,10 +9,11 @@ When a new scene is needed or the game is closed, the notify() method should be
 import os
 import json
 import functools
+import collections
 
 import pyglet
 
-import gamestate, actionsequencer, util, interpolator, scene
+import gamestate, actionsequencer, autosave, util, interpolator, mixer, scene
 
 NONE = 0
 FADE = 1
@@ -30,6 +31,18 @@ class SceneHandler(actionsequencer.ActionSequencer):
         
         self.controller = interpolator.InterpolatorController()
         self.fade_time = 1.0
+        
+        # Scene being built a slice per tick during a transition
+        self.loading_scene = None
+        self.when_loaded = None
+        self.load_stages = 4        # Loading stages (about an actor each) per tick
+        
+        # Recently exited scenes, suspended rather than destroyed: name -> (scene, texture bytes),
+        # least recently used first
+        self.scene_cache = collections.OrderedDict()
+        self.background_time = 0.0  # Game time since cached scenes were last simulated
+        self.simulating = None      # Cached scene being simulated, whose scripts can't notify()
+        self.pinned = None          # Scene the quicksave refers to, which is never exited
         self.batch = pyglet.graphics.Batch()
         
         # Build transition sprite(s)
@@ -44,6 +57,7 @@ class SceneHandler(actionsequencer.ActionSequencer):
     def set_scenes(self, *args):
         if args:
             self.scene = args[0]
+            self.handler.prepare_music(self.scene.name)
         else:
             self.scene = None
         self.scenes = args
@@ -51,16 +65,115 @@ class SceneHandler(actionsequencer.ActionSequencer):
     def __repr__(self):
         return "SceneHandler(scene_object=%s)" % str(self.scene)
     
-    def make_or_load_scene(self, scene_name):
+    def make_or_load_scene(self, scene_name, staged=False):
+        if self.scene_cache.has_key(scene_name):
+            scn = self.scene_cache.pop(scene_name)[0]
+            scn.wake()
+            if not staged:
+                scn.finish_loading()
+            return scn
         p = os.path.join(self.handler.save_path, 'autosave', scene_name)
-        if os.path.exists(p + '.json'):
-            return scene.Scene(scene_name, self, self.handler.ui, load_path=p)
+        if autosave.exists(p):
+            return scene.Scene(scene_name, self, self.handler.ui, load_path=p, staged=staged)
+        else:
+            return scene.Scene(scene_name, self, self.handler.ui, staged=staged)
+    
+    def retire(self, scn):
+        """Take a scene off screen for good, keeping it in the scene cache if there is room"""
+        budget = util.settings.scene_cache_budget*1048576
+        size = scn.texture_memory() if budget else 0
+        if not budget or size > budget:
+            self.discard(scn)
+            return
+        scn.suspend()
+        if self.scene_cache.has_key(scn.name):
+            self.discard(self.scene_cache.pop(scn.name)[0])
+        self.scene_cache[scn.name] = (scn, size)
+        while sum(entry[1] for entry in self.scene_cache.itervalues()) > budget:
+            self.discard(self.scene_cache.popitem(last=False)[1][0])
+    
+    def discard(self, scn):
+        """Exit a scene for good, or only suspend it if the quicksave still refers to it"""
+        if scn is self.pinned:
+            scn.suspend()
         else:
-            return scene.Scene(scene_name, self, self.handler.ui)
+            scn.exit()
+    
+    def pin(self, scn):
+        """Keep scn from being exited from now on, and stop keeping the scene pinned before"""
+        old, self.pinned = self.pinned, scn
+        if old is None or old is scn or old is self.scene:
+            return
+        if self.scene_cache.get(old.name, (None,))[0] is not old:
+            old.exit()
+    
+    def simulate_cached_scenes(self, dt):
+        """Tick cached scenes at settings.background_sim_rate so their world doesn't freeze"""
+        rate = util.settings.background_sim_rate
+        if not rate or not self.scene_cache:
+            self.background_time = 0.0
+            return
+        self.background_time += dt
+        step = 1.0/rate
+        while self.background_time >= step:
+            self.background_time -= step
+            for scn, size in self.scene_cache.values():
+                self.simulating = scn
+                try:
+                    scn.simulate(step)
+                finally:
+                    self.simulating = None
+    
+    def clear_scene_cache(self):
+        """Exit every cached scene, so the next visit to each loads it from its save"""
+        while self.scene_cache:
+            self.discard(self.scene_cache.popitem()[1][0])
+    
+    def in_transition(self):
+        """True while changing scenes, when the scene on screen can't be swapped out"""
+        return bool(self.controller.interpolators or self.loading_scene is not None or
+                    self.actions or self.blocking_actions or len(self.scenes) != 1)
+    
+    def show_scene(self, scn):
+        """Put a scene that is already built on screen straight away, with no transition"""
+        if scn is self.scene:
+            return
+        gamestate.event_manager.set_scene(None)
+        if self.scene.name == scn.name:
+            self.scene.exit()
+        else:
+            self.retire(self.scene)
+        if self.scene_cache.get(scn.name, (None,))[0] is scn:
+            del self.scene_cache[scn.name]
+        scn.wake()
+        scn.finish_loading()
+        self.set_scenes(scn)
+        gamestate.event_manager.set_scene(self.scene)
+    
+    def begin_loading(self, scene_name):
+        """Start building a scene in the background of the ticks to come"""
+        self.loading_scene = self.make_or_load_scene(scene_name, staged=True)
+        return self.loading_scene
+    
+    def step_loading(self):
+        if self.loading_scene.load_step(self.load_stages):
+            self.loading_scene = None
+            if self.when_loaded:
+                when_loaded, self.when_loaded = self.when_loaded, None
+                when_loaded()
+    
+    def wait_for_loading(self, ending_action=None):
+        """Transition step that holds the sequence until the loading scene is built"""
+        if self.loading_scene is None:
+            self.next_action()
+        else:
+            self.when_loaded = self.next_action
 
     # Called by a scene to load a new scene.
     # If dir is specified a sliding transition is used
     def notify(self, next_scene, direction=FADE):
+        if self.simulating is not None:
+            return      # Only the scene on screen can change scenes
         if self.handler.ui.cam is not None:
             self.handler.ui.cam.set_visible(False)
         
@@ -72,7 +185,7 @@ class SceneHandler(actionsequencer.ActionSequencer):
                 self.fade_to(next_scene)
             elif direction == NONE:
                 gamestate.event_manager.set_scene(None)
-                self.scene.exit()
+                self.retire(self.scene)
                 new_scene = self.make_or_load_scene(next_scene)
                 new_scene.transition_from(self.scene.name)
                 self.set_scenes(new_scene)
@@ -84,18 +197,22 @@ class SceneHandler(actionsequencer.ActionSequencer):
     def slide_to(self, next_scene, direction=RIGHT):
         InterpClass = interpolator.LinearInterpolator
         gamestate.event_manager.set_scene(None)
-        slide_scene = self.make_or_load_scene(next_scene)
-        slide_scene.pause(show_sprites=False)
-        self.set_scenes(self.scene, slide_scene)
-        # Determine offset
-        if direction == UP:
-            slide_scene.y_offset = gamestate.norm_h
-        elif direction == RIGHT:
-            slide_scene.x_offset = gamestate.norm_w
-        elif direction == DOWN:
-            slide_scene.y_offset = -gamestate.norm_h
-        elif direction == LEFT:
-            slide_scene.x_offset = -gamestate.norm_w
+        slide_scene = self.begin_loading(next_scene)
+        
+        def show(ending_action=None):
+            slide_scene.finish_loading()
+            slide_scene.pause(show_sprites=False)
+            self.set_scenes(self.scene, slide_scene)
+            # Determine offset
+            if direction == UP:
+                slide_scene.y_offset = gamestate.norm_h
+            elif direction == RIGHT:
+                slide_scene.x_offset = gamestate.norm_w
+            elif direction == DOWN:
+                slide_scene.y_offset = -gamestate.norm_h
+            elif direction == LEFT:
+                slide_scene.x_offset = -gamestate.norm_w
+            self.next_action()
         
         def slide(ending_action=None):
             self.scene.pause(show_sprites=False)
@@ -120,24 +237,26 @@ class SceneHandler(actionsequencer.ActionSequencer):
             
         def complete_transition(ending_action=None):
             self.handler.save()
-            self.scene.exit()
+            self.retire(self.scene)
             slide_scene.transition_from(self.scene.name)
             self.set_scenes(slide_scene)
             self.scene.resume()    
             gamestate.event_manager.set_scene(self.scene)
             self.next_action()
             
-        self.simple_sequence(slide, complete_transition)
+        self.simple_sequence(self.wait_for_loading, show, slide, complete_transition)
     
     def fade_to(self, next_scene):
         InterpClass = interpolator.LinearInterpolator
+        new_scene = self.begin_loading(next_scene)
+        
         def fade_out(ending_action=None):
             gamestate.event_manager.set_scene(None)
             interp = InterpClass(self.sprite, 'opacity', end=255, start=0, duration=self.fade_time,
                                 done_function=self.next_action)
             self.controller.add_interpolator(interp)
         
-        def complete_transition(new_scene, ending_action=None):
+        def complete_transition(ending_action=None):
             gamestate.event_manager.set_scene(self.scene)
             new_scene.resume()
             self.next_action()
@@ -145,8 +264,8 @@ class SceneHandler(actionsequencer.ActionSequencer):
         def fade_in(ending_action=None):
             # Remove scene
             self.handler.save()
-            self.scene.exit()
-            new_scene = self.make_or_load_scene(next_scene)
+            self.retire(self.scene)
+            new_scene.finish_loading()
             new_scene.transition_from(self.scene.name)
             new_scene.pause(show_sprites=False)
             
@@ -156,26 +275,39 @@ class SceneHandler(actionsequencer.ActionSequencer):
             
             self.set_scenes(new_scene)
             interp = InterpClass(self.sprite, 'opacity', end=0, start=255, duration=self.fade_time,
-                                done_function=functools.partial(complete_transition, new_scene))
+                                done_function=complete_transition)
             self.controller.add_interpolator(interp)
         
-        self.simple_sequence(fade_out, fade_in)
+        self.simple_sequence(fade_out, self.wait_for_loading, fade_in)
     
     def update(self, dt=0):
-        if dt > 0.2:
-            dt = 0.01
         self.controller.update_interpolators(dt)
+        if self.loading_scene is not None:
+            self.step_loading()
+        self.simulate_cached_scenes(dt)
         
         # DIRTY DIRTY DIRTY (to save a function call)
         self.handler.dj.update(dt)
         self.handler.background_dj.update(dt)
+        if mixer.active:
+            mixer.ducked = self.scene is not None and self.scene.convo_in_progress()
         
         for scn in self.scenes:
             scn.update(dt)
     
-    def draw_scenes(self):
+    def is_idle(self):
+        if self.controller.interpolators or self.loading_scene is not None:
+            return False
+        if self.handler.dj.interp.interpolators or self.handler.background_dj.interp.interpolators:
+            return False
+        for scn in self.scenes:
+            if not scn.is_idle():
+                return False
+        return True
+    
+    def draw_scenes(self, alpha=1.0):
         for scn in self.scenes:
-            scn.draw()
+            scn.draw(alpha)
     
     def draw(self):
         self.batch.draw()
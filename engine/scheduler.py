@@ -0,0 +1,198 @@
+"""
+Owns the timing of the main loop: simulation ticks, timers and render frames.
+
+The simulation advances in fixed steps of sim_t seconds no matter how often frames are drawn.
+Once per render frame, everything registered with schedule_render() is called with alpha, the
+fraction of a simulation step that has elapsed since the last tick. Scenes use it to draw
+sprites between their previous and current positions, so the simulation rate can be lowered
+without visible stutter.
+
+Only the scheduler is registered with pyglet.clock. Everything else should go through it:
+
+    scheduler.schedule_sim(func)        func(dt) is called once per simulation tick
+    scheduler.schedule_render(func)     func(alpha) is called once per render frame
+    scheduler.schedule_once(func, t)    func(dt) is called after t seconds of simulation time
+
+Scene scripts should use their scene's clock (myscene.clock) for timers instead, since it is
+ticked by the scene's update and therefore stops when the scene is paused or exited.
+
+Frame pacing: while running, the scheduler ticks and redraws once per vsynced frame. If
+idle_check() keeps returning True (no interpolators, no animations on screen, nothing on any
+clock), it goes idle: it takes itself off pyglet's clock and stops invalidating the window, so
+the process sleeps until the window sees input and calls wake().
+"""
+
+import os
+import time
+
+import pyglet
+
+import perfhud, util
+from util import settings
+
+class Scheduler(object):
+    def __init__(self, sim_rate=None, render_rate=None):
+        super(Scheduler, self).__init__()
+        self.sim_t = 1.0/(sim_rate or settings.sim_rate)
+        self.render_t = 1.0/(render_rate or settings.render_rate)
+
+        # Frames longer than this are treated as hitches (loading, window dragging) rather than
+        # time that needs to be caught up on
+        self.max_frame_t = 0.2
+        self.max_steps_per_frame = 4
+
+        self.accum_time = 0.0
+        self.alpha = 1.0
+        self.sim_time = 0.0
+        self.ticks = 0
+        self.clock = pyglet.clock.Clock(time_function=lambda: self.sim_time)
+
+        self.sim_functions = []
+        self.render_functions = []
+        self.running = False
+
+        # Frame pacing
+        self.window = None
+        self.idle_check = None
+        self.idle = False
+        self.idle_delay = 0.5       # Seconds idle_check() must hold before going idle
+        self.idle_time = 0.0
+
+        # CPU time accounting per pacing mode
+        self.report_interval = 5.0
+        self.cpu_time = {'active': 0.0, 'idle': 0.0}
+        self.wall_time = {'active': 0.0, 'idle': 0.0}
+        self.last_cpu = self.cpu_now()
+        self.last_wall = time.time()
+        self.last_report = self.last_wall
+
+    def schedule_sim(self, func):
+        self.sim_functions.append(func)
+
+    def unschedule_sim(self, func):
+        if func in self.sim_functions:
+            self.sim_functions.remove(func)
+
+    def schedule_render(self, func):
+        self.render_functions.append(func)
+
+    def unschedule_render(self, func):
+        if func in self.render_functions:
+            self.render_functions.remove(func)
+
+    def schedule_once(self, func, delay, *args, **kwargs):
+        self.clock.schedule_once(func, delay, *args, **kwargs)
+
+    def schedule_interval(self, func, interval, *args, **kwargs):
+        self.clock.schedule_interval(func, interval, *args, **kwargs)
+
+    def unschedule(self, func):
+        self.clock.unschedule(func)
+
+
+    # Main loop
+
+    def start(self):
+        if not self.running:
+            self.running = True
+            pyglet.clock.schedule_interval(self.tick, self.render_t)
+
+    def stop(self):
+        if self.running:
+            self.running = False
+            pyglet.clock.unschedule(self.tick)
+
+    def tick(self, dt=0):
+        """Run as many fixed simulation steps as dt covers"""
+        if dt > self.max_frame_t:
+            dt = self.sim_t
+        self.accum_time = min(self.accum_time + dt, self.sim_t*self.max_steps_per_frame)
+        if perfhud.active:
+            perfhud.start_laps(sync=False)
+        while self.accum_time >= self.sim_t:
+            self.step()
+            self.accum_time -= self.sim_t
+        if perfhud.active:
+            perfhud.lap('update', sync=False)
+        self.alpha = self.accum_time/self.sim_t
+
+        # The HUD needs every frame drawn to measure anything
+        if self.idle_check is not None and settings.idle_throttling and not perfhud.active:
+            if self.idle_check() and not util.clock_has_events(self.clock):
+                self.idle_time += dt
+                if self.idle_time >= self.idle_delay:
+                    self.enter_idle()
+            else:
+                self.idle_time = 0.0
+
+        if settings.report_frame_pacing and time.time() - self.last_report >= self.report_interval:
+            self.report()
+
+    def step(self):
+        """Advance the simulation by exactly one tick"""
+        self.sim_time += self.sim_t
+        self.ticks += 1
+        self.clock.tick()
+        for func in self.sim_functions:
+            func(self.sim_t)
+
+    def render(self):
+        for func in self.render_functions:
+            func(self.alpha)
+        if self.idle and self.window:
+            # That was the last frame until something wakes us up
+            self.window.invalid = False
+
+
+    # Frame pacing
+
+    def enter_idle(self):
+        if self.idle or not self.running:
+            return
+        self.account_cpu()
+        self.idle = True
+        pyglet.clock.unschedule(self.tick)
+        # Draw the final state exactly once
+        self.accum_time = 0.0
+        self.alpha = 1.0
+        if self.window:
+            self.window.invalid = True
+
+    def wake(self):
+        """Resume ticking and drawing every frame. Call on input or when a timer fires."""
+        self.idle_time = 0.0
+        if not self.idle:
+            return
+        self.account_cpu()
+        self.idle = False
+        if self.running:
+            pyglet.clock.schedule_interval(self.tick, self.render_t)
+        if self.window:
+            self.window.invalid = True
+
+    def cpu_now(self):
+        t = os.times()
+        return t[0] + t[1]
+
+    def account_cpu(self):
+        """Charge CPU and wall time since the last call to the current mode"""
+        mode = 'idle' if self.idle else 'active'
+        cpu, wall = self.cpu_now(), time.time()
+        self.cpu_time[mode] += cpu - self.last_cpu
+        self.wall_time[mode] += wall - self.last_wall
+        self.last_cpu, self.last_wall = cpu, wall
+
+    def cpu_usage(self):
+        """CPU seconds used per wall clock second in each mode"""
+        self.account_cpu()
+        return {mode: self.cpu_time[mode]/self.wall_time[mode] if self.wall_time[mode] else 0.0
+                for mode in self.cpu_time}
+
+    def report(self):
+        usage = self.cpu_usage()
+        print "Frame pacing: active %0.3f CPU s/s over %0.1fs, idle %0.3f CPU s/s over %0.1fs" % (
+            usage['active'], self.wall_time['active'], usage['idle'], self.wall_time['idle'])
+        self.cpu_time = {'active': 0.0, 'idle': 0.0}
+        self.wall_time = {'active': 0.0, 'idle': 0.0}
+        self.last_report = time.time()
+
@@ -0,0 +1,94 @@
+"""
+In-memory snapshots of the whole running game, for quicksave/quickload.
+
+Autosaves (see autosave.py) only hold what is needed to rebuild a scene: actor positions and
+states. A snapshot also holds everything that is in motion: interpolators part way through,
+actions queued on actors, the conversation's place and the line on screen, timers on the
+scene's clock and the random number generator, so restoring one puts the game back exactly,
+mid-walk or mid-dialogue, within a frame.
+
+Snapshots refer to the live objects (actors, conversations, sprites, scheduled functions) rather
+than copying them, so they only live in memory and only restore into the game that took them.
+SceneHandler.pin() keeps the snapshot's scene from being exited after the player leaves it.
+
+Every other scene is rolled back through its autosave: a snapshot keeps a copy of the autosave
+folder (with the cached scenes saved into it first), and restoring one exits the cached scenes
+and puts the folder back, so they load as they were when the snapshot was taken.
+
+Snapshots can't be taken or restored while scenes are changing.
+"""
+
+import copy, os, random
+
+import autosave, cam
+
+class Snapshot(object):
+    def __init__(self, game_handler):
+        super(Snapshot, self).__init__()
+        self.handler = game_handler
+        scene_handler = game_handler.scene_handler
+        ui = game_handler.ui
+
+        self.scene = scene_handler.scene
+        self.scene_state = self.scene.snapshot()
+        self.game_variables = copy.deepcopy(game_handler.game_variables)
+        self.random_state = random.getstate()
+        self.music = game_handler.dj.current_sound_name
+        self.background = game_handler.background_dj.current_sound_name
+
+        self.saves_folder = os.path.join(game_handler.save_path, 'autosave')
+        for scn, size in scene_handler.scene_cache.values():
+            autosave.save(os.path.join(self.saves_folder, scn.name), scn.save_repr(), scn.name)
+        self.saves = autosave.copy_folder(self.saves_folder)
+
+        self.inventory_items = dict(ui.inventory.items)
+        self.inventory_open = ui.inventory.isopen
+        self.inventory_visible = ui.inventory.visible
+        self.cam = None
+        if ui.cam is not None and ui.cam.visible:
+            self.cam = (ui.cam.actions, ui.cam.x, ui.cam.y, ui.cam.hide_on_click_outside)
+
+    def restore(self):
+        handler = self.handler
+        ui = handler.ui
+        if ui.cam is not None:
+            ui.cam.set_visible(False)
+        handler.scene_handler.show_scene(self.scene)
+        handler.scene_handler.clear_scene_cache()
+        autosave.restore_folder(self.saves_folder, self.saves)
+
+        handler.game_variables.clear()
+        handler.game_variables.update(copy.deepcopy(self.game_variables))
+        self.restore_inventory(ui.inventory)
+        self.scene.restore_snapshot(self.scene_state)
+        handler.save()
+        random.setstate(self.random_state)
+
+        for dj, name in ((handler.dj, self.music), (handler.background_dj, self.background)):
+            if dj.current_sound_name != name:
+                if name:
+                    dj.transition_to(name)
+                else:
+                    dj.fade_out()
+
+        if self.cam is not None:
+            actions, x, y, hide_on_click_outside = self.cam
+            ui.cam = cam.CAM(actions, x, y, ui)
+            ui.cam.hide_on_click_outside = hide_on_click_outside
+
+    def restore_inventory(self, inventory):
+        for identifier, item in inventory.items.items():
+            if self.inventory_items.get(identifier) is not item:
+                inventory.get_item(identifier)
+        for identifier, item in self.inventory_items.viewitems():
+            if not inventory.has_item(identifier):
+                item.revive()
+                inventory.put_item(item)
+        inventory.isopen = self.inventory_open
+        inventory.visible = self.inventory_visible
+
+def can_snapshot(game_handler):
+    """True if the game is somewhere a snapshot can be taken or restored"""
+    scene_handler = game_handler.scene_handler
+    return (scene_handler.scene is not None and not scene_handler.in_transition() and
+            not scene_handler.scene.paused)
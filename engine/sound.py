@@ -1,28 +1,132 @@
+"""
+Engine-wide sound bank.
+
+Every sound effect is decoded once into a static source, keyed by a logical name, and played
+through a fixed pool of players:
+
+    sound.play('klaxon')                            # sound/klaxon.ogg
+    sound.play('select_1', sound.PRIORITY_HIGH)     # registered in paths below
+    sound.play('sound/scream.wav')                  # names with an extension are resource paths
+
+Missing files are remembered too, so asking for one again costs a dictionary lookup. Compressed
+effects are decoded through pcmcache.py, so only their first load ever runs the codec.
+
+At most voice_limit sounds play at once, and at most instance_limit copies of any one sound.
+When every voice is busy, a new sound takes over the lowest priority, oldest voice, or is
+dropped if everything playing matters more than it does.
+"""
+
+import os
+
 import pyglet
 
-import util
+import mixer, pcmcache
+
+PRIORITY_LOW = 0
+PRIORITY_NORMAL = 1
+PRIORITY_HIGH = 2       # UI feedback
+
+voice_limit = 8
+instance_limit = 2
+
+# Logical names that aren't sound/<name>.ogg
+paths = {
+    'give': 'sound/give.wav',
+    'take': 'sound/take.wav',
+    'options_appear': 'sound/options_appear.wav',
+}
+for i in xrange(1, 7):
+    paths['select_%d' % i] = 'sound/select_%d.wav' % i
+
+sources = {}    # Logical name: StaticSource, or None if there is no such file
+
+class Voice(object):
+    __slots__ = ('player', 'name', 'priority', 'order')
+
+    def __init__(self):
+        super(Voice, self).__init__()
+        self.player = mixer.player('sfx')
+        self.name = None
+        self.priority = PRIORITY_LOW
+        self.order = 0
+
+    busy = property(lambda self: self.player.source is not None)
+
+    def start(self, name, source, priority, order, volume, bus):
+        if self.busy:
+            self.player.next()
+        if mixer.active:
+            self.player.bus = bus
+            self.player.priority = priority
+        self.name = name
+        self.priority = priority
+        self.order = order
+        self.player.volume = volume
+        self.player.queue(source)
+        self.player.play()
 
-class Sound(object):
+voices = []
+_plays = 0      # Counts play() calls, to tell which voice is oldest
 
-    def __init__ (self, volume = 1.0):
-        self.volume = volume
+def path_for(name):
+    if paths.has_key(name):
+        return paths[name]
+    if os.path.splitext(name)[1]:
+        return name
+    return 'sound/%s.ogg' % name
 
-        self.player = pyglet.media.Player()
-        self.player.volume = self.volume
-        self.player.eos_action = 'stop'
+def load(name, optional=False):
+    """
+    The static source for a sound, or None if it doesn't exist. Missing sounds are reported
+    unless they are optional, like the speaking sounds most actors don't have.
+    """
+    if not sources.has_key(name):
+        try:
+            sources[name] = pcmcache.load(path_for(name))
+        except pyglet.resource.ResourceNotFoundException:
+            if not optional:
+                print "Missing sound %s (%s)" % (name, path_for(name))
+            sources[name] = None
+    return sources[name]
 
-        self.path = util.respath_func_with_base_path("sound")
+def preload(*names):
+    for name in names:
+        load(name)
 
-        self.sound_cache = {}
+def _choose_voice(name, priority):
+    busy = [v for v in voices if v.busy]
+    same = [v for v in busy if v.name == name]
+    if len(same) >= instance_limit:
+        return min(same, key=lambda v: v.order)
+    for v in voices:
+        if not v.busy:
+            return v
+    if len(voices) < voice_limit:
+        voices.append(Voice())
+        return voices[-1]
+    victim = min(busy, key=lambda v: (v.priority, v.order))
+    if victim.priority > priority:
+        return None
+    return victim
 
+def play(name, priority=PRIORITY_NORMAL, volume=1.0, bus='sfx', optional=False):
+    """
+    Play a sound. Returns False if it doesn't exist or was dropped for lack of voices.
+    bus is the software mixer bus ('sfx' or 'voice'), if the mixer is on. optional is as for
+    load().
+    """
+    global _plays
+    source = load(name, optional)
+    if source is None:
+        return False
+    voice = _choose_voice(name, priority)
+    if voice is None:
+        return False
+    _plays += 1
+    voice.start(name, source, priority, _plays, volume, bus)
+    return True
 
-    def get_sound(self, sound_name):
-        if not self.sound_cache.has_key(sound_name):
-            self.sound_cache[sound_name] = pyglet.resource.media('sound/%s.ogg' % sound_name,
-                                                                 streaming=False)
-        return self.sound_cache[sound_name]
-    
-    def play_sound(self, sound_name, volume = 1.0):
-        self.get_sound(sound_name).play()
-    
-    
+def stop_all():
+    for v in voices:
+        if v.busy:
+            v.player.next()
@@ -1,4 +1,4 @@
-import pyglet, functools, json, os, random
+import pyglet, copy, functools, json, os, random
 
 # Easy access if you just import util
 import const
@@ -204,6 +204,24 @@ def mkdir_if_absent(path):
     if not os.path.exists(path):
         os.mkdir(path)
 
+def cache_path(*args):
+    """Folder under settings.cache_path, created if necessary. None if caching is off."""
+    if not settings.cache_path:
+        return None
+    path = os.path.join(settings.cache_path, *args)
+    if not os.path.exists(path):
+        os.makedirs(path)
+    return path
+
+def write_file_atomic(path, data):
+    """Write data so that readers see either the old file or the new one, never part of one"""
+    tmp_path = '%s.tmp' % path
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    if os.name == 'nt' and os.path.exists(path):
+        os.remove(path)
+    os.rename(tmp_path, path)
+
 def load_json(path):
     with open('%s.json' % path, 'r') as f:
         return json.load(f)
@@ -242,3 +260,37 @@ def image_alpha_at_point(img, x, y):
 # caution - broken. doesn't account for anchors
 def intersects_sprite(x, y, sprite):
     return x > sprite.x and y > sprite.y and x < sprite.x + sprite.width and y < sprite.y + sprite.height
+
+def clock_has_events(clock):
+    """True if a pyglet Clock has anything scheduled on it"""
+    return bool(clock._schedule_items or clock._schedule_interval_items)
+
+def clear_clock(clock):
+    """Unschedule everything on a pyglet Clock"""
+    clock._schedule_items = []
+    clock._schedule_interval_items = []
+
+def clock_snapshot(clock):
+    """Copy of a pyglet Clock's time and everything scheduled on it, for restore_clock()"""
+    return (clock.last_ts, clock.cumulative_time, list(clock.times),
+            [copy.copy(item) for item in clock._schedule_items],
+            [copy.copy(item) for item in clock._schedule_interval_items])
+
+def restore_clock(clock, snapshot):
+    """Put a clock back as clock_snapshot() found it, replacing whatever is scheduled now"""
+    last_ts, cumulative_time, times, items, interval_items = snapshot
+    clock.last_ts = last_ts
+    clock.cumulative_time = cumulative_time
+    clock.times = list(times)
+    clock._schedule_items = [copy.copy(item) for item in items]
+    clock._schedule_interval_items = [copy.copy(item) for item in interval_items]
+
+def sprite_is_animating(sprite):
+    """True if a visible sprite is showing an animation that has not run out of frames"""
+    if not sprite.visible:
+        return False
+    try:
+        frames = sprite.image.frames
+    except AttributeError:
+        return False
+    return frames[sprite._frame_index].duration is not None
@@ -1,2 +1,47 @@
 fullscreen = False
 resources_path = 'resources'
+# Where compiled/decoded resources are cached between runs. GameHandler sets this to a folder
+# in the save directory if it is left as None.
+cache_path = None
+
+# Simulation ticks per second. Rendering interpolates between ticks, so low-end
+# machines can drop this (e.g. to 30) without visible stutter.
+sim_rate = 120
+# Render frames per second
+render_rate = 60
+
+# Stop ticking and redrawing when nothing on screen can change until the next input event
+idle_throttling = True
+# Print CPU time per second spent in the active and idle frame pacing modes
+report_frame_pacing = False
+
+# Autosave format: 'binary' (one file per save folder, see engine/savefile.py) or 'json'
+# (a file per scene). Either format loads saves made in the other.
+save_format = 'binary'
+compress_saves = True
+
+# Megabytes of textures that exited scenes may keep, so that going back to one is instant
+# instead of a reload from the autosave. 0 destroys scenes on exit.
+scene_cache_budget = 96
+# Ticks per second for cached scenes, which keep their timers and walk path moves going
+# without drawing, animating or playing sound. 0 freezes them.
+background_sim_rate = 5
+
+# Mix all sound in a background thread (needs NumPy) instead of giving each sound an OpenAL
+# source. Adds bus volumes, music ducking during conversations and a cap on mixed voices.
+software_mixer = False
+
+# Key (a pyglet.window.key name) that shows/hides the performance HUD. None turns the HUD off,
+# along with the texture and sprite tracking it does from startup.
+perf_hud_key = 'F3'
+# Wait for the GPU after each subsystem while the HUD is up, so draw times are attributed properly
+perf_hud_sync_gpu = True
+
+# Keys that keep a snapshot of the game in memory and go back to it
+quicksave_key = 'F5'
+quickload_key = 'F9'
+
+# Record trace spans from startup instead of waiting for trace_key
+trace_at_start = False
+# Key that starts tracing, then dumps the trace buffer to a Chrome trace JSON file
+trace_key = 'F4'
@@ -0,0 +1,139 @@
+"""
+Timing spans for engine hot paths, viewable as a timeline in chrome://tracing or Perfetto.
+
+    with tracing.span('Scene.__init__ load_actors'):
+        ...
+
+    @tracing.traced('Scene.update')
+    def update(self, dt=0):
+        ...
+
+Spans go into a ring buffer allocated once up front, so the newest `capacity` spans are kept
+and nothing is allocated per span beyond the span object itself. While tracing is disabled,
+span() returns a shared do-nothing context manager and traced functions make one extra call.
+
+settings.trace_key starts tracing and, once started, dumps the buffer to a Chrome trace JSON
+file. Anything still in the buffer is also dumped at exit.
+"""
+
+import functools, json, thread, time, timeit
+
+enabled = False
+timer = timeit.default_timer
+epoch = timer()
+
+capacity = 1 << 16
+_names = [None]*capacity
+_starts = [0.0]*capacity
+_durations = [0.0]*capacity
+_threads = [0]*capacity
+_next = 0           # Index of the next slot to write
+_count = 0          # Number of filled slots
+
+def record(name, start, end):
+    global _next, _count
+    i = _next
+    _names[i] = name
+    _starts[i] = start
+    _durations[i] = end - start
+    _threads[i] = thread.get_ident()
+    _next = (i + 1) % capacity
+    if _count < capacity:
+        _count += 1
+
+class _Span(object):
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = timer()
+        return self
+
+    def __exit__(self, *exc_info):
+        record(self.name, self.start, timer())
+        return False
+
+class _NullSpan(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_null_span = _NullSpan()
+
+def span(name):
+    if enabled:
+        return _Span(name)
+    return _null_span
+
+def traced(name):
+    """Decorator that records every call of a function as a span"""
+    def decorator(func):
+        @functools.wraps(func)
+        def traced_func(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            start = timer()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(name, start, timer())
+        return traced_func
+    return decorator
+
+
+# Control
+
+def start():
+    global enabled
+    enabled = True
+
+def stop():
+    global enabled
+    enabled = False
+
+def clear():
+    global _next, _count
+    _next = 0
+    _count = 0
+
+def events():
+    """Buffered spans as Chrome trace events, oldest first"""
+    first = (_next - _count) % capacity
+    result = []
+    for j in xrange(_count):
+        i = (first + j) % capacity
+        result.append({
+            'name': _names[i],
+            'ph': 'X',
+            'ts': (_starts[i] - epoch)*1e6,
+            'dur': _durations[i]*1e6,
+            'pid': 1,
+            'tid': _threads[i],
+        })
+    return result
+
+def dump(path=None):
+    """Write buffered spans to a Chrome trace / Perfetto JSON file and return its path"""
+    path = path or time.strftime('trace-%Y%m%d-%H%M%S.json')
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': events(), 'displayTimeUnit': 'ms'}, f)
+    print "Wrote %d trace spans to %s" % (_count, path)
+    return path
+
+def on_trace_key():
+    """First press starts tracing, later presses dump what has been recorded so far"""
+    if enabled:
+        dump()
+    else:
+        start()
+        print "Tracing started"
+
+def dump_at_exit():
+    if _count:
+        dump()
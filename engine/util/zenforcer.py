@@ -1,5 +1,7 @@
 import pyglet
 
+import tracing
+
 class ZEnforcer(object):
     """Ensure that sprites maintain z-order based on some sort key"""
     def __init__(self, parent_group, sprite_iterator, sort_function):
@@ -58,6 +60,7 @@ class ZEnforcer(object):
         g1, g2 = B.group, C.group
         B.group, C.group = g2, g1
     
+    @tracing.traced('ZEnforcer.update')
     def update(self, dt=0):
         for s in self.sprite_iterator():
             if s.__above and s.__above.y > s.y:
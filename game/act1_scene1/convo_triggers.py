@@ -52,5 +52,5 @@ def handle_thermostat():
         state.myscene.actors['thermostat'].update_state('rising')
         # Nicole complains!
         tourist = state.myscene.actors['tourist']
-        pyglet.clock.schedule_once(make_dt_wrapper(tourist.prepare_walkpath_move), 5, "tourist_complain")
-        pyglet.clock.schedule_once(tourist.next_action, 5)
+        state.myscene.clock.schedule_once(make_dt_wrapper(tourist.prepare_walkpath_move), 5, "tourist_complain")
+        state.myscene.clock.schedule_once(tourist.next_action, 5)
@@ -32,8 +32,8 @@ def levity_walk(actor, point):
             state.myscene.global_dict['levity_direction'] = 'left'
             next_point = "levity_4"
         #levity.prepare_walkpath_move(next_point)
-        pyglet.clock.schedule_once(make_dt_wrapper(levity.prepare_walkpath_move), 1, next_point)
-        pyglet.clock.schedule_once(levity.next_action, 60)
+        state.myscene.clock.schedule_once(make_dt_wrapper(levity.prepare_walkpath_move), 1, next_point)
+        state.myscene.clock.schedule_once(levity.next_action, 60)
         
     else:
         if point == "levity_1":
@@ -77,5 +77,5 @@ def potato_roll(actor, point):
             next_index = 1
         next_point = "potato_%d" % next_index
         print "Potato rolling from %s to %s" % (point, next_point)
-        pyglet.clock.schedule_once(make_dt_wrapper(actor.prepare_walkpath_move), 0, next_point)
-        pyglet.clock.schedule_once(make_dt_wrapper(actor.next_action), 0)
+        state.myscene.clock.schedule_once(make_dt_wrapper(actor.prepare_walkpath_move), 0, next_point)
+        state.myscene.clock.schedule_once(make_dt_wrapper(actor.next_action), 0)
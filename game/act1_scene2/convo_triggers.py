@@ -70,7 +70,7 @@ def potato_adventure():
 def ball_drop():
     #pause for a moment, then shake it off
     state.myscene.actors['potato_drop'].prepare_walkpath_move('shake_4')
-    pyglet.clock.schedule_once(make_dt_wrapper(state.myscene.actors['potato_drop'].next_action), 3)
+    state.myscene.clock.schedule_once(make_dt_wrapper(state.myscene.actors['potato_drop'].next_action), 3)
     state.myscene.actors['potato_drop'].update_state('run')
     state.myscene.begin_conversation('surprise_note')
     
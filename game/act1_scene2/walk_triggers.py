@@ -39,12 +39,12 @@ def inga_walk(actor, point):
             
             
 def kidnap_stanislav():
-    pyglet.resource.media('sound/lights_out.ogg', streaming=False).play()
+    state.myscene.play_sound('sound/lights_out.ogg')
     state.myscene.blackout = True
     state.myscene.fade_music(0)
     
     def scream(dt=0):
-        pyglet.resource.media('sound/scream.wav', streaming=False).play()
+        state.myscene.play_sound('sound/scream.wav')
     
     def flash_drag_away(dt=0):
         sb = state.myscene.actors['sneaky_bastard_1']
@@ -59,7 +59,7 @@ def kidnap_stanislav():
     
     def re_blackout(dt=0):
         state.myscene.blackout = True
-        pyglet.resource.media('sound/clonk.mp3', streaming=False).play()
+        state.myscene.play_sound('sound/clonk.mp3')
     
     def un_blackout(dt=0):
         mor = state.myscene.actors['moritz']
@@ -74,10 +74,10 @@ def kidnap_stanislav():
         state.myscene.remove_actor('sneaky_bastard_1')
         state.myscene.blackout = False
     
-    pyglet.clock.schedule_once(scream, 1.0)
-    pyglet.clock.schedule_once(flash_drag_away, 2.5)
-    pyglet.clock.schedule_once(re_blackout, 4.0)
-    pyglet.clock.schedule_once(un_blackout, 7.0)
+    state.myscene.clock.schedule_once(scream, 1.0)
+    state.myscene.clock.schedule_once(flash_drag_away, 2.5)
+    state.myscene.clock.schedule_once(re_blackout, 4.0)
+    state.myscene.clock.schedule_once(un_blackout, 7.0)
 
 @state.handles_walk('tourist')
 def tourist_to_inga(actor, point):
@@ -96,16 +96,15 @@ def potato_roll(actor, point):
 @state.handles_walk('potato_drop')
 def potato_drop(actor, point):
     if point == "potato_drop_end":
-        squeak_snd = pyglet.resource.media('sound/squeak.wav', streaming=False)
-        squeak_snd.play()
+        state.myscene.play_sound('sound/squeak.wav')
         
         actor.walk_speed = 200
         #stanislav is surprised at the critter
-        pyglet.clock.schedule_once(make_dt_wrapper(state.myscene.begin_conversation), 1, "a_visitor")
+        state.myscene.clock.schedule_once(make_dt_wrapper(state.myscene.begin_conversation), 1, "a_visitor")
     
         actor.update_state('run_note_4')
  
     if point == "shake_4":
         actor.prepare_walkpath_move('potato_exit')
-        pyglet.clock.schedule_once(make_dt_wrapper(actor.next_action), 3)
+        state.myscene.clock.schedule_once(make_dt_wrapper(actor.next_action), 3)
         actor.update_state('run_4')
@@ -32,18 +32,18 @@ def init(fresh=True):
         return show
     
     for t in xrange(1, 4):
-        pyglet.clock.schedule_once(show_n(t+1), 3.0*t)
+        myscene.clock.schedule_once(show_n(t+1), 3.0*t)
     
     def shakeshakeshake(dt=0):
         myscene.play_sound('space_train_explode')
         interp = Random2DInterpolator(myscene.camera, 'position', 20.0, duration=9.0)
         myscene.add_interpolator(interp)
     
-    pyglet.clock.schedule_once(shakeshakeshake, 3.0)
+    myscene.clock.schedule_once(shakeshakeshake, 3.0)
     
     def next(dt=0):
         myscene.handler.notify('credits2')
-    pyglet.clock.schedule_once(next, 12)
+    myscene.clock.schedule_once(next, 12)
     
 
 def transition_from(old_scene):
@@ -56,9 +56,9 @@ def begin(dt=0):
          "--Yogi Berra (1925-2014)"
     t = spawn_text(q1, 0.045, 0.45, 0.75)
     
-    pyglet.clock.schedule_once(functools.partial(spawn_text, q2, 0.045, 0.55, 0.25), 4.0)
+    myscene.clock.schedule_once(functools.partial(spawn_text, q2, 0.045, 0.55, 0.25), 4.0)
     
-    pyglet.clock.schedule_once(show_letter, t+7.0)
+    myscene.clock.schedule_once(show_letter, t+7.0)
 
 def show_letter(dt=0):
     global can_continue
@@ -86,7 +86,7 @@ def spawn_text(text, size, x, y, dt=0):
         myscene.interp.add_interpolator(interp)
     
     start_text()
-    pyglet.clock.schedule_once(end_text, wait_time(text)+3.0)
+    myscene.clock.schedule_once(end_text, wait_time(text)+3.0)
     return wait_time(text)+3
 
 def handle_event(event, *args):
@@ -25,7 +25,7 @@ def init(fresh=True):
     with pyglet.resource.file(myscene.resource_path('credits.yaml'), 'r') as f:
         t = 0
         for item in yaml.load(f):
-            pyglet.clock.schedule_once(functools.partial(show_team_member, item['name'], item['role']), t)
+            myscene.clock.schedule_once(functools.partial(show_team_member, item['name'], item['role']), t)
             t += 6.0
 
 def show_team_member(name, role, dt=0):
@@ -33,7 +33,7 @@ def show_team_member(name, role, dt=0):
     a.update_state(name.split()[0].lower())
     
     px = random.random()*0.3+0.05
-    a.x = random.randint(150, norm_w-150)
+    random.randint(150, norm_w-150)     # Was a.x, which never moved the picture
     if random.randint(0, 1) == 1:
         py = random.random()*0.2+0.6
         a.sprite.y = random.randint(150, norm_h/2-150)
@@ -54,7 +54,7 @@ def show_team_member(name, role, dt=0):
                                     name="fade2", duration=2.0)
         myscene.add_interpolator(interp2)
     
-    pyglet.clock.schedule_once(fade_out, 4.0)
+    myscene.clock.schedule_once(fade_out, 4.0)
 
 def spawn_text(text, size, x, y, dt=0):
     l = pyglet.text.Label(text, font_name=['Verdana', 'Helvetica'], font_size=norm_h*size, 
@@ -75,7 +75,7 @@ def spawn_text(text, size, x, y, dt=0):
         myscene.interp.add_interpolator(interp)
     
     start_text()
-    pyglet.clock.schedule_once(end_text, 4.0)
+    myscene.clock.schedule_once(end_text, 4.0)
     return wait_time(text)+3
 
 def transition_from(old_scene):
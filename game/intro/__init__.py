@@ -18,7 +18,7 @@ def init(fresh=True):
     note_actor = myscene.new_actor('intro_billboards', 'note', attrs=dict(x=640, y=360, opacity=0))
     
     myscene.play_music('intro', fade=False)
-    pyglet.clock.schedule_once(begin, 2.0)
+    myscene.clock.schedule_once(begin, 2.0)
     
     # t = show_sequence(sequence)
     myscene.ui.inventory.visible = False
@@ -29,7 +29,7 @@ def init(fresh=True):
         interp = LinearInterpolator(note_actor.sprite, 'opacity', start=0, end=255, name="fade", duration=3.0)
         myscene.interp.add_interpolator(interp)
     
-    pyglet.clock.schedule_once(show_letter, 14.0)
+    myscene.clock.schedule_once(show_letter, 14.0)
 
 def transition_from(old_scene):
     pass
@@ -41,7 +41,7 @@ def begin(dt=0):
          "--Yogi Berra (1925-2014)"
     t = spawn_text(q1, 0.045, 0.45, 0.75)
     
-    pyglet.clock.schedule_once(functools.partial(spawn_text, q2, 0.045, 0.55, 0.25), 5.0)
+    myscene.clock.schedule_once(functools.partial(spawn_text, q2, 0.045, 0.55, 0.25), 5.0)
 
 
 def spawn_text(text, size, x, y, dt=0):
@@ -63,7 +63,7 @@ def spawn_text(text, size, x, y, dt=0):
         myscene.interp.add_interpolator(interp)
     
     start_text()
-    pyglet.clock.schedule_once(end_text, wait_time(text)+3.0)
+    myscene.clock.schedule_once(end_text, wait_time(text)+3.0)
     return wait_time(text)+3
 
 def handle_event(event, *args):